@@ -0,0 +1,243 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent))
+
+import argparse
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from application.pipeline import *
+from application.ifsc_chess.game_session import GameSession
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+CHECKPOINT_FILE = "frames.json"
+PGN_FILE = "game.pgn"
+SUMMARY_FILE = "batch_summary.json"
+
+def discover_games(source):
+    """
+    Lists the games of an archive.
+    source: a directory, where every directory holding images is a game whose frames are its images
+    in name order, or a JSON lines manifest with the "game_id" and the "frames" (image paths) of each game.
+    Returns: a list of (game id, frame paths), the game id being the relative path of its directory.
+    """
+    source = Path(source)
+    if source.is_file():
+        games = []
+        with open(source) as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    games.append((entry["game_id"], [str(source.parent / frame) for frame in entry["frames"]]))
+    else:
+        frames = {}
+        for path in sorted(source.rglob("*")):
+            if path.suffix.lower() in IMAGE_EXTENSIONS and path.is_file():
+                frames.setdefault(path.parent.relative_to(source).as_posix(), []).append(str(path))
+        games = list(frames.items())
+    for game_id, _ in games:
+        if Path(game_id).is_absolute() or ".." in Path(game_id).parts:
+            raise ValueError(f"[error] Invalid game id '{game_id}', it must be a relative path.")
+    return games
+
+def load_checkpoint(directory, game_id):
+    """Returns the checkpoint of a game, or a new one if the game was never started."""
+    try:
+        with open(Path(directory) / CHECKPOINT_FILE) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {"game_id": game_id, "status": "running", "frames": [], "session": None}
+
+def process_game(game_id, frames, output_directory, detector: Detector, cache: ResultCache = None, should_stop=None):
+    """
+    Recognizes a whole game, resuming from its checkpoint.
+    After each frame, the result of every frame so far and the state of the session are saved
+    to the frames.json checkpoint of the game, so a killed run restarts after the last finished frame.
+    A frame that can't be recognized is recorded as an error and the game goes on from the next one.
+    should_stop: function checked before each frame, the game is left unfinished when it returns True.
+    Returns: a summary with the number of frames processed now and before, the frame errors by type and the moves.
+    """
+    directory = Path(output_directory) / game_id
+    directory.mkdir(parents=True, exist_ok=True)
+    checkpoint = load_checkpoint(directory, game_id)
+    resumed_from = len(checkpoint["frames"])
+    if checkpoint["status"] != "finished":
+        session = GameSession.from_checkpoint(checkpoint["session"]) if checkpoint["session"] else GameSession(game_id)
+        debug_writer.start_game(game_id)
+        for frame in frames[resumed_from:]:
+            if should_stop is not None and should_stop():
+                return {"game_id": game_id, "status": "interrupted"}
+            start = time.perf_counter()
+            try:
+                result = session.update(generate_board_matrix_from_image(frame, detector, cache))
+                error_type = "rejected_position" if result["status"] == "error" else None
+            except Exception as error: # GridDetectionError, no board lines found, unreadable image...
+                result = session.result("error", error=str(error))
+                error_type = type(error).__name__
+            checkpoint["frames"].append({
+                "frame": frame,
+                "status": result["status"],
+                "moves": result["moves"],
+                "fen": result["fen"],
+                "error": result["error"],
+                "error_type": error_type,
+                "seconds": time.perf_counter() - start,
+            })
+            checkpoint["session"] = session.checkpoint()
+            write_json_atomically(directory / CHECKPOINT_FILE, checkpoint)
+        (directory / PGN_FILE).write_text(session.pgn())
+        checkpoint["status"] = "finished"
+        write_json_atomically(directory / CHECKPOINT_FILE, checkpoint)
+
+    return {
+        "game_id": game_id,
+        "status": "finished",
+        "frames": len(frames),
+        "processed": len(frames) - resumed_from,
+        "resumed_from": resumed_from,
+        "frame_errors": dict(Counter(frame["error_type"] for frame in checkpoint["frames"] if frame["error_type"])),
+        "moves": len(checkpoint["session"]["moves"]) if checkpoint["session"] else 0,
+    }
+
+
+# State of each worker process, created once by _init_worker
+_worker = {}
+
+def _init_worker(detector_backend, detector_args, cache_directory, debug=None):
+    if debug is not None:
+        debug_writer.enable(**debug)
+    _worker["detector"] = load_detector(detector_backend, *detector_args)
+    _worker["cache"] = ResultCache(cache_directory) if cache_directory is not None else None
+    _worker["parent"] = os.getppid()
+
+def _process_game(game_id, frames, output_directory):
+    # if the batch is killed, its workers would go on with their games and race with the next run
+    summary = process_game(game_id, frames, output_directory, _worker["detector"], _worker["cache"],
+                           should_stop=lambda: os.getppid() != _worker["parent"])
+    if summary["status"] == "interrupted":
+        os._exit(1)
+    return summary
+
+def run_batch(games, output_directory, detector_backend=DETECTOR_BACKEND, detector_args=(), cache=None, workers=1, max_attempts=2):
+    """
+    Recognizes every game of the archive, one game per worker process at a time, see process_game.
+    Games already finished by a previous run are skipped, and unfinished ones resume from their checkpoint.
+    An exception raised by a game marks only that game as failed. If a worker process dies, the pool
+    is restarted and the games it was running are tried again, up to max_attempts times.
+    If the debug writer is enabled, each worker process writes the overlays of its games with the same settings.
+    Returns: the summary of each game, in the order they finished.
+    """
+    cache_directory = str(cache.directory) if cache is not None else None
+    pending = list(reversed(games))
+    attempts = Counter()
+    summaries = []
+
+    def failed(game_id, error):
+        print(f"[error] [{game_id}] {type(error).__name__}: {error}")
+        return {"game_id": game_id, "status": "failed", "error": str(error), "error_type": type(error).__name__}
+
+    if workers <= 1:
+        _init_worker(detector_backend, tuple(detector_args), cache_directory)
+        while pending:
+            game_id, frames = pending.pop()
+            try:
+                summaries.append(process_game(game_id, frames, output_directory, _worker["detector"], _worker["cache"]))
+            except Exception as error:
+                summaries.append(failed(game_id, error))
+        return summaries
+
+    while pending:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       initargs=(detector_backend, tuple(detector_args), cache_directory, debug_writer.settings()))
+        running = {}
+        try:
+            while pending or running:
+                # a couple of games queued per worker, without submitting the whole archive at once
+                while pending and len(running) < 2 * workers:
+                    game_id, frames = pending.pop()
+                    attempts[game_id] += 1
+                    running[executor.submit(_process_game, game_id, frames, output_directory)] = (game_id, frames)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    game_id, frames = running[future]
+                    try:
+                        summary = future.result()
+                    except BrokenProcessPool:
+                        raise
+                    except Exception as error:
+                        summary = failed(game_id, error)
+                    del running[future]
+                    summaries.append(summary)
+        except BrokenProcessPool as error:
+            print(f"[error] A worker process died, restarting the pool: {error}")
+            for game_id, frames in running.values():
+                if attempts[game_id] < max_attempts:
+                    pending.append((game_id, frames))
+                else:
+                    summaries.append(failed(game_id, error))
+        finally:
+            executor.shutdown(cancel_futures=True)
+    return summaries
+
+def batch_report(summaries, elapsed):
+    """Returns the totals of a batch: games and frames per status, throughput and the failures by type."""
+    finished = [summary for summary in summaries if summary["status"] == "finished"]
+    processed_games = [summary for summary in finished if summary["processed"] > 0]
+    frames = sum(summary["processed"] for summary in finished)
+    frame_errors = Counter()
+    for summary in finished:
+        frame_errors.update(summary["frame_errors"])
+    return {
+        "games": len(summaries),
+        "finished": len(finished),
+        "failed": len(summaries) - len(finished),
+        "already_finished": sum(summary["processed"] == 0 and summary["resumed_from"] > 0 for summary in finished),
+        "resumed": sum(summary["processed"] > 0 and summary["resumed_from"] > 0 for summary in finished),
+        "frames_processed": frames,
+        "frames_skipped": sum(summary["resumed_from"] for summary in finished),
+        "seconds": elapsed,
+        "games_per_hour": len(processed_games) / elapsed * 3600 if elapsed > 0 else 0.0,
+        "frames_per_second": frames / elapsed if elapsed > 0 else 0.0,
+        "game_failures": dict(Counter(summary["error_type"] for summary in summaries if summary["status"] == "failed")),
+        "frame_errors": dict(frame_errors),
+    }
+
+def print_batch_report(report):
+    print("================ BATCH =================")
+    print(f"games: {report['games']} ({report['finished']} finished, {report['failed']} failed, "
+          f"{report['already_finished']} already finished, {report['resumed']} resumed)")
+    print(f"frames: {report['frames_processed']} processed, {report['frames_skipped']} done by previous runs")
+    print(f"throughput: {report['games_per_hour']:.1f} games/hour, {report['frames_per_second']:.2f} frames/s in {report['seconds']:.1f} s")
+    for kind in ("game_failures", "frame_errors"):
+        for error_type, count in sorted(report[kind].items(), key=lambda item: -item[1]):
+            print(f"{kind.replace('_', ' ')}: {error_type} x{count}")
+    print("========================================")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recognizes every game of an archive of photo folders, resuming unfinished runs.")
+    parser.add_argument("source", help="directory with a folder of images per game, or a JSON lines manifest of the games")
+    parser.add_argument("output", help="directory for the PGN and the per frame results of each game")
+    parser.add_argument("--workers", type=int, default=1, help="number of games processed at once, each in its own process")
+    parser.add_argument("--backend", default=DETECTOR_BACKEND, help="piece detection backend")
+    parser.add_argument("--no-cache", action="store_true", help="don't read or write the results cache")
+    parser.add_argument("--debug-output", metavar="DIR", help="write the debug overlays of each game to a directory")
+    parser.add_argument("--contact-sheet", action="store_true", help="with --debug-output, write a single contact sheet of thumbnails per game")
+    args = parser.parse_args()
+
+    games = discover_games(args.source)
+    print(f"[info] {len(games)} games found in '{args.source}'")
+    Path(args.output).mkdir(parents=True, exist_ok=True)
+    if args.debug_output is not None:
+        debug_writer.enable(args.debug_output, args.contact_sheet)
+    start = time.perf_counter()
+    summaries = run_batch(games, args.output, args.backend, cache=None if args.no_cache else ResultCache(), workers=args.workers)
+    report = batch_report(summaries, time.perf_counter() - start)
+    write_json_atomically(Path(args.output) / SUMMARY_FILE, {"report": report, "games": summaries})
+    print_batch_report(report)
+    if debug_writer.enabled:
+        debug_writer.disable()
+        debug_writer.report()
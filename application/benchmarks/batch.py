@@ -0,0 +1,71 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+
+from application.benchmarks.server import *
+from application.batch import *
+
+def build_archive(directory, frames, games):
+    """
+    Links the test game frames into a folder per game. The last game gets an unreadable frame
+    in the middle, which must be recorded as an error without stopping the game or the batch.
+    """
+    for index in range(games):
+        game_directory = Path(directory) / f"archive/game-{index + 1:03d}"
+        game_directory.mkdir(parents=True)
+        for image_path, _ in frames:
+            os.symlink(image_path, game_directory / Path(image_path).name)
+        if index == games - 1:
+            broken = game_directory / Path(frames[len(frames) // 2][0]).name
+            broken.unlink()
+            broken.write_bytes(b"not an image")
+    return Path(directory) / "archive"
+
+def count_checkpointed_frames(output_directory):
+    total = 0
+    for path in Path(output_directory).rglob(CHECKPOINT_FILE):
+        with open(path) as file:
+            total += len(json.load(file)["frames"])
+    return total
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs the batch processor on an archive of copies of the test game, killing and resuming it.")
+    parser.add_argument("--games", type=int, default=3, help="number of copies of the test game")
+    parser.add_argument("--workers", type=int, default=2, help="games processed at once")
+    parser.add_argument("--kill-after", type=float, default=15.0, help="seconds before the first run is killed")
+    parser.add_argument("--limit", type=int, default=None, help="use only the first N test images")
+    args = parser.parse_args()
+
+    frames = test_game_frames(args.limit)
+    # the worker processes are forked, so they inherit the fake backend registered here
+    detector = FakeDetector(frames, test_game_positions(), call_latency=0.05, image_latency=0.0)
+    DETECTOR_BACKENDS["fake"] = lambda: detector
+    expected = TEST_GAME_MOVES[:frames[-1][1]]
+
+    with tempfile.TemporaryDirectory() as directory:
+        games = discover_games(build_archive(directory, frames, args.games))
+        output = Path(directory) / "output"
+        first_run = multiprocessing.get_context("fork").Process(target=run_batch, args=(games, output, "fake"), kwargs={"workers": args.workers})
+        first_run.start()
+        first_run.join(args.kill_after)
+        first_run.kill()
+        first_run.join()
+        done_before = count_checkpointed_frames(output)
+        print(f"[info] first run killed after {args.kill_after:.0f} s with {done_before} frames checkpointed")
+
+        start = time.perf_counter()
+        summaries = run_batch(games, output, "fake", workers=args.workers)
+        report = batch_report(summaries, time.perf_counter() - start)
+        print_batch_report(report)
+        for game_id, _ in games:
+            pgn = (output / game_id / PGN_FILE).read_text()
+            with open(output / game_id / CHECKPOINT_FILE) as file:
+                moves = json.load(file)["session"]["moves"]
+            print(f"[info] {game_id}: {'ok' if moves == expected else 'WRONG MOVES'}, {len(moves)} moves, PGN of {len(pgn)} bytes")
+        redone = report["frames_processed"] + report["frames_skipped"] - len(games) * len(frames)
+        print(f"[info] {report['frames_skipped']} frames resumed from the checkpoints ({done_before} checkpointed), {redone} frames processed twice")
@@ -0,0 +1,94 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import pickle
+import random
+import time
+import tracemalloc
+
+import chess
+
+from application.ifsc_chess.chessboard import *
+
+class ObjectChessboardMatrix:
+    """Previous ChessboardMatrix, an object array of ChessboardCell instances, kept as the reference."""
+    piece_map = {code: name for name, code in PIECE_CODES.items()}
+    symbols = {name: str(FEN_SYMBOLS[code + 6]) for name, code in PIECE_CODES.items()}
+
+    def __init__(self, points):
+        self.matrix = np.zeros((8, 8), dtype=object)
+        ordered_points = group_points_by_order(points)
+        for x, array in enumerate(ordered_points):
+            for y, point in enumerate(array):
+                if x <= 7 and y <= 7:
+                    self.matrix[x, y] = ChessboardCell(tuple(map(int, point)), tuple(map(int, ordered_points[x + 1][y + 1])))
+
+    def export_to_fen(self):
+        fen = ""
+        for y in range(7, -1, -1):
+            empty_count = 0
+            for x in range(8):
+                piece = self.matrix[x, y].get_piece()
+                if piece:
+                    if empty_count > 0:
+                        fen += str(empty_count)
+                        empty_count = 0
+                    fen += self.symbols.get(piece, "")
+                else:
+                    empty_count += 1
+            if empty_count > 0:
+                fen += str(empty_count)
+            if y > 0:
+                fen += "/"
+        return fen
+
+def random_positions(count, seed=0):
+    random.seed(seed)
+    board = chess.Board()
+    positions = []
+    while len(positions) < count:
+        moves = list(board.legal_moves)
+        if not moves:
+            board = chess.Board()
+            continue
+        board.push(random.choice(moves))
+        positions.append(board.copy())
+    return positions
+
+def measure_memory(factory, count):
+    tracemalloc.start()
+    matrices = [factory() for _ in range(count)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / count, len(pickle.dumps(matrices[0]))
+
+def measure_fen_export(matrices):
+    start = time.perf_counter()
+    for matrix in matrices:
+        matrix.export_to_fen()
+    return len(matrices) / (time.perf_counter() - start)
+
+if __name__ == '__main__':
+    points = np.array([(x * 100.0, 1000.0 - y * 100) for x in range(9) for y in range(9)])
+    positions = random_positions(2000)
+
+    compact_memory, compact_pickle = measure_memory(lambda: ChessboardMatrix(points), 1000)
+    object_memory, object_pickle = measure_memory(lambda: ObjectChessboardMatrix(points), 1000)
+
+    compact_matrices, object_matrices = [], []
+    for board in positions:
+        compact = ChessboardMatrix(points)
+        compact.import_from_fen(board.fen())
+        legacy = ObjectChessboardMatrix(points)
+        for x in range(8):
+            for y in range(8):
+                legacy.matrix[x, y].set_piece(compact.get_cell((x, y)).get_piece())
+        assert compact.export_to_fen().split()[0] == legacy.export_to_fen() == board.board_fen()
+        compact_matrices.append(compact)
+        object_matrices.append(legacy)
+
+    print(f"[info] memory per matrix: compact {compact_memory / 1024:.1f} KB, object {object_memory / 1024:.1f} KB")
+    print(f"[info] pickled size: compact {compact_pickle} bytes, object {object_pickle} bytes")
+    print(f"[info] FEN export: compact {measure_fen_export(compact_matrices):.0f}/s, "
+          f"object {measure_fen_export(object_matrices):.0f}/s ({len(positions)} positions)")
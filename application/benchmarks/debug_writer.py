@@ -0,0 +1,71 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+import tempfile
+
+from application.benchmarks.server import *
+from application.utils import image_utils
+from application.utils.debug_writer import DebugWriter, debug_writer
+
+class InlineWriter(DebugWriter):
+    """Renders and writes each overlay as soon as it is submitted, like the pipeline did without the writer thread."""
+    def submit(self, name, img, commands=()):
+        if not self.enabled:
+            return
+        self.index += 1
+        self.stats["queued"] += 1
+        self._render(self.game, self.frame, self.index, name, img, commands)
+
+def run_frames(frames, detector, writer=None, **settings):
+    """
+    Runs the pipeline on every frame with the given writer (or none) in place of the debug writer of image_utils.
+    Returns: the time of each frame, the time taken to write the overlays still queued at the end, and the writer stats.
+    """
+    times, drain = [], 0.0
+    with tempfile.TemporaryDirectory() as directory:
+        if writer is not None:
+            writer.enable(directory, **settings)
+            image_utils.debug_writer = writer
+        try:
+            for image_path, _ in frames:
+                image_utils.debug_writer.start_frame(image_path)
+                _, elapsed = timed(generate_board_matrix, cv2.imread(image_path), detector)
+                times.append(elapsed)
+            if writer is not None:
+                start = time.perf_counter()
+                writer.disable()
+                drain = time.perf_counter() - start
+        finally:
+            image_utils.debug_writer = debug_writer
+        files = sum(1 for path in Path(directory).rglob("*.jpg"))
+    return times, drain, dict(writer.stats, files=files) if writer is not None else {}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measures the cost of the debug overlays on the pipeline, rendered inline or by the background writer.")
+    parser.add_argument("--limit", type=int, default=8, help="use only the first N test images")
+    parser.add_argument("--max-pending", type=int, default=DEBUG_MAX_PENDING, help="overlays queued before the writer drops new ones")
+    args = parser.parse_args()
+
+    frames = test_game_frames(args.limit)
+    detector = FakeDetector(frames, test_game_positions(), call_latency=0.0, image_latency=0.0)
+    run_frames(frames[:1], detector) # warm up
+
+    modes = [
+        ("off", None, {}),
+        ("inline, full resolution", InlineWriter(), {"overlay_side": None}),
+        ("inline, downscaled", InlineWriter(), {}),
+        ("background, downscaled", DebugWriter(), {"max_pending": args.max_pending}),
+        ("background, contact sheet", DebugWriter(), {"max_pending": args.max_pending, "contact_sheet": True}),
+        ("background, 2 pending", DebugWriter(), {"max_pending": 2}),
+    ]
+    baseline = None
+    for name, writer, settings in modes:
+        times, drain, stats = run_frames(frames, detector, writer, **settings)
+        baseline = baseline or np.median(times)
+        line = f"[info] {name:<26} median {np.median(times)*1000:6.0f} ms/frame ({(np.median(times) - baseline)*1000:+.0f} ms)"
+        if stats:
+            line += (f", {stats['queued']} overlays queued, {stats['dropped']} dropped, {stats['files']} files, "
+                     f"{stats['render_time']:.1f} s rendering, {drain:.2f} s to drain at the end")
+        print(line)
@@ -0,0 +1,53 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+import multiprocessing
+import resource
+from concurrent.futures import ProcessPoolExecutor
+
+from application.benchmarks.suite import *
+
+def measure_backend(backend, backend_args, boards, repeat):
+    """
+    Loads a detector backend in this (fresh) process and runs it on the warped boards.
+    Returns: the time to load it, the time of its first prediction, the latency of each of the next
+    predictions and the resident memory it added, in MB.
+    """
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    detector, load_time = timed(load_detector, backend, *backend_args)
+    _, first_time = timed(detector.predict, boards[0])
+    times = [timed(detector.predict, board)[1] for _ in range(repeat) for board in boards]
+    return load_time, first_time, times, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compares the cold start, memory and latency of the local detector backends.")
+    parser.add_argument("--onnx", default=ONNX_MODEL_PATH, help="YOLO model exported to ONNX, for the onnx backend")
+    parser.add_argument("--precision", default=ONNX_PRECISION, help="precision of the onnx backend (fp32 or fp16)")
+    parser.add_argument("--weights", default=YOLO_WEIGHTS_PATH, help="YOLO weights file, for the yolo (torch) backend")
+    parser.add_argument("--limit", type=int, default=5, help="number of test images")
+    parser.add_argument("--repeat", type=int, default=3, help="times each board is detected")
+    args = parser.parse_args()
+
+    # both backends letterbox the boards to 640 pixels, downscaling them before keeps the memory
+    # measured in the worker process about the backend and not the boards sent to it
+    boards = [locate_chessboard(cv2.imread(image_path))[1] for image_path, _ in test_game_frames(args.limit)]
+    boards = [downscale(board, 640 / max(board.shape[:2])) for board in boards]
+    backends = {
+        "onnx": (args.onnx, (args.onnx, ONNX_CLASS_NAMES, args.precision)),
+        "yolo": (args.weights, (args.weights,)),
+    }
+    for backend, (model_path, backend_args) in backends.items():
+        if model_path is None or not Path(model_path).is_file():
+            print(f"[info] {backend}: skipped, no model file given")
+            continue
+        # each backend is loaded in a new process, so the cold start includes its imports
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            try:
+                load_time, first_time, times, rss = executor.submit(measure_backend, backend, backend_args, boards, args.repeat).result()
+            except ImportError as error:
+                print(f"[info] {backend}: skipped, {error}")
+                continue
+        print(f"[info] {backend}: loaded in {load_time*1000:.0f} ms, first prediction {first_time*1000:.0f} ms, "
+              f"median {np.median(times)*1000:.0f} ms per board (p95 {np.percentile(times, 95)*1000:.0f} ms), +{rss:.0f} MB RSS")
@@ -0,0 +1,59 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+import multiprocessing
+import pickle
+import resource
+from concurrent.futures import ProcessPoolExecutor
+
+from application.benchmarks.server import *
+from application.server import locate_board
+
+def play_isolated(games, frames, detector, workers, frame_store_slots):
+    """
+    Plays the games on a server in this process, started fresh so its peak memory is measured apart.
+    Returns: the moves of each game, the elapsed time, the server metrics and the peak RSS (in KB)
+    of the server process and of its largest worker.
+    """
+    results, elapsed, metrics = asyncio.run(run(games, frames, detector, workers, DETECTION_BATCH_SIZE, frame_store_slots))
+    return ([moves for moves, _ in results], elapsed, metrics,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+def pickled_sizes(frames):
+    """Returns the bytes pickled between the server and a worker for each frame, with and without the frame store."""
+    sizes = {"pickled": [], "frame store": []}
+    for image_path, _ in frames:
+        image_bytes = Path(image_path).read_bytes()
+        warped, grid_points = locate_board(image_bytes)
+        sizes["pickled"].append(len(pickle.dumps((image_bytes,))) + len(pickle.dumps((warped, grid_points))))
+        sizes["frame store"].append(len(pickle.dumps((0,))) + len(pickle.dumps((None, grid_points))))
+    return sizes
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compares the server with the frames pickled to its workers and with the frames in shared memory.")
+    parser.add_argument("--games", type=int, default=2, help="number of concurrent games")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="processes running the board and grid detection")
+    parser.add_argument("--limit", type=int, default=None, help="use only the first N test images")
+    args = parser.parse_args()
+
+    frames = test_game_frames(args.limit)
+    detector = FakeDetector(frames, test_game_positions(), call_latency=0.05)
+    sizes = pickled_sizes(frames)
+    expected = TEST_GAME_MOVES[:frames[-1][1]]
+
+    for mode, slots in (("pickled", 0), ("frame store", FRAME_STORE_SLOTS)):
+        # a pool process is daemonic and can't start the workers of the server
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            moves, elapsed, metrics, server_rss, worker_rss = executor.submit(play_isolated, args.games, frames, detector, args.workers, slots).result()
+        correct = sum(game_moves == expected for game_moves in moves)
+        total_frames = args.games * len(frames)
+        # frame sized buffers created per frame: pickling and unpickling the upload and the warped board,
+        # or copying the upload to its slot (the worker decodes it and writes the warped board in place)
+        copies = 4 if slots == 0 else 1
+        store = metrics["frame_store"]
+        print(f"[info] {mode}: {correct}/{args.games} games correct, {total_frames} frames in {elapsed:.1f} s, "
+              f"{np.mean(sizes[mode]) / 2**20:.2f} MB pickled per frame, {copies} frame copies per frame, "
+              f"peak RSS server {server_rss / 1024:.0f} MB, worker {worker_rss / 1024:.0f} MB"
+              + (f", {store['frames']} frames in the store, {store['peak_in_use']} slots used at most" if store else ""))
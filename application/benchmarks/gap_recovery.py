@@ -0,0 +1,33 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+
+import numpy as np
+
+from application.benchmarks.suite import test_game_positions
+from application.ifsc_chess.gap_recovery import find_move_sequence
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Drops frames from the test game and recovers the missing moves.")
+    parser.add_argument("--max-plies", type=int, default=4, help="longest sequence searched")
+    args = parser.parse_args()
+
+    positions = test_game_positions()
+    for gap in range(2, args.max_plies + 1):
+        times, nodes, failures = [], [], 0
+        for start in range(len(positions) - gap):
+            result = find_move_sequence(positions[start], positions[start + gap], args.max_plies)
+            recovered = result.moves is not None and len(result.moves) <= gap
+            if recovered:
+                board = positions[start].copy()
+                for move in result.moves:
+                    board.push(move)
+                recovered = board.board_fen() == positions[start + gap].board_fen()
+            failures += not recovered
+            times.append(result.elapsed)
+            nodes.append(result.nodes)
+        print(f"[info] {gap - 1} missing frame(s): {len(times) - failures}/{len(times)} recovered, "
+              f"median {np.median(times)*1000:.1f} ms, max {np.max(times)*1000:.1f} ms, "
+              f"median {np.median(nodes):.0f} positions searched")
@@ -0,0 +1,63 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+import time
+
+from application.ifsc_chess.chessboard_operations import *
+from application.utils.image_utils import load_image
+
+TEST_IMAGES = sorted((Path(__file__).absolute().parent.parent.parent / "test_images").glob("*.jpg"))
+
+def grid_intersections(warped, scale=1.0):
+    """Returns the intersections clustered by find_grid_points on the warped board, and its eps and min_samples."""
+    lines = detect_scaled_lines(warped, 1, scale)
+    intersections = detect_intersections([extrapolate_line(*line[0], warped.shape) for line in lines])
+    return intersections, warped.shape[0] / GRID_CLUSTER_EPS_DIVISOR, max(1, int(round(GRID_CLUSTER_MIN_SAMPLES * scale**2)))
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Times the grid clustering and compares it with scikit-learn's DBSCAN, if installed.")
+    parser.add_argument("--limit", type=int, default=None, help="use only the first N test images")
+    parser.add_argument("--repeat", type=int, default=5, help="times each clustering runs")
+    args = parser.parse_args()
+
+    try:
+        from sklearn.cluster import DBSCAN
+    except ImportError:
+        DBSCAN = None
+        print("[info] scikit-learn is not installed, only timing the clustering")
+
+    factor = PYRAMID_WORKING_SIDE / REFERENCE_IMAGE_SIDE
+    times = {"full resolution": ([], []), f"working side {PYRAMID_WORKING_SIDE}": ([], [])}
+    mismatches = 0
+    for image_path in TEST_IMAGES[:args.limit]:
+        img = load_image(str(image_path))
+        warped = warp_perspective(img, find_chessboard_corners(img))
+        cases = {
+            "full resolution": grid_intersections(warped),
+            f"working side {PYRAMID_WORKING_SIDE}": grid_intersections(downscale(warped, factor), factor),
+        }
+        for name, (intersections, eps, min_samples) in cases.items():
+            for _ in range(args.repeat):
+                labels, elapsed = timed(dbscan_labels, intersections, eps, min_samples)
+                times[name][0].append(elapsed)
+                if DBSCAN is not None:
+                    expected, elapsed = timed(lambda: DBSCAN(eps=eps, min_samples=min_samples).fit(intersections).labels_)
+                    times[name][1].append(elapsed)
+            if DBSCAN is not None and not np.array_equal(labels, expected):
+                mismatches += 1
+                print(f"[error] {image_path.name} ({name}): labels differ from DBSCAN")
+
+    for name, (grid_times, dbscan_times) in times.items():
+        line = f"[info] {name}: dbscan_labels median {np.median(grid_times)*1000:.1f} ms"
+        if dbscan_times:
+            line += f", sklearn DBSCAN median {np.median(dbscan_times)*1000:.1f} ms ({np.median(dbscan_times) / np.median(grid_times):.1f}x)"
+        print(line)
+    if DBSCAN is not None:
+        print(f"[info] {mismatches} images with labels different from DBSCAN")
@@ -0,0 +1,92 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+
+from application.benchmarks.suite import *
+from application.ifsc_chess import incremental_detection
+from application.ifsc_chess.incremental_detection import pack_crops
+
+class GroundTruthDetector(Detector):
+    """
+    Answers with the synthetic predictions of the frame given to set_frame, for the whole warped board
+    or for crops of it, after sleeping as long as a remote detector would take for the pixels sent.
+    Crops must be views on the warped board, their position is found from their memory address;
+    the mosaics of crops are recognized by the positions recorded by pack_crops.
+    batched: the crops are sent as a batch, or packed into a mosaic, see IncrementalDetector.
+    """
+    def __init__(self, call_latency=0.0, megapixel_latency=0.0, batched=True):
+        self.call_latency = call_latency
+        self.megapixel_latency = megapixel_latency
+        self.batched = batched
+        self.calls = 0
+        self.pixels = 0
+        self.mosaics = {}
+
+    def pack_crops(self, crops, max_width):
+        """Packs the crops as incremental_detection.pack_crops does, keeping where each one came from."""
+        mosaic, positions = pack_crops(crops, max_width)
+        self.mosaics[id(mosaic)] = (mosaic, [(self.crop_offset(crop), position, crop.shape) for crop, position in zip(crops, positions)])
+        return mosaic, positions
+
+    def set_frame(self, warped, predictions):
+        self.warped = warped
+        self.predictions = predictions
+
+    def crop_offset(self, image):
+        offset = image.__array_interface__["data"][0] - self.warped.__array_interface__["data"][0]
+        return (offset % self.warped.strides[0]) // self.warped.strides[1], offset // self.warped.strides[0]
+
+    def predict_batch(self, images):
+        self.calls += 1
+        pixels = sum(image.shape[0] * image.shape[1] for image in images)
+        self.pixels += pixels
+        time.sleep(self.call_latency + self.megapixel_latency * pixels / 1e6)
+        results = []
+        for image in images:
+            # each crop of a mosaic moves its predictions from the board to its position in the mosaic
+            _, crops = self.mosaics.pop(id(image), (None, [(self.crop_offset(image), (0, 0), image.shape)]))
+            results.append([{**p, "x": p["x"] - x0 + px, "y": p["y"] - y0 + py} for (x0, y0), (px, py), shape in crops
+                            for p in self.predictions if x0 <= p["x"] < x0 + shape[1] and y0 <= p["y"] < y0 + shape[0]])
+        return results
+
+def replay(located, positions, detector, incremental):
+    """Reads every frame with the detector, or through the IncrementalDetector. Returns: the positions read correctly and the latency of each frame."""
+    correct, times = 0, []
+    for warped, grid_points, ply in located:
+        matrix = ChessboardMatrix(grid_points)
+        detector.set_frame(warped, synthetic_predictions(matrix, positions[ply]))
+        start = time.perf_counter()
+        predictions = incremental.predict(warped, matrix) if incremental is not None else detector.predict(warped)
+        times.append(time.perf_counter() - start)
+        map_all_pieces(matrix, predictions)
+        correct += matrix.export_to_fen().split()[0] == positions[ply].board_fen()
+    return correct, times
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compares the incremental piece detection with the detection of the whole board on the test game.")
+    parser.add_argument("--limit", type=int, default=None, help="use only the first N test images")
+    parser.add_argument("--call-latency", type=float, default=0.2, help="simulated seconds taken by each detector call")
+    parser.add_argument("--megapixel-latency", type=float, default=0.1, help="simulated seconds taken per megapixel sent to the detector")
+    parser.add_argument("--threshold", type=float, default=INCREMENTAL_CHANGE_THRESHOLD, help="cell change threshold")
+    args = parser.parse_args()
+
+    frames = test_game_frames(args.limit)
+    positions = test_game_positions()
+    located = []
+    for image_path, ply in frames:
+        _, warped, grid_points = locate_chessboard(cv2.imread(image_path))
+        located.append((warped, grid_points, ply))
+
+    for mode in ("full board", "incremental, batched", "incremental, mosaic"):
+        detector = GroundTruthDetector(args.call_latency, args.megapixel_latency, batched=mode != "incremental, mosaic")
+        incremental_detection.pack_crops = detector.pack_crops
+        incremental = IncrementalDetector(detector, change_threshold=args.threshold) if mode != "full board" else None
+        correct, times = replay(located, positions, detector, incremental)
+        # the first frame is always detected whole, the moves are the frames after it
+        print(f"[info] {mode}: {correct}/{len(located)} positions read correctly, {detector.calls} detector calls, "
+              f"{detector.pixels / 1e6:.1f} Mpixels sent, median {np.median(times[1:])*1000:.0f} ms per move "
+              f"(p95 {np.percentile(times[1:], 95)*1000:.0f} ms)")
+        if incremental is not None:
+            incremental.report()
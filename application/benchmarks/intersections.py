@@ -0,0 +1,63 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import time
+import numpy as np
+
+from application.processing.image_preprocessing import *
+from application.utils.image_utils import load_image
+
+TEST_IMAGES = sorted((Path(__file__).absolute().parent.parent.parent / "test_images").glob("*.jpg"))
+
+def extrapolated_lines_from_image(img, dilate_iterations=2):
+    dilated_edges = edge_and_dilate(pre_process(img), dilate_iterations)
+    lines = detect_lines(dilated_edges)
+    return [extrapolate_line(*line[0], img.shape) for line in lines]
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def check_parity(images=TEST_IMAGES):
+    """
+    Compares detect_intersections against the pairwise reference implementation
+    on the lines detected in each test image.
+    Returns: True if every image produced the same point set.
+    """
+    all_equal = True
+    total_pairwise, total_batch = 0.0, 0.0
+    for image_path in images:
+        img = load_image(str(image_path))
+        lines = extrapolated_lines_from_image(img)
+        expected, pairwise_time = timed(detect_intersections_pairwise, lines)
+        result, batch_time = timed(detect_intersections, lines)
+        equal = np.array_equal(expected, result)
+        all_equal &= equal
+        total_pairwise += pairwise_time
+        total_batch += batch_time
+        print(f"[info] {image_path.name}: {len(lines)} lines, {len(result)} intersections, "
+              f"pairwise {pairwise_time*1000:.1f} ms, batch {batch_time*1000:.1f} ms, "
+              f"{'OK' if equal else 'MISMATCH'}")
+    print(f"[info] total pairwise {total_pairwise:.2f} s, batch {total_batch:.2f} s "
+          f"({total_pairwise / max(total_batch, 1e-9):.1f}x)")
+    return all_equal
+
+def scaling(line_counts=(500, 1000, 2000, 4000), seed=0):
+    """Times detect_intersections on random grid-like lines of increasing size."""
+    rng = np.random.default_rng(seed)
+    width, height = 4624, 3468
+    for count in line_counts:
+        horizontal = [(0, int(y), width, int(y + d)) for y, d in zip(rng.integers(0, height, count // 2), rng.integers(-50, 50, count // 2))]
+        vertical = [(int(x), 0, int(x + d), height) for x, d in zip(rng.integers(0, width, count // 2), rng.integers(-50, 50, count // 2))]
+        lines = horizontal + vertical
+        intersections, batch_time = timed(detect_intersections, lines)
+        print(f"[info] {count} lines: {len(intersections)} intersections in {batch_time*1000:.1f} ms")
+
+if __name__ == '__main__':
+    parity = check_parity()
+    scaling()
+    if not parity:
+        print("[error] detect_intersections does not match the pairwise implementation.")
+        exit(1)
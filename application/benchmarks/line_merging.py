@@ -0,0 +1,43 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import time
+
+from application.ifsc_chess.chessboard_operations import *
+import application.processing.image_preprocessing as image_preprocessing
+
+TEST_IMAGES = sorted((Path(__file__).absolute().parent.parent.parent / "test_images").glob("*.jpg"))
+
+def run_geometry(img, merge):
+    """Runs select_chessboard_area and map_chessboard, returns the elapsed time or None on failure."""
+    start = time.perf_counter()
+    try:
+        warped = select_chessboard_area(img, merge=merge)
+        map_chessboard(warped, merge=merge)
+    except ValueError:
+        return None
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    totals = {False: 0.0, True: 0.0}
+    failures = {False: 0, True: 0}
+    reset_line_merge_stats()
+    for image_path in TEST_IMAGES:
+        img = load_image(str(image_path))
+        for merge in (False, True):
+            elapsed = run_geometry(img, merge)
+            if elapsed is None:
+                failures[merge] += 1
+                print(f"[error] {image_path.name}: grid mapping failed (merge={merge})")
+            else:
+                totals[merge] += elapsed
+                print(f"[info] {image_path.name}: {elapsed*1000:.0f} ms (merge={merge})")
+
+    stats = image_preprocessing.line_merge_stats
+    print("========================================")
+    print(f"[info] lines: {stats['raw']} raw, {stats['merged']} merged "
+          f"({stats['raw'] / max(stats['merged'], 1):.1f}x fewer)")
+    print(f"[info] raw lines:    {totals[False]:.2f} s, {failures[False]} failures")
+    print(f"[info] merged lines: {totals[True]:.2f} s, {failures[True]} failures")
+    print(f"[info] speedup: {totals[False] / max(totals[True], 1e-9):.2f}x")
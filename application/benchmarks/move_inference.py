@@ -0,0 +1,88 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import time
+
+import chess
+import numpy as np
+
+from application.benchmarks.suite import TEST_GAME_MOVES, test_game_positions
+from application.ifsc_chess.game_session import GameSession
+from application.ifsc_chess.move_inference import infer_move
+
+def find_san_move_by_pushing(board_before, board_after):
+    """Previous find_san_move: pushes every legal move and compares the FEN, kept as the reference."""
+    for move in board_before.legal_moves:
+        board_before.push(move)
+        matches = board_before.board_fen() == board_after.board_fen()
+        board_before.pop()
+        if matches:
+            return board_before.san(move)
+    return None
+
+class PositionMatrix:
+    """Stands for the board matrix of a frame showing the given position."""
+    def __init__(self, board: chess.BaseBoard):
+        self.board = board
+
+    def export_to_fen(self):
+        return self.board.board_fen()
+
+def misdetections(positions, max_mismatches):
+    """
+    Removes each piece, one at a time, from the positions of the test game, with and without the move that follows.
+    Returns: the unchanged positions taken for a move, and the moves found despite a piece missed on a square they don't touch.
+    """
+    false_moves, found, total = 0, 0, 0
+    for before, after in zip(positions, positions[1:]):
+        move = after.peek()
+        touched = {move.from_square, move.to_square}
+        for square in before.piece_map():
+            missed = before.copy()
+            missed.remove_piece_at(square)
+            false_moves += infer_move(before, missed, max_mismatches).move is not None
+        for square in after.piece_map():
+            if square in touched or after.piece_type_at(square) == chess.KING:
+                continue
+            missed = after.copy()
+            missed.remove_piece_at(square)
+            found += infer_move(before, missed, max_mismatches).move == move
+            total += 1
+    return false_moves, found, total
+
+def time_moves(function, positions, repeat):
+    times = []
+    for before, after in zip(positions, positions[1:]):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            san = function(before, after)
+        times.append((time.perf_counter() - start) / repeat)
+    return san, times
+
+if __name__ == '__main__':
+    positions = test_game_positions()
+    repeat = 50
+    for before, after, expected in zip(positions, positions[1:], TEST_GAME_MOVES):
+        assert find_san_move_by_pushing(before.copy(), after) == expected
+        assert infer_move(before, after).san == expected
+
+    # a rook missed after 1.e4 e5 2.Nf3 Nc6 3.Bc4, with no move played, must not become Rb8
+    session, board = GameSession(max_mismatches=1), chess.Board()
+    session.update(PositionMatrix(board))
+    for san_move in ("e4", "e5", "Nf3", "Nc6", "Bc4"):
+        board.push_san(san_move)
+        session.update(PositionMatrix(board))
+    missed = board.copy()
+    missed.remove_piece_at(chess.A8)
+    assert session.update(PositionMatrix(missed))["status"] == "error" and session.moves == ["e4", "e5", "Nf3", "Nc6", "Bc4"]
+    false_moves, found, total = misdetections(positions, 1)
+    assert false_moves == 0
+    print(f"[info] one piece missed: no move taken from an unchanged position, {found}/{total} moves found despite it")
+
+    _, pushing = time_moves(lambda before, after: find_san_move_by_pushing(before, after), positions, repeat)
+    _, diffing = time_moves(lambda before, after: infer_move(before, after).san, positions, repeat)
+    print(f"[info] {len(TEST_GAME_MOVES)} moves of the test game, both methods find every move")
+    print(f"[info] push every legal move: median {np.median(pushing)*1e6:.0f} us, p95 {np.percentile(pushing, 95)*1e6:.0f} us")
+    print(f"[info] square diff:           median {np.median(diffing)*1e6:.0f} us, p95 {np.percentile(diffing, 95)*1e6:.0f} us")
+    print(f"[info] speedup {np.sum(pushing) / np.sum(diffing):.1f}x")
@@ -0,0 +1,116 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from application.benchmarks.suite import *
+from application.ifsc_chess.game_session import GameSession, MultiBoardSession
+
+TILE_SIZE = (2312, 1734) # half the side of the test images, so 4 boards make a frame of the same size
+
+def mosaic_frames(frames, boards, lag):
+    """
+    Yields, for each frame, the tiles of the boards and the ply each one shows: board k shows the game lag*k frames behind,
+    as if the boards of a tournament had started one after the other.
+    """
+    tiles = {}
+    for index in range(len(frames)):
+        shown = [frames[max(0, index - lag * k)] for k in range(boards)]
+        for image_path, _ in shown:
+            if image_path not in tiles:
+                tiles[image_path] = cv2.resize(cv2.imread(image_path), TILE_SIZE, interpolation=cv2.INTER_AREA)
+        yield [tiles[image_path] for image_path, _ in shown], [ply for _, ply in shown]
+
+def assemble(tiles):
+    """Returns: the tiles in a frame of 2 columns."""
+    if len(tiles) % 2:
+        tiles = tiles + [np.zeros_like(tiles[0])] if len(tiles) > 1 else tiles
+    rows = [np.hstack(tiles[i:i + 2]) for i in range(0, len(tiles), 2)]
+    return np.vstack(rows)
+
+def tile_of(region, columns):
+    x, y = (region[0] + region[2]) / 2, (region[1] + region[3]) / 2
+    return int(y // TILE_SIZE[1]) * columns + int(x // TILE_SIZE[0])
+
+def record_predictions(detector, frames, boards, lag, positions):
+    """Records the predictions of the boards located on each frame and on each tile alone, as the two modes will warp them."""
+    columns = min(boards, 2)
+    for tiles, plies in mosaic_frames(frames, boards, lag):
+        for region, located, _ in locate_chessboards(assemble(tiles)):
+            if located is not None:
+                detector.record(located[1], located[2], positions[plies[tile_of(region, columns)]])
+        for tile, ply in zip(tiles, plies):
+            try:
+                _, warped, grid_points = locate_chessboard(tile)
+            except ValueError:
+                continue
+            detector.record(warped, grid_points, positions[ply])
+
+def run_multi_board(frames, boards, lag, detector, executor):
+    """Runs every frame through generate_board_matrices. Returns: the time of each frame and the multi-board session."""
+    session = MultiBoardSession()
+    times = []
+    for tiles, _ in mosaic_frames(frames, boards, lag):
+        img = assemble(tiles)
+        start = time.perf_counter()
+        session.update(generate_board_matrices(img, detector, executor))
+        times.append(time.perf_counter() - start)
+    return times, session.sessions
+
+def run_board_by_board(frames, boards, lag, detector):
+    """Runs each board of every frame through generate_board_matrix as a frame of its own, one detector call each."""
+    sessions = [GameSession(f"board-{k + 1}") for k in range(boards)]
+    times = []
+    for tiles, _ in mosaic_frames(frames, boards, lag):
+        start = time.perf_counter()
+        for tile, session in zip(tiles, sessions):
+            try:
+                chessboard_matrix, _, _, _ = generate_board_matrix(tile, detector)
+            except ValueError:
+                continue
+            session.update(chessboard_matrix)
+        times.append(time.perf_counter() - start)
+    return times, {session.game_id: session for session in sessions}
+
+def games_read(sessions, frames, boards, lag, positions):
+    """
+    Returns: the number of boards whose session ends on the position of the last frame each one shows,
+    and the number of those whose moves are exactly the ones of the game (a gap may be recovered with a transposition).
+    """
+    plies = [frames[max(0, len(frames) - 1 - lag * k)][1] for k in range(boards)]
+    games = [sessions.get(f"board-{k + 1}") for k in range(boards)]
+    positions_read = sum(game is not None and game.board is not None and game.board.board_fen() == positions[ply].board_fen()
+                         for game, ply in zip(games, plies))
+    moves_read = sum(game is not None and game.moves == TEST_GAME_MOVES[:ply] for game, ply in zip(games, plies))
+    return positions_read, moves_read
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compares one frame showing several boards, detected in a single batch, with each board processed as a frame of its own.")
+    parser.add_argument("--limit", type=int, default=12, help="use only the first N test images")
+    parser.add_argument("--boards", type=int, nargs="+", default=[1, 2, 4], help="boards per frame")
+    parser.add_argument("--lag", type=int, default=2, help="frames between the positions of two consecutive boards")
+    parser.add_argument("--threads", type=int, default=4, help="threads locating the boards of a frame")
+    parser.add_argument("--latency", type=float, default=0.15, help="seconds taken by each call to the detector")
+    args = parser.parse_args()
+
+    frames = test_game_frames(args.limit)
+    positions = test_game_positions()
+    executor = ThreadPoolExecutor(max_workers=args.threads)
+    for boards in args.boards:
+        detector = FakeDetector(call_latency=args.latency)
+        record_predictions(detector, frames, boards, args.lag, positions)
+        modes = [
+            ("board by board", lambda: run_board_by_board(frames, boards, args.lag, detector)),
+            ("one frame, batched", lambda: run_multi_board(frames, boards, args.lag, detector, None)),
+            (f"one frame, {args.threads} threads", lambda: run_multi_board(frames, boards, args.lag, detector, executor)),
+        ]
+        for name, run in modes:
+            detector.calls = 0
+            times, sessions = run()
+            positions_read, moves_read = games_read(sessions, frames, boards, args.lag, positions)
+            print(f"[info] {boards} boards, {name:<22} median {np.median(times)*1000:5.0f} ms/frame, "
+                  f"{len(frames) * boards / sum(times):5.2f} boards/s, {detector.calls} detector calls, {len(sessions)} sessions, "
+                  f"{positions_read}/{boards} final positions and {moves_read}/{boards} move lists right")
+    executor.shutdown()
@@ -0,0 +1,40 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+import os
+import time
+
+from application.pipeline import *
+
+TEST_IMAGES = sorted((Path(__file__).absolute().parent.parent.parent / "test_images").glob("*.jpg"))
+
+def run(images, workers):
+    """Processes the images with the given number of workers and returns (elapsed time, grid of each image)."""
+    # every worker gets enough empty recorded predictions for the whole game
+    detector_args = ([[]] * len(images),)
+    start = time.perf_counter()
+    grids = [
+        [matrix.get_cell((x, y)).get_coordinates() for x in range(8) for y in range(8)]
+        for _, matrix in iter_board_matrices(images, "recorded", detector_args, workers=workers)
+    ]
+    return time.perf_counter() - start, grids
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measures the wall-clock speedup of the process pool.")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    images = [str(path) for path in TEST_IMAGES]
+    sequential_time, expected = run(images, 1)
+    results = [(1, sequential_time, True)]
+    for workers in range(2, args.max_workers + 1):
+        elapsed, grids = run(images, workers)
+        results.append((workers, elapsed, grids == expected))
+
+    print("========================================")
+    print(f"[info] {len(images)} images, {os.cpu_count()} CPU cores")
+    for workers, elapsed, identical in results:
+        print(f"[info] {workers} worker(s): {elapsed:.2f} s, {len(images) / elapsed:.2f} frames/s, "
+              f"speedup {sequential_time / elapsed:.2f}x, {'identical' if identical else 'DIFFERENT'} output")
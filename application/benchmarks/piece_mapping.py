@@ -0,0 +1,63 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+import copy
+import time
+
+from application.benchmarks.suite import *
+
+def mapped_pieces(matrix):
+    return [[matrix.get_cell((x, y)).get_piece() for y in range(8)] for x in range(8)]
+
+def time_homography_fit(matrix, repeat):
+    times = []
+    for _ in range(repeat):
+        fresh_matrix = copy.deepcopy(matrix)
+        start = time.perf_counter()
+        fresh_matrix.get_board_homography()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+def time_mapping(matrix, predictions, vectorized, repeat):
+    times = []
+    for _ in range(repeat):
+        fresh_matrix = copy.deepcopy(matrix)
+        start = time.perf_counter()
+        map_all_pieces(fresh_matrix, predictions, vectorized=vectorized)
+        times.append(time.perf_counter() - start)
+    return fresh_matrix, float(np.median(times))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compares the cell scanning and the homography piece mappers.")
+    parser.add_argument("--frames", type=int, default=5, help="number of test images to use")
+    parser.add_argument("--repeat", type=int, default=200, help="times each mapper runs per frame")
+    args = parser.parse_args()
+
+    positions = test_game_positions()
+    total_scan, total_vectorized, total_fit, disagreements = 0.0, 0.0, 0.0, 0
+    for image_path, ply in test_game_frames(args.frames):
+        matrix = map_chessboard(select_chessboard_area(cv2.imread(image_path)))
+        predictions = synthetic_predictions(matrix, positions[ply])
+        fit_time = time_homography_fit(matrix, args.repeat)
+        matrix.get_board_homography()  # fitted once per frame, timed separately
+        scan_matrix, scan_time = time_mapping(matrix, predictions, False, args.repeat)
+        vectorized_matrix, vectorized_time = time_mapping(matrix, predictions, True, args.repeat)
+        agree = mapped_pieces(scan_matrix) == mapped_pieces(vectorized_matrix)
+        disagreements += not agree
+        total_scan += scan_time
+        total_vectorized += vectorized_time
+        total_fit += fit_time
+        print(f"[info] {Path(image_path).name}: {len(predictions)} pieces, scan {scan_time*1e6:.0f} us, "
+              f"homography {vectorized_time*1e6:.0f} us + {fit_time*1e6:.0f} us fit, {'same cells' if agree else 'DIFFERENT cells'}")
+    print(f"[info] scan {total_scan*1e3:.2f} ms, homography {total_vectorized*1e3:.2f} ms + {total_fit*1e3:.2f} ms fit "
+          f"({total_scan / max(total_vectorized + total_fit, 1e-12):.1f}x with fit), {disagreements} frame(s) with different cells")
+
+    # cost per piece as the number of predictions grows, e.g. with noisy detections
+    matrix.get_board_homography()
+    for count in (32, 256, 2048):
+        predictions = [dict(synthetic_predictions(matrix, positions[0])[i % 32], confidence=0.5 + i / 10000) for i in range(count)]
+        _, scan_time = time_mapping(matrix, predictions, False, 20)
+        _, vectorized_time = time_mapping(matrix, predictions, True, 20)
+        print(f"[info] {count} predictions: scan {scan_time*1e3:.2f} ms, homography {vectorized_time*1e3:.2f} ms")
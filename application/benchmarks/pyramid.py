@@ -0,0 +1,87 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+import multiprocessing
+import resource
+import tracemalloc
+
+from application.benchmarks.suite import *
+
+def locate_all(frames, working_side):
+    """
+    Runs locate_chessboard on every frame, in a fresh process so the peak memory of each mode is measured apart.
+    Returns: the corners and grid points of each frame (None on failure), the elapsed times,
+    the peak traced memory, the peak resident memory of the process and the number of frames located at each level.
+    """
+    results, times = [], []
+    peak_traced = 0
+    for image_path, _ in frames:
+        img = cv2.imread(image_path)
+        tracemalloc.start()
+        try:
+            (corners, _, grid_points), elapsed = timed(locate_chessboard, img, MERGE_LINES, working_side)
+            results.append((corners, grid_points))
+            times.append(elapsed)
+        except ValueError:
+            results.append(None)
+        peak_traced = max(peak_traced, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return results, times, peak_traced, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, dict(pyramid_stats)
+
+def warp_transform(corners):
+    """Returns the perspective transform used by warp_perspective, from the image to the warped board."""
+    width, height = calculate_image_size(corners)
+    dst_points = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype='float32')
+    return cv2.getPerspectiveTransform(corners, dst_points)
+
+def transform_points(points, transform):
+    return cv2.perspectiveTransform(np.asarray(points, dtype=np.float64).reshape(-1, 1, 2), transform).reshape(-1, 2)
+
+def run_isolated(frames, working_side):
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(locate_all, (frames, working_side))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compares the board and grid detection on downscaled copies with the full resolution.")
+    parser.add_argument("--sides", type=int, nargs="+", default=[800, 1200, 1600], help="working sides to compare")
+    parser.add_argument("--limit", type=int, default=None, help="use only the first N test images")
+    args = parser.parse_args()
+
+    frames = test_game_frames(args.limit)
+    positions = test_game_positions()
+    reference, reference_times, reference_traced, reference_rss, _ = run_isolated(frames, None)
+    print(f"[info] full resolution: {sum(r is not None for r in reference)}/{len(frames)} boards found, "
+          f"median {np.median(reference_times)*1000:.0f} ms, peak traced {reference_traced / 2**20:.0f} MB, peak RSS {reference_rss / 1024:.0f} MB")
+
+    for side in args.sides:
+        results, times, traced, rss, levels = run_isolated(frames, side)
+        found = correct = 0
+        corner_errors, grid_errors = [], []
+        for (_, ply), full, pyramid in zip(frames, reference, results):
+            if pyramid is None:
+                continue
+            found += 1
+            # compare both grids on the original image, since each one was found on its own warped board
+            to_image = np.linalg.inv(warp_transform(pyramid[0]))
+            pyramid_grid = transform_points(pyramid[1], to_image)
+            matrix = ChessboardMatrix(pyramid[1])
+            if full is None:
+                map_all_pieces(matrix, synthetic_predictions(matrix, positions[ply]))
+            else:
+                full_to_image = np.linalg.inv(warp_transform(full[0]))
+                full_grid = transform_points(full[1], full_to_image)
+                corner_errors.append(np.abs(pyramid[0] - full[0]).max())
+                grid_errors.append(np.median(np.min(np.linalg.norm(pyramid_grid[:, None] - full_grid[None], axis=2), axis=1)))
+                # a perfect detector on the full resolution board, moved to the board warped from the downscaled corners
+                predictions = synthetic_predictions(ChessboardMatrix(full[1]), positions[ply])
+                centers = transform_points([(p["x"], p["y"]) for p in predictions], warp_transform(pyramid[0]) @ full_to_image)
+                for prediction, (x, y) in zip(predictions, centers):
+                    prediction["x"], prediction["y"] = x, y
+                map_all_pieces(matrix, predictions)
+            correct += matrix.export_to_fen().split()[0] == positions[ply].board_fen()
+        print(f"[info] working side {side}: {found}/{len(frames)} boards found ({levels['full_resolution']} at full resolution), {correct} positions read correctly, "
+              f"max corner offset {max(corner_errors):.1f} px, grid offset median {np.median(grid_errors):.1f} px (worst image {max(grid_errors):.1f} px), "
+              f"median {np.median(times)*1000:.0f} ms ({np.median(reference_times) / np.median(times):.1f}x faster), "
+              f"peak traced {traced / 2**20:.0f} MB, peak RSS {rss / 1024:.0f} MB")
@@ -0,0 +1,85 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+import base64
+import hashlib
+
+import requests
+
+from application.benchmarks.suite import *
+from application.server import locate_board
+from application.detection.remote_detection import RemoteDetectionClient, encode_for_model, rescale_predictions
+from application.detection.replay_server import ReplayServer
+
+def record_boards(boards, sizes):
+    """Returns: the synthetic predictions of each board, by hash of the JPEG sent for each image size, in its coordinates."""
+    recordings = {}
+    for warped, predictions in boards:
+        for size in sizes:
+            encoded, scale = encode_for_model(warped, size)
+            recordings[hashlib.sha1(encoded).hexdigest()] = rescale_predictions(predictions, 1 / scale)
+    return recordings
+
+def detect_one_by_one(url, images):
+    """Sends each image at full resolution on a new connection, waiting for its answer, without retries."""
+    results = []
+    for image in images:
+        encoded, _ = encode_for_model(image, None)
+        response = requests.post(f"{url}/{ROBOFLOW_PROJECT_ID}/{ROBOFLOW_MODEL_VERSION}", data=base64.b64encode(encoded),
+                                 headers={"Content-Type": "application/x-www-form-urlencoded"})
+        results.append(response.json()["predictions"] if response.ok else None)
+    return results
+
+def positions_read(boards, grids, positions, results):
+    correct = 0
+    for grid_points, position, predictions in zip(grids, positions, results):
+        if predictions is not None:
+            matrix = ChessboardMatrix(grid_points)
+            map_all_pieces(matrix, predictions)
+            correct += matrix.export_to_fen().split()[0] == position.board_fen()
+    return correct
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compares the remote detection client with one full resolution request at a time, on a local replay server.")
+    parser.add_argument("--limit", type=int, default=8, help="use only the first N test images")
+    parser.add_argument("--latency", type=float, default=0.15, help="seconds taken by the server to answer")
+    parser.add_argument("--bandwidth", type=float, default=2.5, help="simulated upload bandwidth, in MB/s")
+    parser.add_argument("--failure-rate", type=float, default=0.1, help="fraction of the requests answered with 503")
+    parser.add_argument("--in-flight", type=int, nargs="+", default=[1, REMOTE_MAX_IN_FLIGHT], help="concurrent requests of the client")
+    args = parser.parse_args()
+
+    frames = test_game_frames(args.limit)
+    all_positions = test_game_positions()
+    boards, grids, positions = [], [], []
+    for image_path, ply in frames:
+        warped, grid_points = locate_board(Path(image_path).read_bytes())
+        boards.append((warped, synthetic_predictions(ChessboardMatrix(grid_points), all_positions[ply])))
+        grids.append(grid_points)
+        positions.append(all_positions[ply])
+    images = [warped for warped, _ in boards]
+    recordings = record_boards(boards, [None, REMOTE_IMAGE_SIZE])
+    print(f"[info] {len(images)} boards of {np.mean([image.shape[0] * image.shape[1] for image in images]) / 1e6:.1f} Mpixels")
+
+    modes = [("one by one, full resolution", None)] + [(f"client, {n} in flight", n) for n in args.in_flight]
+    for name, in_flight in modes:
+        server = ReplayServer(recordings, latency=args.latency, bandwidth=args.bandwidth * 2**20, failure_rate=args.failure_rate)
+        url = server.start()
+        start = time.perf_counter()
+        if in_flight is None:
+            results = detect_one_by_one(url, images)
+            line = f"{sum(result is None for result in results)} images failed"
+        else:
+            client = RemoteDetectionClient(url, max_in_flight=in_flight)
+            try:
+                results = client.detect_batch(images)
+            finally:
+                client.close()
+            line = (f"{client.stats['retries']} retries, latency median {np.median(client.latencies)*1000:.0f} ms, "
+                    f"p95 {np.percentile(client.latencies, 95)*1000:.0f} ms")
+        elapsed = time.perf_counter() - start
+        server.stop()
+        print(f"[info] {name:<28} {elapsed:6.2f} s, {server.stats['bytes_received'] / len(images) / 1024:7.0f} KB per image, "
+              f"{server.stats['requests']} requests on {server.stats['connections']} connections, {server.stats['peak_in_flight']} in flight at most, "
+              f"{positions_read(boards, grids, positions, results)}/{len(images)} positions read, {line}")
@@ -0,0 +1,67 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from application.benchmarks.suite import *
+from application.server import GameServer, ServerClient
+
+def play_game(url, frames):
+    """Sends every frame of the test game to the server, returns the moves of the game and the rejected frames."""
+    client = ServerClient(url)
+    game_id = client.create_game()
+    rejected = 0
+    for image_path, _ in frames:
+        image = Path(image_path).read_bytes()
+        while True:
+            status, result = client.send_frame(game_id, image)
+            if status not in (429, 503):
+                break
+            rejected += 1
+            time.sleep(0.05)
+        if status != 200:
+            print(f"[error] [{game_id}] {result['error']}")
+            break
+    moves = client.game(game_id)["move_list"]
+    client.close()
+    return moves, rejected
+
+async def run(games, frames, detector, workers, batch_size, frame_store_slots=FRAME_STORE_SLOTS):
+    server = GameServer(detector, workers=workers, batch_size=batch_size, frame_store_slots=frame_store_slots)
+    port = await server.start("127.0.0.1", 0)
+    loop = asyncio.get_running_loop()
+    clients = ThreadPoolExecutor(max_workers=games)
+    start = time.perf_counter()
+    results = await asyncio.gather(*[loop.run_in_executor(clients, play_game, f"http://127.0.0.1:{port}", frames) for _ in range(games)])
+    elapsed = time.perf_counter() - start
+    metrics = server.metrics()
+    clients.shutdown()
+    await server.stop()
+    return results, elapsed, metrics
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Plays the test game on several concurrent sessions of the pipeline server.")
+    parser.add_argument("--games", type=int, default=4, help="number of concurrent games")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="processes running the board and grid detection")
+    parser.add_argument("--batch-size", type=int, default=DETECTION_BATCH_SIZE, help="images sent to the detector in a single call")
+    parser.add_argument("--detector-latency", type=float, default=0.15, help="seconds taken by each call to the fake detector")
+    parser.add_argument("--limit", type=int, default=None, help="use only the first N test images")
+    args = parser.parse_args()
+
+    frames = test_game_frames(args.limit)
+    positions = test_game_positions()
+    detector = FakeDetector(frames, positions, call_latency=args.detector_latency)
+    results, elapsed, metrics = asyncio.run(run(args.games, frames, detector, args.workers, args.batch_size))
+
+    expected = TEST_GAME_MOVES[:frames[-1][1]]
+    for session, (moves, rejected) in zip(metrics["sessions"], results):
+        latency = session["latency"]["total"]
+        print(f"[info] {session['game_id']}: {'ok' if moves == expected else 'WRONG MOVES'}, {session['frames']} frames, "
+              f"{rejected} rejected, median {latency['median_ms']:.0f} ms, p95 {latency['p95_ms']:.0f} ms")
+    total_frames = sum(session["frames"] for session in metrics["sessions"])
+    print(f"[info] {total_frames} frames in {elapsed:.1f} s ({total_frames / elapsed:.2f} frames/s), "
+          f"{metrics['detection_batches']} detection calls, mean batch size {metrics['mean_batch_size']:.1f}")
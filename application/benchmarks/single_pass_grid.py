@@ -0,0 +1,59 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+
+from application.benchmarks.suite import *
+from application.ifsc_chess.chessboard_operations import grid_stats
+
+def cell_side_spread(matrix: ChessboardMatrix):
+    """Returns: the longest over the shortest side of the cells, 1 for a perfectly even grid."""
+    widths = np.diff(matrix.corners[:, :, 0], axis=0)
+    heights = np.abs(np.diff(matrix.corners[:, :, 1], axis=1))
+    sides = np.concatenate([widths.ravel(), heights.ravel()])
+    return sides.max() / sides.min()
+
+def cells_disagreeing(matrix: ChessboardMatrix, reference: ChessboardMatrix):
+    """Returns: the number of cells of matrix whose center falls in another cell of reference."""
+    centers = (matrix.get_bottom_left_corners() + matrix.get_top_right_corners()) / 2
+    pieces = [{"x": x, "y": y} for x, y in centers.reshape(-1, 2)]
+    expected = np.stack(np.meshgrid(np.arange(8), np.arange(8), indexing="ij"), axis=-1).reshape(-1, 2)
+    return int((map_pieces_to_cells(reference, pieces) != expected).any(axis=1).sum())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compares the grid fitted to the first pass intersections with the grid of a second line detection.")
+    parser.add_argument("--limit", type=int, default=None, help="use only the first N test images")
+    args = parser.parse_args()
+
+    frames = test_game_frames(args.limit)
+    times = {True: [], False: []}
+    offsets, disagreements, spreads = [], [], {True: [], False: []}
+    for image_path, _ in frames:
+        img = cv2.imread(image_path)
+        grids = {}
+        for single_pass in (False, True):
+            try:
+                (_, warped, grid_points), elapsed = timed(locate_chessboard, img, MERGE_LINES, PYRAMID_WORKING_SIDE, None, single_pass)
+            except ValueError as error:
+                print(f"[error] {Path(image_path).name} ({'single' if single_pass else 'two'} pass): {error}")
+                continue
+            times[single_pass].append(elapsed)
+            grids[single_pass] = ChessboardMatrix(grid_points)
+            spreads[single_pass].append(cell_side_spread(grids[single_pass]))
+        if len(grids) == 2:
+            cell_size = np.array(warped.shape[1::-1]) / 8
+            offset = np.linalg.norm((grids[True].corners - grids[False].corners) / cell_size, axis=2)
+            offsets.append(offset)
+            disagreements.append(cells_disagreeing(grids[True], grids[False]))
+            print(f"[info] {Path(image_path).name}: grid offset median {np.median(offset):.3f} max {offset.max():.3f} cells, "
+                  f"{disagreements[-1]} cells disagreeing, cell side spread {spreads[True][-1]:.2f} single pass / {spreads[False][-1]:.2f} two passes")
+
+    offsets = np.array(offsets)
+    print(f"[info] two passes: median {np.median(times[False])*1000:.0f} ms per frame, cell side spread median {np.median(spreads[False]):.2f}, "
+          f"{len(times[False])}/{len(frames)} frames located")
+    print(f"[info] single pass: median {np.median(times[True])*1000:.0f} ms per frame, cell side spread median {np.median(spreads[True]):.2f}, "
+          f"{len(times[True])}/{len(frames)} frames located, {grid_stats['single_pass']} grids fitted, {grid_stats['second_pass'] - len(times[False])} second passes")
+    print(f"[info] saved {(np.median(times[False]) - np.median(times[True]))*1000:.0f} ms per frame; grid offset median {np.median(offsets):.3f} cells, "
+          f"{(offsets < 0.1).mean():.1%} of the points within 0.1 cell, worst {offsets.max():.3f} cells; "
+          f"{sum(disagreements)} of {64 * len(disagreements)} cells disagreeing")
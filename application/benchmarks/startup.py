@@ -0,0 +1,70 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+import os
+import re
+import subprocess
+import time
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).absolute().parent.parent.parent
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+def run_python(*args):
+    """Runs a fresh interpreter from the repository root, returns its stderr."""
+    env = dict(os.environ, PYTHONPATH=str(REPO_ROOT))
+    process = subprocess.run([sys.executable, *args], cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"'python {' '.join(args)}' failed:\n{process.stderr}")
+    return process.stderr
+
+def parse_importtime(output):
+    """
+    Parses the output of python -X importtime.
+    Returns: the self and cumulative time (in seconds) of every module, and the names of the top-level imports.
+    """
+    modules, top_level = {}, []
+    for match in IMPORTTIME_LINE.finditer(output):
+        self_us, cumulative_us, indent, name = match.groups()
+        modules[name] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+        if not indent:
+            top_level.append(name)
+    return modules, top_level
+
+def import_times(module, runs=5):
+    """Returns the cumulative import time of module on each cold interpreter, and the modules of the last run."""
+    times = []
+    for _ in range(runs):
+        modules, _ = parse_importtime(run_python("-X", "importtime", "-c", f"import {module}"))
+        times.append(modules[module][1])
+    return times, modules
+
+def cli_startup_times(runs=5):
+    """Returns the wall time of 'python -m application --help' on each run, interpreter startup included."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run_python("-m", "application", "--help")
+        times.append(time.perf_counter() - start)
+    return times
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measures the cold import time of the pipeline and the startup of the command line.")
+    parser.add_argument("--module", default="application.pipeline", help="module whose import is timed")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters started for each measure")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports listed")
+    args = parser.parse_args()
+
+    times, modules = import_times(args.module, args.runs)
+    print(f"[info] import {args.module}: median {np.median(times)*1000:.0f} ms over {args.runs} runs")
+    print("[info] slowest imports (self time):")
+    for name, (self_time, cumulative) in sorted(modules.items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f"[info]   {name:<48} {self_time*1000:7.1f} ms  (cumulative {cumulative*1000:.1f} ms)")
+    for heavy in ("roboflow", "sklearn", "chess.pgn"):
+        print(f"[info] {heavy} {'imported' if heavy in modules else 'not imported'}")
+
+    times = cli_startup_times(args.runs)
+    print(f"[info] python -m application --help: median {np.median(times)*1000:.0f} ms over {args.runs} runs")
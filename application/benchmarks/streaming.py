@@ -0,0 +1,54 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+import tempfile
+
+from application.benchmarks.suite import *
+from application.ifsc_chess.game_session import GameSession
+from application.streaming import BoardChangeDetector, iter_video_board_matrices, read_video_frames, write_video_from_images
+
+def selected_frames(video_path, stable_frames):
+    """Returns: the index and the image of each video frame the change detector selects."""
+    change_detector = BoardChangeDetector(stable_frames=stable_frames)
+    return [(index, frame) for index, frame in read_video_frames(str(video_path)) if change_detector.update(frame)]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Writes a video of the test game and reads the game back in streaming mode.")
+    parser.add_argument("--limit", type=int, default=8, help="use only the first N test images")
+    parser.add_argument("--frames-per-image", type=int, default=10, help="video frames showing each test image")
+    parser.add_argument("--blank-frames", type=int, default=3, help="black frames before the board comes into view")
+    parser.add_argument("--stable-frames", type=int, default=5, help="frames the board must stay still before a frame is processed")
+    parser.add_argument("--scale", type=float, default=0.5, help="scale of the test images in the video")
+    args = parser.parse_args()
+
+    frames = test_game_frames(args.limit)
+    positions = test_game_positions()
+    with tempfile.TemporaryDirectory() as directory:
+        video_path = Path(directory) / "test_game.mp4"
+        write_video_from_images([image_path for image_path, _ in frames], video_path, args.frames_per_image,
+                                scale=args.scale, blank_frames=args.blank_frames)
+
+        # the frames the streaming mode will process, recorded for the fake detector
+        detector = FakeDetector(call_latency=0)
+        expected = [args.blank_frames + k * args.frames_per_image + args.stable_frames for k in range(len(frames))]
+        selected = selected_frames(video_path, args.stable_frames)
+        assert [index for index, _ in selected] == expected, f"selected frames {[index for index, _ in selected]}, expected {expected}"
+        for (_, frame), (_, ply) in zip(selected, frames):
+            _, warped, grid_points = locate_chessboard(frame)
+            detector.record(warped, grid_points, positions[ply])
+
+        change_detector = BoardChangeDetector(stable_frames=args.stable_frames)
+        session = GameSession("video")
+        start = time.perf_counter()
+        for _, board_matrix in iter_video_board_matrices(str(video_path), detector, change_detector):
+            session.update(board_matrix)
+        elapsed = time.perf_counter() - start
+
+    total = args.blank_frames + len(frames) * args.frames_per_image
+    assert change_detector.stats == {"processed": len(frames), "skipped": total - len(frames)}, change_detector.stats
+    assert session.moves == TEST_GAME_MOVES[:frames[-1][1]], session.moves
+    change_detector.report()
+    print(f"[info] {len(session.moves)} moves read back from {len(frames)} test images in {elapsed:.1f} s, "
+          f"{args.blank_frames} frames before the board skipped")
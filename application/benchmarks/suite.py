@@ -0,0 +1,241 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+import hashlib
+import json
+import resource
+import time
+import tracemalloc
+
+import chess
+import numpy as np
+
+from application.pipeline import *
+from application.ifsc_chess.chess_logic import find_san_move, validate_board_matrix
+from application.benchmarks.startup import cli_startup_times, import_times
+
+TEST_IMAGES_DIR = Path(__file__).absolute().parent.parent.parent / "test_images"
+DEFAULT_BASELINE = Path(__file__).absolute().parent / "baseline.json"
+
+# Game recorded in test_images: image 0001 is the initial position and image N is the position after N-1 plies
+TEST_GAME_MOVES = [
+    "e4", "e5", "Nf3", "d6", "d4", "Bg4", "dxe5", "Bxf3", "Qxf3", "dxe5", "Bc4", "Nf6",
+    "Qb3", "Qe7", "Nc3", "c6", "Bg5", "b5", "Nxb5", "cxb5", "Bxb5+", "Nbd7", "O-O-O", "Rd8",
+    "Rxd7", "Rxd7", "Rd1", "Qe6", "Bxd7+", "Nxd7", "Qb8+", "Nxb8", "Rd8#",
+]
+
+def test_game_positions():
+    """Returns the chess.Board of every position of the test game, starting from the initial one."""
+    board = chess.Board()
+    positions = [board.copy()]
+    for move in TEST_GAME_MOVES:
+        board.push_san(move)
+        positions.append(board.copy())
+    return positions
+
+def test_game_frames(limit=None):
+    """Returns (image path, ply) of the test images available on disk."""
+    frames = []
+    for ply in range(len(TEST_GAME_MOVES) + 1):
+        path = TEST_IMAGES_DIR / f"{ply + 1:04d}.jpg"
+        if path.is_file():
+            frames.append((str(path), ply))
+    return frames[:limit]
+
+def synthetic_predictions(matrix: ChessboardMatrix, board: chess.Board):
+    """
+    Builds the predictions a perfect detector would return for the board,
+    one bounding box centered on the cell of each piece.
+    """
+    predictions = []
+    for square, piece in board.piece_map().items():
+        bottom_left, top_right = matrix.get_cell((chess.square_file(square), chess.square_rank(square))).get_coordinates()
+        color = "white" if piece.color == chess.WHITE else "black"
+        predictions.append({
+            "x": (bottom_left[0] + top_right[0]) / 2,
+            "y": (bottom_left[1] + top_right[1]) / 2,
+            "width": abs(top_right[0] - bottom_left[0]) * 0.8,
+            "height": abs(bottom_left[1] - top_right[1]) * 1.5,
+            "confidence": 0.9,
+            "class": f"{color}_{chess.piece_name(piece.piece_type)}",
+            "class_id": piece.piece_type,
+        })
+    return predictions
+
+class FakeDetector(Detector):
+    """
+    Answers with the synthetic predictions of the test game position shown on the image,
+    looked up by the hash of the warped board, after sleeping as long as a remote detector would take.
+    frames, positions: test images whose boards are located and recorded up front, more can be added with record.
+    """
+    def __init__(self, frames=(), positions=None, call_latency=0.15, image_latency=0.01):
+        self.predictions = {}
+        self.call_latency = call_latency
+        self.image_latency = image_latency
+        self.calls = 0
+        for image_path, ply in frames:
+            _, warped, grid_points = locate_chessboard(cv2.imread(image_path))
+            self.record(warped, grid_points, positions[ply])
+
+    def record(self, warped, grid_points, position: chess.Board):
+        """Answers the warped board with the synthetic predictions of position."""
+        self.predictions[hashlib.sha1(warped.tobytes()).hexdigest()] = synthetic_predictions(ChessboardMatrix(grid_points), position)
+
+    def predict_batch(self, images):
+        self.calls += 1
+        time.sleep(self.call_latency + self.image_latency * len(images))
+        return [self.predictions[hashlib.sha1(image.tobytes()).hexdigest()] for image in images]
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def latency_stats(times):
+    return {
+        "median": float(np.median(times)),
+        "p95": float(np.percentile(times, 95)),
+        "count": len(times),
+    }
+
+def benchmark_stages(frames, positions, recordings=None, repeat=1):
+    """
+    Times each stage of the pipeline separately on every frame.
+    recordings: predictions of each frame, or None to build synthetic ones from the known positions.
+    Returns: the latencies of each stage and the predictions used for each frame.
+    """
+    located_stages = ("select_chessboard_area", "map_chessboard")
+    times = {name: [] for name in ("locate_chessboard",) + located_stages + ("map_all_pieces", "export_to_fen", "find_san_move")}
+    used_predictions = []
+    # the corners and the grid are timed by the profiler stages inside locate_chessboard
+    profiler.enable()
+    for index, (image_path, ply) in enumerate(frames):
+        img = cv2.imread(image_path)
+        for _ in range(repeat):
+            profiler.start_frame(image_path)
+            (_, _, grid_points), elapsed = timed(locate_chessboard, img)
+            stages = profiler.end_frame()["stages"]
+            times["locate_chessboard"].append(elapsed)
+            for name in located_stages:
+                times[name].append(stages[name]["time"])
+            matrix = ChessboardMatrix(grid_points)
+            predictions = recordings[index] if recordings is not None else synthetic_predictions(matrix, positions[ply])
+            _, elapsed = timed(map_all_pieces, matrix, predictions)
+            times["map_all_pieces"].append(elapsed)
+            _, elapsed = timed(matrix.export_to_fen)
+            times["export_to_fen"].append(elapsed)
+        used_predictions.append(predictions)
+    profiler.disable()
+
+    # move inference does not depend on the images, so it runs over the whole game
+    for _ in range(repeat):
+        for before, after in zip(positions, positions[1:]):
+            _, elapsed = timed(find_san_move, before.copy(), after)
+            times["find_san_move"].append(elapsed)
+    return {name: latency_stats(values) for name, values in times.items()}, used_predictions
+
+def benchmark_replay(frames, positions, recordings):
+    """
+    Replays the whole game through the pipeline with recorded predictions.
+    Returns: the latency of each frame, the throughput and the peak memory.
+    """
+    tracemalloc.start()
+    frame_times = []
+    errors = 0
+    detector_args = (recordings,)
+    board_matrices = iter_board_matrices([path for path, _ in frames], "recorded", detector_args)
+    start = time.perf_counter()
+    frame_start = start
+    previous_ply = None
+    for (_, ply), (_, board_matrix) in zip(frames, board_matrices):
+        fen = board_matrix.export_to_fen()
+        if not validate_board_matrix(fen) or fen.split()[0] != positions[ply].board_fen():
+            errors += 1
+        elif previous_ply is not None and ply == previous_ply + 1:
+            find_san_move(positions[previous_ply].copy(), chess.Board(fen))
+        previous_ply = ply
+        now = time.perf_counter()
+        frame_times.append(now - frame_start)
+        frame_start = now
+    elapsed = time.perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        **latency_stats(frame_times),
+        "frames_per_second": len(frame_times) / elapsed,
+        "peak_traced_memory_mb": peak_memory / 2**20,
+        "errors": errors,
+    }
+
+def compare_with_baseline(results, baseline, threshold):
+    """
+    Returns the list of stages whose median latency regressed more than threshold, or that are in the baseline
+    but missing from the results, and the list of stages of the results not in the baseline.
+    """
+    regressions = [f"{name}: missing from the results" for name in baseline if name not in results]
+    new = [name for name in results if name not in baseline]
+    for name, stats in results.items():
+        if name not in baseline or "median" not in stats:
+            continue
+        limit = baseline[name]["median"] * (1 + threshold)
+        if stats["median"] > limit:
+            regressions.append(f"{name}: median {stats['median']*1000:.2f} ms > {limit*1000:.2f} ms")
+    return regressions, new
+
+def print_results(results):
+    print("============== BENCHMARK ===============")
+    for name, stats in results.items():
+        line = f"{name:<24} median {stats['median']*1000:9.2f} ms  p95 {stats['p95']*1000:9.2f} ms  ({stats['count']} runs)"
+        if "frames_per_second" in stats:
+            line += f"  {stats['frames_per_second']:.2f} frames/s  peak {stats['peak_traced_memory_mb']:.0f} MB  {stats['errors']} errors"
+        print(line)
+    print(f"max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    print("========================================")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the recognition pipeline on the test images, offline.")
+    parser.add_argument("--frames", type=int, help="number of test images to use (default: all)")
+    parser.add_argument("--repeat", type=int, default=1, help="times each stage runs per frame")
+    parser.add_argument("--recordings", help="JSON file with the recorded predictions of each frame (default: synthetic predictions)")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="baseline file to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed median regression over the baseline (0.2 = 20%%)")
+    parser.add_argument("--output", help="write the results to a JSON file")
+    parser.add_argument("--startup-runs", type=int, default=5, help="fresh interpreters started to time the imports and the command line (0 to skip)")
+    args = parser.parse_args()
+
+    frames = test_game_frames(args.frames)
+    positions = test_game_positions()
+    recordings = RecordedDetector(args.recordings).recordings if args.recordings else None
+
+    results, recordings = benchmark_stages(frames, positions, recordings, args.repeat)
+    results["game_replay"] = benchmark_replay(frames, positions, recordings)
+    if args.startup_runs > 0:
+        results["import_pipeline"] = latency_stats(import_times("application.pipeline", args.startup_runs)[0])
+        results["cli_startup"] = latency_stats(cli_startup_times(args.startup_runs))
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"[info] Baseline saved to '{args.baseline}'.")
+    elif Path(args.baseline).is_file():
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if args.startup_runs == 0:
+            baseline = {name: stats for name, stats in baseline.items() if name not in ("import_pipeline", "cli_startup")}
+        regressions, new = compare_with_baseline(results, baseline, args.threshold)
+        if new:
+            print(f"[info] Not in the baseline, not compared: {', '.join(new)}")
+        if regressions:
+            print(f"[error] Performance regressions over {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"[error]   {regression}")
+            exit(1)
+        print(f"[info] No regression over {args.threshold:.0%} of the baseline.")
@@ -9,9 +9,85 @@ ROBOFLOW_API_KEY = os.getenv("ROBOFLOW_API_KEY")
 ROBOFLOW_PROJECT_ID = os.getenv("ROBOFLOW_PROJECT_ID")
 ROBOFLOW_MODEL_VERSION = os.getenv("ROBOFLOW_MODEL_VERSION")
 
+DETECTOR_BACKEND = os.getenv("DETECTOR_BACKEND", "roboflow") # roboflow, remote, yolo, onnx or recorded
+REMOTE_DETECTION_URL = os.getenv("REMOTE_DETECTION_URL", "https://detect.roboflow.com")
+YOLO_WEIGHTS_PATH = os.getenv("YOLO_WEIGHTS_PATH")
+ONNX_MODEL_PATH = os.getenv("ONNX_MODEL_PATH")
+ONNX_PRECISION = os.getenv("ONNX_PRECISION", "fp32") # fp32 or fp16
+# classes of the ONNX model in the order of its outputs, the alphabetical order of the Roboflow dataset export
+ONNX_CLASS_NAMES = os.getenv("ONNX_CLASS_NAMES", ",".join(sorted(
+    f"{color}_{piece}" for color in ("white", "black") for piece in ("pawn", "knight", "bishop", "rook", "queen", "king")
+))).split(",")
+
 # globals
 
 SHOW_IMAGES = False
 
+# debug overlays written by the background debug writer (--debug-output)
+DEBUG_MAX_PENDING = 32 # overlays waiting to be rendered before new ones are dropped
+DEBUG_OVERLAY_SIDE = 1280 # longest side of the overlays written to disk, None for the original resolution
+DEBUG_SHEET_THUMBNAIL_SIDE = 320 # side of each thumbnail of the contact sheets
+
 OBJECT_DETECTION_MIN_CONFIDENCE = 50 # 50% confidence
-OBJECT_DETECTION_MIN_OVERLAP = 30 # 30% overlap
\ No newline at end of file
+OBJECT_DETECTION_MIN_OVERLAP = 30 # 30% overlap
+
+# image processing parameters
+
+# pixel sizes are tuned for images whose longest side is REFERENCE_IMAGE_SIDE
+REFERENCE_IMAGE_SIDE = 4624
+MEDIAN_BLUR_SIZE = 7
+DILATION_KERNEL_SIZE = 3
+CANNY_THRESHOLDS = (30, 120)
+HOUGH_THRESHOLD = 100
+HOUGH_MIN_LINE_LENGTH = 200
+HOUGH_MAX_LINE_GAP = 20
+GRID_CLUSTER_EPS_DIVISOR = 12 # DBSCAN eps = warped image height / 12
+GRID_CLUSTER_MIN_SAMPLES = 5
+
+PYRAMID_WORKING_SIDE = 1600 # longest side of the downscaled copy used to find the board and grid, None to use the full image
+MERGE_LINES = False # merge duplicated Hough lines before detecting intersections
+MAX_GAP_PLIES = 3 # longest sequence of moves searched when frames are missing
+MOVE_INFERENCE_MAX_MISMATCHES = 1 # squares misdetected that are tolerated when a single legal move explains the rest of the position
+VECTORIZED_PIECE_MAPPING = True # map the pieces to cells with the grid homography instead of scanning the cells
+SINGLE_PASS_GRID = True # fit the grid to the intersections found with the board corners instead of detecting the lines of the warped board again
+GRID_FIT_MIN_NODES = 72 # grid points that must be found among the intersections for the fitted grid to be used
+GRID_FIT_MAX_RESIDUAL = 0.05 # maximum median distance, in cells, between these points and the fitted grid
+MULTI_BOARD_MIN_AREA = 0.01 # smallest board region searched on a frame with several boards, as a fraction of the frame area
+MULTI_BOARD_MARGIN = 0.08 # margin added around each board region, as a fraction of its size
+MULTI_BOARD_WORKING_SIDE = 1000 # longest side of the downscaled copy of each board region, a board fills more of its region than of a frame
+MULTI_BOARD_CLOSING_SIZE = 45 # pixels (at the reference resolution) that join the lines of a board into a single region
+
+# results cache
+
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "results"))
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024 # 256 MB
+
+# pipeline server
+
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", 8765))
+SERVER_WORKERS = 2 # processes running the board and grid detection
+SERVER_MAX_PENDING_FRAMES = 32 # frames being processed by the whole server before new ones are refused
+SERVER_MAX_SESSION_FRAMES = 4 # frames being processed for a single game before new ones are refused
+SERVER_MAX_UPLOAD_BYTES = 16 * 1024 * 1024 # 16 MB
+DETECTION_BATCH_SIZE = 8 # images sent to the detector in a single call
+DETECTION_BATCH_DELAY = 0.02 # seconds a batch waits for images of other games
+
+# remote detection client (remote backend)
+
+REMOTE_IMAGE_SIZE = 640 # longest side of the images sent, the input size of the model
+REMOTE_JPEG_QUALITY = 90
+REMOTE_MAX_IN_FLIGHT = 4 # requests sent at once by each client
+REMOTE_TIMEOUT = (3.05, 30) # seconds to connect and to read the answer
+REMOTE_MAX_RETRIES = 3
+REMOTE_BACKOFF = 0.5 # seconds, the wait before the n-th retry is random between 0 and REMOTE_BACKOFF * 2^n
+
+# frame store shared by the server and its worker processes
+
+FRAME_STORE_SLOTS = 2 * SERVER_WORKERS # a frame located by each worker and one waiting for it, 0 to pickle the frames instead
+FRAME_STORE_SLOT_BYTES = 3072 * 3072 * 3 # a warped board of the reference camera (27 MB), the frames that don't fit are pickled
+
+# incremental piece detection
+
+INCREMENTAL_CHANGE_THRESHOLD = 8.0 # mean absolute difference of a cell thumbnail (0 to 255) above the median of the board
+INCREMENTAL_MAX_CHANGED_CELLS = 16 # changed cells above which the whole board is detected again
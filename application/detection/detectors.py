@@ -0,0 +1,248 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import json
+
+from application.config import *
+from application.detection.roboflow_detection import load_roboflow_model, roboflow_detect_objects
+from application.detection.onnx_detection import load_onnx_model, onnx_detect_objects
+from application.detection.remote_detection import RemoteDetectionClient
+
+class Detector:
+    """
+    Base class for the chess piece detection backends.
+    Every backend returns, for each image, a list of prediction dicts with the keys
+    "x", "y" (bounding box center), "width", "height", "confidence" (0 to 1), "class" and "class_id",
+    the same shape used by map_all_pieces and draw_bounding_boxes.
+    batched: True if predict_batch runs all the images in a single call of the model; otherwise
+    each image costs a request (or a forward pass) of its own, and callers should send fewer, larger images.
+    """
+    batched = False
+
+    def predict(self, image):
+        return self.predict_batch([image])[0]
+
+    def predict_batch(self, images):
+        raise NotImplementedError
+
+    def identifier(self):
+        """Returns a string identifying the model used by the backend."""
+        return type(self).__name__
+
+
+def make_prediction(x, y, width, height, confidence, class_name, class_id):
+    return {
+        "x": float(x),
+        "y": float(y),
+        "width": float(width),
+        "height": float(height),
+        "confidence": float(confidence),
+        "class": class_name,
+        "class_id": int(class_id),
+    }
+
+
+class RoboflowDetector(Detector):
+    """
+    Sends each image to the model hosted on the Roboflow server.
+    The model is loaded from the server on the first prediction, so creating the detector
+    (in every worker process, or when all the results are cached) doesn't touch the network.
+    """
+    def __init__(self, model=None):
+        self._model = model
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = load_roboflow_model()
+        return self._model
+
+    def predict_batch(self, images):
+        predictions = []
+        for image in images:
+            result = roboflow_detect_objects(self.model, image).json()
+            predictions.append([
+                make_prediction(p["x"], p["y"], p["width"], p["height"], p["confidence"], p["class"], p.get("class_id", -1))
+                for p in result["predictions"]
+            ])
+        return predictions
+
+    def identifier(self):
+        return f"roboflow:{ROBOFLOW_PROJECT_ID}/{ROBOFLOW_MODEL_VERSION}"
+
+
+class RemoteDetector(Detector):
+    """
+    Sends the images to the hosted model over a pooled HTTP client, several at once, downscaled
+    to the input size of the model, with timeouts and retries, see RemoteDetectionClient.
+    The client (and its connections) is created on the first prediction.
+    url: Roboflow inference API, or a local ReplayServer.
+    """
+    def __init__(self, url=REMOTE_DETECTION_URL, **client_args):
+        self.url = url
+        self.client_args = client_args
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = RemoteDetectionClient(self.url, **self.client_args)
+        return self._client
+
+    def predict_batch(self, images):
+        print(f"[debug] requested object detection of {len(images)} image(s) to {self.url}")
+        return [
+            [make_prediction(p["x"], p["y"], p["width"], p["height"], p["confidence"], p["class"], p.get("class_id", -1)) for p in predictions]
+            for predictions in self.client.detect_batch(images)
+        ]
+
+    def report(self):
+        if self._client is not None:
+            self._client.report()
+
+    def identifier(self):
+        size = self.client_args.get("image_size", REMOTE_IMAGE_SIZE)
+        return f"roboflow:{ROBOFLOW_PROJECT_ID}/{ROBOFLOW_MODEL_VERSION}:{size}"
+
+
+class YoloDetector(Detector):
+    """Runs a local YOLO weights file on the CPU with ultralytics, a whole batch of images per call."""
+    batched = True
+
+    def __init__(self, weights_path=YOLO_WEIGHTS_PATH, device="cpu", image_size=640):
+        if weights_path is None or not Path(weights_path).is_file():
+            raise ValueError(f"Error: YOLO weights file '{weights_path}' not found.")
+        try:
+            from ultralytics import YOLO
+        except ImportError as error:
+            raise ImportError("Error: the yolo backend needs ultralytics, install it with 'pip install -r requirements-yolo.txt'.") from error
+        self.weights_path = str(weights_path)
+        self.model = YOLO(self.weights_path)
+        self.device = device
+        self.image_size = image_size
+
+    def predict_batch(self, images):
+        print(f"[debug] running local object detection on {len(images)} image(s)")
+        results = self.model.predict(
+            list(images),
+            conf=OBJECT_DETECTION_MIN_CONFIDENCE / 100,
+            iou=OBJECT_DETECTION_MIN_OVERLAP / 100,
+            imgsz=self.image_size,
+            device=self.device,
+            verbose=False,
+        )
+        predictions = []
+        for result in results:
+            boxes = result.boxes
+            predictions.append([
+                make_prediction(x, y, width, height, confidence, result.names[int(class_id)], class_id)
+                for (x, y, width, height), confidence, class_id
+                in zip(boxes.xywh.tolist(), boxes.conf.tolist(), boxes.cls.tolist())
+            ])
+        return predictions
+
+    def identifier(self):
+        return f"yolo:{Path(self.weights_path).name}"
+
+
+class OnnxDetector(Detector):
+    """
+    Runs a YOLO model exported to ONNX with the OpenCV DNN module on the CPU, without torch.
+    The letterboxing, confidence filter and NMS are done in NumPy with the same thresholds
+    given to the Roboflow model. Exported models have a fixed batch size of 1, so the images
+    of a batch run one at a time.
+    class_names: names of the classes in the order of the model outputs.
+    precision: "fp32" or "fp16", see load_onnx_model.
+    """
+    def __init__(self, model_path=ONNX_MODEL_PATH, class_names=ONNX_CLASS_NAMES, precision=ONNX_PRECISION, image_size=640):
+        self.net = load_onnx_model(model_path, precision)
+        self.model_path = str(model_path)
+        self.class_names = list(class_names)
+        self.precision = precision
+        self.image_size = image_size
+
+    def predict_batch(self, images):
+        predictions = []
+        for image in images:
+            boxes, scores, class_ids = onnx_detect_objects(self.net, image, len(self.class_names), self.image_size)
+            predictions.append([
+                make_prediction(x, y, width, height, score, self.class_names[class_id], class_id)
+                for (x, y, width, height), score, class_id in zip(boxes.tolist(), scores.tolist(), class_ids.tolist())
+            ])
+        return predictions
+
+    def identifier(self):
+        return f"onnx:{Path(self.model_path).name}:{self.precision}"
+
+
+class RecordedDetector(Detector):
+    """
+    Deterministic backend that replays recorded predictions, one recording per image, in call order.
+    recordings: list with the predictions of each image, or the path of a JSON file
+    saved by RecordingDetector.
+    """
+    def __init__(self, recordings):
+        if isinstance(recordings, (str, Path)):
+            self.source = str(recordings)
+            with open(recordings) as file:
+                recordings = json.load(file)
+        else:
+            self.source = "memory"
+        self.recordings = list(recordings)
+        self.position = 0
+
+    def predict_batch(self, images):
+        if self.position + len(images) > len(self.recordings):
+            raise ValueError(f"Error: only {len(self.recordings)} recorded predictions are available.")
+        predictions = self.recordings[self.position:self.position + len(images)]
+        self.position += len(images)
+        return [[dict(prediction) for prediction in image_predictions] for image_predictions in predictions]
+
+    def rewind(self):
+        self.position = 0
+
+    def identifier(self):
+        return f"recorded:{self.source}"
+
+
+class RecordingDetector(Detector):
+    """Wraps another backend and records its predictions so they can be replayed by RecordedDetector."""
+    def __init__(self, detector):
+        self.detector = detector
+        self.recordings = []
+
+    @property
+    def batched(self):
+        return self.detector.batched
+
+    def predict_batch(self, images):
+        predictions = self.detector.predict_batch(images)
+        self.recordings.extend(predictions)
+        return predictions
+
+    def save(self, output_path):
+        with open(output_path, "w") as file:
+            json.dump(self.recordings, file, indent=1)
+        print(f"[debug] {len(self.recordings)} recorded predictions saved to '{output_path}'.")
+
+    def identifier(self):
+        return self.detector.identifier()
+
+
+DETECTOR_BACKENDS = {
+    "roboflow": RoboflowDetector,
+    "remote": RemoteDetector,
+    "yolo": YoloDetector,
+    "onnx": OnnxDetector,
+    "recorded": RecordedDetector,
+}
+
+def load_detector(backend=DETECTOR_BACKEND, *args, **kwargs):
+    """
+    Creates the detection backend with the given name.
+    backend: "roboflow", "remote", "yolo", "onnx" or "recorded".
+    """
+    if backend not in DETECTOR_BACKENDS:
+        raise ValueError(f"Error: unknown detector backend '{backend}'. Options: {', '.join(DETECTOR_BACKENDS)}.")
+    return DETECTOR_BACKENDS[backend](*args, **kwargs)
@@ -0,0 +1,110 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import cv2
+import numpy as np
+
+from application.config import *
+
+ONNX_PRECISIONS = {
+    "fp32": cv2.dnn.DNN_TARGET_CPU,
+    "fp16": cv2.dnn.DNN_TARGET_CPU_FP16,
+}
+
+def load_onnx_model(model_path, precision="fp32"):
+    """
+    Loads a YOLO model exported to ONNX with the OpenCV DNN module, running on the CPU.
+    precision: "fp32", or "fp16" to compute in half precision (OpenCV only does it on ARM CPUs,
+    elsewhere it falls back to fp32). Models quantized to INT8 (QDQ nodes) are loaded as they are.
+    """
+    if model_path is None or not Path(model_path).is_file():
+        raise ValueError(f"Error: ONNX model file '{model_path}' not found.")
+    if precision not in ONNX_PRECISIONS:
+        raise ValueError(f"Error: unknown ONNX precision '{precision}'. Options: {', '.join(ONNX_PRECISIONS)}.")
+    net = cv2.dnn.readNetFromONNX(str(model_path))
+    net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+    net.setPreferableTarget(ONNX_PRECISIONS[precision])
+    return net
+
+def letterbox(image, size=640, fill=114):
+    """
+    Resizes the image to fit a size x size square keeping its aspect ratio, and pads the rest with fill.
+    Returns: the padded image, the resize ratio and the (x, y) padding, to map the boxes back to the image.
+    """
+    height, width = image.shape[:2]
+    ratio = min(size / height, size / width)
+    new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+    pad_x, pad_y = (size - new_width) // 2, (size - new_height) // 2
+    padded = np.full((size, size, 3), fill, dtype=np.uint8)
+    interpolation = cv2.INTER_AREA if ratio < 1 else cv2.INTER_LINEAR
+    padded[pad_y:pad_y + new_height, pad_x:pad_x + new_width] = cv2.resize(image, (new_width, new_height), interpolation=interpolation)
+    return padded, ratio, (pad_x, pad_y)
+
+def box_iou(box, boxes):
+    """IoU of a box (x0, y0, x1, y1) with every row of boxes."""
+    width = np.clip(np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0]), 0, None)
+    height = np.clip(np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1]), 0, None)
+    intersection = width * height
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return intersection / (areas + (box[2] - box[0]) * (box[3] - box[1]) - intersection + 1e-9)
+
+def non_max_suppression(boxes, scores, class_ids, iou_threshold):
+    """
+    Keeps, for each class, the highest scored boxes that overlap less than iou_threshold with the ones kept before.
+    boxes: np.ndarray (n, 4) as (x0, y0, x1, y1).
+    Returns: the indices of the kept boxes, by decreasing score.
+    """
+    # shifting each class to its own region of the plane makes a single pass class-aware
+    offsets = class_ids[:, None] * (boxes.max() - boxes.min() + 1)
+    shifted = boxes + offsets
+    order = np.argsort(-scores)
+    keep = []
+    while order.size > 0:
+        best = order[0]
+        keep.append(best)
+        order = order[1:][box_iou(shifted[best], shifted[order[1:]]) <= iou_threshold]
+    return np.array(keep, dtype=int)
+
+def decode_yolo_output(output, num_classes, ratio, padding, min_confidence, iou_threshold):
+    """
+    Decodes the raw output of a YOLO model into boxes of the original image.
+    output: (1, 4 + num_classes, anchors) for YOLOv8/YOLO11, or (1, anchors, 5 + num_classes) for YOLOv5
+    with the objectness before the class scores. Boxes are (cx, cy, width, height) in letterboxed pixels.
+    min_confidence, iou_threshold: 0 to 1.
+    Returns: np.ndarray (n, 4) with the (cx, cy, width, height) of each kept box in the image, its score and class.
+    """
+    output = np.squeeze(output, axis=0)
+    if output.shape[0] == 4 + num_classes:
+        rows = output.T
+        class_scores = rows[:, 4:]
+    elif output.shape[1] == 5 + num_classes:
+        rows = output
+        class_scores = rows[:, 5:] * rows[:, 4:5]
+    else:
+        raise ValueError(f"Error: unexpected YOLO output shape {output.shape} for {num_classes} classes.")
+    class_ids = np.argmax(class_scores, axis=1)
+    scores = class_scores[np.arange(len(class_ids)), class_ids]
+    selected = scores >= min_confidence
+    rows, scores, class_ids = rows[selected], scores[selected], class_ids[selected]
+    if len(rows) == 0:
+        return np.empty((0, 4), dtype=np.float32), scores, class_ids
+
+    centers = (rows[:, :2] - padding) / ratio
+    sizes = rows[:, 2:4] / ratio
+    corners = np.hstack([centers - sizes / 2, centers + sizes / 2])
+    keep = non_max_suppression(corners, scores, class_ids, iou_threshold)
+    return np.hstack([centers, sizes])[keep], scores[keep], class_ids[keep]
+
+def onnx_detect_objects(net, image, num_classes, image_size=640,
+                        min_confidence=OBJECT_DETECTION_MIN_CONFIDENCE, min_overlap=OBJECT_DETECTION_MIN_OVERLAP):
+    """
+    Runs the ONNX model on a BGR image.
+    min_confidence, min_overlap: percentages, like the ones given to the Roboflow model.
+    Returns: the boxes (cx, cy, width, height) in image pixels, their scores and class indices, see decode_yolo_output.
+    """
+    print("[debug] running ONNX object detection")
+    padded, ratio, padding = letterbox(image, image_size)
+    net.setInput(cv2.dnn.blobFromImage(padded, 1 / 255, swapRB=True))
+    output = net.forward()
+    return decode_yolo_output(output, num_classes, ratio, np.array(padding), min_confidence / 100, min_overlap / 100)
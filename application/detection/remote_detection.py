@@ -0,0 +1,132 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from application.config import *
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def encode_for_model(image, image_size=REMOTE_IMAGE_SIZE, quality=REMOTE_JPEG_QUALITY):
+    """
+    Downscales the image to image_size pixels on its longest side, the input size of the model,
+    and encodes it as JPEG. The model would resize a larger image anyway, so the extra pixels are only upload time.
+    image_size: None to send the image at its own resolution.
+    Returns: the JPEG bytes and the scale of the encoded image over the original one.
+    """
+    scale = 1.0 if image_size is None else min(1.0, image_size / max(image.shape[:2]))
+    if scale < 1.0:
+        image = cv2.resize(image, (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale))),
+                           interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Error: could not encode the image as JPEG.")
+    return encoded.tobytes(), scale
+
+def rescale_predictions(predictions, scale):
+    """Moves the bounding boxes found on the encoded image back to the original image."""
+    if scale == 1.0:
+        return predictions
+    return [{**p, "x": p["x"] / scale, "y": p["y"] / scale, "width": p["width"] / scale, "height": p["height"] / scale}
+            for p in predictions]
+
+class RemoteDetectionClient:
+    """
+    Client of a hosted detection model with the API of the Roboflow inference server: the image is POSTed,
+    base64 encoded, to <url>/<project>/<version> and the answer is a JSON object with its "predictions".
+    Keeps a pool of open connections, sends up to max_in_flight images at once and retries the requests
+    that fail on the network or with a 429/5xx status, waiting an exponential backoff with full jitter.
+    Every image is downscaled to the input size of the model before being sent, see encode_for_model.
+    With record, the predictions are kept by the hash of the image sent, to be replayed by a ReplayServer (replay_server.py).
+    """
+    def __init__(self, url=REMOTE_DETECTION_URL, project=ROBOFLOW_PROJECT_ID, version=ROBOFLOW_MODEL_VERSION, api_key=ROBOFLOW_API_KEY,
+                 max_in_flight=REMOTE_MAX_IN_FLIGHT, timeout=REMOTE_TIMEOUT, max_retries=REMOTE_MAX_RETRIES,
+                 backoff=REMOTE_BACKOFF, image_size=REMOTE_IMAGE_SIZE, quality=REMOTE_JPEG_QUALITY, record=False):
+        # requests takes longer to import than the rest of the pipeline
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.requests = requests
+        self.endpoint = f"{url.rstrip('/')}/{project}/{version}"
+        self.params = {"api_key": api_key, "confidence": OBJECT_DETECTION_MIN_CONFIDENCE, "overlap": OBJECT_DETECTION_MIN_OVERLAP}
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="remote-detection")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.image_size = image_size
+        self.quality = quality
+        self.recordings = {} if record else None
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "bytes_sent": 0, "bytes_received": 0}
+        self.latencies = [] # seconds of each image, retries included
+
+    def detect(self, image):
+        """Returns: the predictions of the image, in its own coordinates."""
+        start = time.perf_counter()
+        encoded, scale = encode_for_model(image, self.image_size, self.quality)
+        body = base64.b64encode(encoded)
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(self.endpoint, params=self.params, data=body, timeout=self.timeout,
+                                             headers={"Content-Type": "application/x-www-form-urlencoded"})
+                with self.lock:
+                    self.stats["requests"] += 1
+                    self.stats["bytes_sent"] += len(body)
+                    self.stats["bytes_received"] += len(response.content)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    break
+                error = f"HTTP {response.status_code}"
+            except (self.requests.ConnectionError, self.requests.Timeout) as exception:
+                with self.lock:
+                    self.stats["requests"] += 1
+                error = type(exception).__name__
+            if attempt == self.max_retries:
+                with self.lock:
+                    self.stats["failures"] += 1
+                raise RuntimeError(f"Error: remote detection failed after {attempt + 1} attempts ({error}).")
+            with self.lock:
+                self.stats["retries"] += 1
+            print(f"[debug] remote detection failed ({error}), retrying")
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+        predictions = response.json()["predictions"]
+        if self.recordings is not None:
+            with self.lock:
+                self.recordings[hashlib.sha1(encoded).hexdigest()] = predictions
+        with self.lock:
+            self.latencies.append(time.perf_counter() - start)
+        return rescale_predictions(predictions, scale)
+
+    def detect_batch(self, images):
+        """Sends the images concurrently, at most max_in_flight at a time. Returns: the predictions of each image, in order."""
+        return list(self.executor.map(self.detect, images))
+
+    def save_recordings(self, output_path):
+        with open(output_path, "w") as file:
+            json.dump(self.recordings, file)
+        print(f"[debug] {len(self.recordings)} recorded remote predictions saved to '{output_path}'.")
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
+
+    def report(self):
+        if not self.latencies:
+            return
+        print(f"[info] Remote detection: {len(self.latencies)} images, {self.stats['requests']} requests, {self.stats['retries']} retries, "
+              f"{self.stats['failures']} failures, {self.stats['bytes_sent'] / 2**20:.1f} MB sent, "
+              f"latency median {np.median(self.latencies)*1000:.0f} ms, p95 {np.percentile(self.latencies, 95)*1000:.0f} ms")
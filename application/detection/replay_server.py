@@ -0,0 +1,112 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the hosted model, answering with the predictions recorded for each image,
+    found by the hash of the JPEG sent (see RemoteDetectionClient record).
+    latency: seconds added to every answer.
+    bandwidth: bytes per second of the simulated upload link, shared by every connection, or None.
+    failure_rate: fraction of the requests answered with 503, to exercise the retries.
+    """
+    daemon_threads = True
+
+    def __init__(self, recordings, host="127.0.0.1", port=0, latency=0.0, bandwidth=None, failure_rate=0.0, seed=0):
+        super().__init__((host, port), ReplayHandler)
+        if isinstance(recordings, (str, Path)):
+            with open(recordings) as file:
+                recordings = json.load(file)
+        self.recordings = recordings
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.link = threading.Lock() # the uploads of concurrent requests go through the link one after the other
+        self.stats = {"requests": 0, "failed": 0, "unknown": 0, "bytes_received": 0, "connections": 0, "peak_in_flight": 0}
+        self.in_flight = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serves on a background thread, returns the URL of the server."""
+        threading.Thread(target=self.serve_forever, name="replay-server", daemon=True).start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keeps the connections open, like the hosted API
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.stats["connections"] += 1
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with server.lock:
+            server.stats["requests"] += 1
+            server.stats["bytes_received"] += len(body)
+            server.in_flight += 1
+            server.stats["peak_in_flight"] = max(server.stats["peak_in_flight"], server.in_flight)
+            fail = server.random.random() < server.failure_rate
+        try:
+            if server.bandwidth:
+                with server.link:
+                    time.sleep(len(body) / server.bandwidth)
+            time.sleep(server.latency)
+            predictions = server.recordings.get(hashlib.sha1(base64.b64decode(body)).hexdigest())
+            if fail or predictions is None:
+                with server.lock:
+                    server.stats["failed" if fail else "unknown"] += 1
+            if fail:
+                self.answer(503, {"message": "Service temporarily unavailable"})
+            elif predictions is None:
+                self.answer(404, {"message": f"No recorded predictions for the image sent to {urlsplit(self.path).path}"})
+            else:
+                self.answer(200, {"predictions": predictions})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def answer(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serves recorded predictions with the API of the hosted detection model.")
+    parser.add_argument("recordings", help="JSON file of predictions by image hash, saved by RemoteDetectionClient.save_recordings")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every answer")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of the requests answered with 503")
+    args = parser.parse_args()
+
+    server = ReplayServer(args.recordings, port=args.port, latency=args.latency, failure_rate=args.failure_rate)
+    print(f"[info] Replaying {len(server.recordings)} recorded images on {server.url}, point REMOTE_DETECTION_URL to it")
+    server.serve_forever()
@@ -2,10 +2,11 @@ import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
 
-from roboflow import Roboflow
 from application.config import *
 
 def load_roboflow_model():
+    # roboflow (and the requests stack it brings) takes longer to import than the rest of the pipeline
+    from roboflow import Roboflow
     rf = Roboflow(api_key=ROBOFLOW_API_KEY)
     project = rf.workspace().project(ROBOFLOW_PROJECT_ID)
     model = project.version(ROBOFLOW_MODEL_VERSION).model
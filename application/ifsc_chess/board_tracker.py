@@ -0,0 +1,90 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import time
+
+from application.ifsc_chess.chessboard_operations import *
+
+class BoardTracker:
+    """
+    Reuses the board corners and the 81 grid points between frames of a fixed camera.
+    The board is fully detected on the first frame. On the next frames, a grayscale patch around
+    each stored corner is searched in a small window of the new frame by normalized cross-correlation;
+    if every corner is still found in place, the stored perspective and grid are reused,
+    otherwise the board is detected again.
+    patch_size: side of the patch around each corner, in pixels.
+    search_margin: how far around the stored position each patch is searched, in pixels.
+    min_correlation: minimum normalized correlation for a corner to be considered found.
+    max_shift: maximum displacement of a corner, in pixels, to keep the stored geometry.
+    """
+    def __init__(self, patch_size=96, search_margin=24, min_correlation=0.8, max_shift=3):
+        self.patch_size = patch_size
+        self.search_margin = search_margin
+        self.min_correlation = min_correlation
+        self.max_shift = max_shift
+        self.corners = None
+        self.grid_points = None
+        self.patches = None
+        self.history = []  # (path taken, seconds) of each frame
+
+    def _gray(self, img):
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+
+    def _window(self, img_shape, corner, half_size):
+        height, width = img_shape[:2]
+        x, y = int(round(corner[0])), int(round(corner[1]))
+        x0, y0 = max(x - half_size, 0), max(y - half_size, 0)
+        x1, y1 = min(x + half_size, width), min(y + half_size, height)
+        return x0, y0, x1, y1
+
+    def _extract_patches(self, gray):
+        patches = []
+        for corner in self.corners:
+            x0, y0, x1, y1 = self._window(gray.shape, corner, self.patch_size // 2)
+            patches.append((x0, y0, gray[y0:y1, x0:x1].copy()))
+        return patches
+
+    def is_board_in_place(self, img):
+        """Checks if the board corners are still where they were found."""
+        gray = self._gray(img)
+        for corner, (patch_x, patch_y, patch) in zip(self.corners, self.patches):
+            x0, y0, x1, y1 = self._window(gray.shape, corner, self.patch_size // 2 + self.search_margin)
+            search_area = gray[y0:y1, x0:x1]
+            if search_area.shape[0] < patch.shape[0] or search_area.shape[1] < patch.shape[1]:
+                return False
+            scores = cv2.matchTemplate(search_area, patch, cv2.TM_CCOEFF_NORMED)
+            _, best_score, _, (best_x, best_y) = cv2.minMaxLoc(scores)
+            shift = np.hypot(x0 + best_x - patch_x, y0 + best_y - patch_y)
+            if best_score < self.min_correlation or shift > self.max_shift:
+                return False
+        return True
+
+    def detect(self, img):
+        """Detects the board corners and grid from scratch and stores them for the next frames."""
+        self.corners, warped, self.grid_points = locate_chessboard(img)
+        self.patches = self._extract_patches(self._gray(img))
+        return warped
+
+    def locate(self, img):
+        """
+        Finds the board in the frame, reusing the stored geometry when the camera did not move.
+        Returns: the board corners, the warped board and the 81 grid points.
+        """
+        start = time.perf_counter()
+        if self.corners is not None and self.is_board_in_place(img):
+            path = "tracked"
+            warped = warp_perspective(img, self.corners)
+        else:
+            path = "detected"
+            warped = self.detect(img)
+        elapsed = time.perf_counter() - start
+        self.history.append((path, elapsed))
+        print(f"[debug] board {path} in {elapsed*1000:.0f} ms")
+        return self.corners, warped, self.grid_points
+
+    def report(self):
+        for path in ("tracked", "detected"):
+            times = [elapsed for taken, elapsed in self.history if taken == path]
+            if times:
+                print(f"[info] Board {path} in {len(times)} frames, mean {1000 * sum(times) / len(times):.0f} ms")
@@ -0,0 +1,73 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import chess
+import numpy as np
+
+from application.ifsc_chess.chessboard import ChessboardMatrix
+from application.ifsc_chess.move_inference import board_to_codes, infer_move
+from application.utils.profiling import profiled
+
+def is_conversion_successful(board_matrix: ChessboardMatrix, chessboard: chess.Board, max_mismatches=0):
+    """Checks that the detected position is the one of chessboard, up to max_mismatches squares, see find_san_move."""
+    fen1 = board_matrix.export_to_fen()
+    fen2 = chessboard.board_fen()
+    if fen1 == fen2:
+        return True
+    mismatches = int(np.count_nonzero(board_to_codes(chess.BaseBoard(fen1.split()[0])) != board_to_codes(chessboard)))
+    if mismatches <= max_mismatches:
+        print(f"[debug] {mismatches} squares of the board matrix ignored as misdetections")
+        return True
+    print(f"[debug] board matrix FEN: {fen1}")
+    print(f"[debug] chess.Board  FEN: {fen2}")
+    return False
+
+def validate_board_matrix(fen: str):
+    piece_counts = {
+        'K': 0, 'Q': 0, 'R': 0, 'B': 0, 'N': 0, 'P': 0,
+        'k': 0, 'q': 0, 'r': 0, 'b': 0, 'n': 0, 'p': 0
+    }
+
+    # Contar as peças no FEN
+    for char in fen.split()[0]:
+        if char in piece_counts:
+            piece_counts[char] += 1
+
+    # Validar o número de peças
+    if piece_counts['K'] != 1:
+        print(f"[error] the number of white king detected was not 1: {fen}")
+        return False
+    if piece_counts['k'] != 1:
+        print(f"[error] the number of black king detected was not 1: {fen}")
+        return False
+    if piece_counts['P'] > 8:
+        print(f"[error] more than 8 white pawns were detected: {fen}")
+        return False
+    if piece_counts['p'] > 8:
+        print(f"[error] more than 8 black pawns were detected: {fen}")
+        return False
+
+    # Verificar o número total de peças
+    total_pieces = sum(piece_counts.values())
+    if total_pieces > 32:
+        print("[error] {total_pieces} pieces detected. The board cannot have more than 32 pieces.")
+        return False
+
+    return True
+
+@profiled("find_san_move")
+def find_san_move(board_before: chess.Board, board_after: chess.Board, max_mismatches=0):
+    """
+    Finds the move played between two positions.
+    max_mismatches: squares of board_after that may be misdetected, when a single legal move explains the others
+    (GameSession passes MOVE_INFERENCE_MAX_MISMATCHES).
+    Returns: the move in SAN notation, or None if no legal move leads to board_after.
+    """
+    result = infer_move(board_before, board_after, max_mismatches)
+    if result.move is not None and not result.exact:
+        print(f"[debug] no move matches the detected position exactly, closest: {result.san} ({result.candidates[0][1]} squares off)")
+    if result.move is None and result.candidates:
+        closest = ", ".join(f"{board_before.san(move)} ({mismatches} squares off)" for move, mismatches in result.candidates[:3])
+        print(f"[debug] no move matches the detected position, closest: {closest}")
+    return result.san
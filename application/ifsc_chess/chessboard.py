@@ -4,8 +4,63 @@ sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
 
 from application.processing.image_preprocessing import *
 
+import functools
 import numpy as np
 
+# Códigos das peças, iguais aos tipos do python-chess: positivos para as brancas e negativos para as pretas, 0 = casa vazia
+PIECE_TYPES = ["pawn", "knight", "bishop", "rook", "queen", "king"]
+PIECE_CODES = {
+    f"{color}_{piece_type}": sign * (index + 1)
+    for color, sign in (("white", 1), ("black", -1))
+    for index, piece_type in enumerate(PIECE_TYPES)
+}
+PIECE_NAMES = {code: name for name, code in PIECE_CODES.items()}
+# Símbolo FEN de cada código, indexado por código + 6
+FEN_SYMBOLS = np.array(list("kqrbnp") + [""] + list("PNBRQK"))
+
+def piece_to_code(piece):
+    """Converte uma string como 'white_king' para o seu código, 0 para nomes desconhecidos ou None."""
+    return PIECE_CODES.get(piece, 0)
+
+def code_to_piece(code):
+    """Converte um código de peça para a string 'white_king', 'black_pawn', etc. ou None para casa vazia."""
+    return PIECE_NAMES.get(int(code))
+
+@functools.lru_cache(maxsize=4096)
+def _row_to_fen(row):
+    """Converte os códigos de uma linha do tabuleiro (bytes) para a sua representação FEN."""
+    fen = ""
+    empty_count = 0
+    for code in np.frombuffer(row, dtype=np.int8):
+        if code == 0:
+            empty_count += 1
+            continue
+        if empty_count > 0:
+            fen += str(empty_count)
+            empty_count = 0
+        fen += FEN_SYMBOLS[code + 6]
+    if empty_count > 0:
+        fen += str(empty_count)
+    return fen
+
+def pieces_from_fen(fen):
+    """
+    Importa a disposição das peças de um FEN.
+    Returns: np.ndarray (8, 8) int8 com os códigos das peças, indexado por [coluna, linha].
+    """
+    pieces = np.zeros((8, 8), dtype=np.int8)
+    symbols = {symbol: code - 6 for code, symbol in enumerate(FEN_SYMBOLS) if symbol}
+    for rank, row in enumerate(fen.split()[0].split("/")):
+        x = 0
+        for symbol in row:
+            if symbol.isdigit():
+                x += int(symbol)
+            else:
+                pieces[x, 7 - rank] = symbols[symbol]
+                x += 1
+    return pieces
+
+
 class ChessboardCell:
     def __init__(self, bottom_left, top_right, piece=None):
         self.coordinates = (bottom_left, top_right)
@@ -27,7 +82,27 @@ class ChessboardCell:
         self.piece = piece
     
     def __repr__(self):
-        return f"Coordinates: {self.coordinates}, Piece: {self.piece}"
+        return f"Coordinates: {self.get_coordinates()}, Piece: {self.get_piece()}"
+
+
+class ChessboardMatrixCell(ChessboardCell):
+    """Casa de um ChessboardMatrix: lê e escreve diretamente nos arrays da matriz."""
+    def __init__(self, matrix, position):
+        self.matrix = matrix
+        self.position = position
+
+    @property
+    def coordinates(self):
+        x, y = self.position
+        bottom_left = tuple(map(int, self.matrix.corners[x, y]))
+        top_right = tuple(map(int, self.matrix.corners[x + 1, y + 1]))
+        return bottom_left, top_right
+
+    def get_piece(self):
+        return code_to_piece(self.matrix.pieces[self.position])
+
+    def set_piece(self, piece):
+        self.matrix.pieces[self.position] = piece_to_code(piece)
 
 
 class ChessboardMatrix:
@@ -36,54 +111,58 @@ class ChessboardMatrix:
         if len(points) != 81:
             raise ValueError("Error: The number of points must be 81.")
 
-        # Inicializa a matriz 8x8 com células
-        self.matrix = np.zeros((8, 8), dtype=object)
-        
         # Dividir os pontos em linhas
         ordered_points = group_points_by_order(points)
-        
-        # Preencher a matriz 8x8 com as casas do tabuleiro contendo as coordenadas de seu ponto inferior esquerdo e superior direito
-        for x, array in enumerate(ordered_points):
-            for y, point in enumerate(array):
-                if x<=7 and y<=7:
-                    bottom_left = tuple(map(int, point))
-                    top_right = tuple(map(int,ordered_points[x+1][y+1]))
-                    # print(f"cell [{x}][{y}] - bottom_left: {bottom_left}, top_right: {top_right}")
-                    self.matrix[x, y] = ChessboardCell(bottom_left, top_right)
-        
+
+        # corners[x, y] = ponto da coluna x e linha y da grade, a casa [x][y] vai de corners[x, y] (inferior esquerdo)
+        # até corners[x+1, y+1] (superior direito)
+        self.corners = np.array(ordered_points, dtype=np.float32)
+        # pieces[x, y] = código da peça na casa [x][y], ver PIECE_CODES
+        self.pieces = np.zeros((8, 8), dtype=np.int8)
+        self.homography = None
+
     def get_cell(self, position):
         x, y = position
-        return self.matrix[x, y]
-    
-    def export_to_fen(self):
+        return ChessboardMatrixCell(self, (x, y))
+
+    def get_bottom_left_corners(self):
+        """View (8, 8, 2) do ponto inferior esquerdo de cada casa, sem cópia."""
+        return self.corners[:8, :8]
+
+    def get_top_right_corners(self):
+        """View (8, 8, 2) do ponto superior direito de cada casa, sem cópia."""
+        return self.corners[1:, 1:]
+
+    def get_board_homography(self):
         """
-        Exporta o estado atual do tabuleiro em formato FEN.
+        Transformação de perspectiva das coordenadas da imagem para coordenadas do tabuleiro,
+        onde a casa [x][y] cobre [x, x+1) x [y, y+1). Calculada a partir dos 81 pontos no primeiro uso.
         """
-        fen = ""
-        for y in range(7, -1, -1):  # De cima para baixo (linhas 8 até 1)
-            empty_count = 0
-            for x in range(8):  # Da esquerda para direita (colunas a até h)
-                cell = self.get_cell((x, y))
-                piece = cell.get_piece()
-
-                if piece:
-                    # Adiciona o número de casas vazias antes de uma peça, se houver
-                    if empty_count > 0:
-                        fen += str(empty_count)
-                        empty_count = 0
+        if self.homography is None:
+            lattice = np.stack(np.meshgrid(np.arange(9), np.arange(9), indexing='ij'), axis=-1).astype(np.float32)
+            self.homography, _ = cv2.findHomography(self.corners.reshape(-1, 2), lattice.reshape(-1, 2))
+        return self.homography
 
-                    # Converte "white_king" para "K", "black_pawn" para "p", etc.
-                    fen += self._piece_to_fen_symbol(piece)
-                else:
-                    empty_count += 1
+    def diff(self, other):
+        """
+        Compara as peças com as de outra matriz.
+        Returns: np.ndarray (n, 2) com as posições [x, y] das casas diferentes.
+        """
+        return np.argwhere(self.pieces != other.pieces)
 
-            # Adiciona o número de casas vazias restantes no final da linha
-            if empty_count > 0:
-                fen += str(empty_count)
+    def import_from_fen(self, fen):
+        """
+        Substitui as peças do tabuleiro pelas do FEN.
+        """
+        self.pieces[:] = pieces_from_fen(fen)
 
-            # Adiciona a barra "/" entre as linhas, exceto na última linha
-            if y > 0:
-                fen += "/"
+    def export_to_fen(self):
+        """
+        Exporta o estado atual do tabuleiro em formato FEN.
+        """
+        # De cima para baixo (linhas 8 até 1), cada linha da esquerda para direita (colunas a até h)
+        rows = np.ascontiguousarray(self.pieces.T[::-1])
+        fen = "/".join(_row_to_fen(row.tobytes()) for row in rows)
 
         # Adiciona os campos extras do FEN (quem joga, roques, en passant, etc.)
         if fen == "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR": # initial state
@@ -95,18 +174,4 @@ class ChessboardMatrix:
         """
         Converte uma string como 'white_king' ou 'black_pawn' para o símbolo FEN.
         """
-        piece_map = {
-            "white_king": "K",
-            "white_queen": "Q",
-            "white_rook": "R",
-            "white_bishop": "B",
-            "white_knight": "N",
-            "white_pawn": "P",
-            "black_king": "k",
-            "black_queen": "q",
-            "black_rook": "r",
-            "black_bishop": "b",
-            "black_knight": "n",
-            "black_pawn": "p",
-        }
-        return piece_map.get(piece, "")
+        return str(FEN_SYMBOLS[piece_to_code(piece) + 6])
@@ -5,26 +5,65 @@ sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
 from application.processing.image_preprocessing import *
 from application.utils.image_utils import *
 from application.ifsc_chess.chessboard import *
+from application.config import (MERGE_LINES, GRID_CLUSTER_EPS_DIVISOR, GRID_CLUSTER_MIN_SAMPLES, VECTORIZED_PIECE_MAPPING,
+                                HOUGH_THRESHOLD, HOUGH_MIN_LINE_LENGTH, HOUGH_MAX_LINE_GAP, MEDIAN_BLUR_SIZE,
+                                DILATION_KERNEL_SIZE, REFERENCE_IMAGE_SIDE, PYRAMID_WORKING_SIDE, SINGLE_PASS_GRID,
+                                GRID_FIT_MIN_NODES, GRID_FIT_MAX_RESIDUAL, MULTI_BOARD_MIN_AREA, MULTI_BOARD_MARGIN,
+                                MULTI_BOARD_WORKING_SIDE, MULTI_BOARD_CLOSING_SIZE)
 
-def select_chessboard_area(img, ouput_path=None):
+def detect_scaled_lines(img, dilate_iterations, scale):
     """
-    Selects the area of the chessboard in the image.
+    Runs pre_process, edge_and_dilate and detect_lines with their pixel sizes scaled to the working resolution.
+    scale: working resolution over the reference resolution, 1 for full resolution images.
+    """
+    pre_processed = pre_process(img, scale_kernel(MEDIAN_BLUR_SIZE, scale))
+    show_image(pre_processed, "pre_processed")
+    # each dilation with a 3x3 kernel grows the edges by one pixel, so the number of iterations is what scales
+    iterations = scale_pixels(dilate_iterations * (DILATION_KERNEL_SIZE // 2), scale, minimum=0)
+    dilated_edges = edge_and_dilate(pre_processed, iterations, 3)
+    show_image(dilated_edges, "edges")
+    return detect_lines(dilated_edges, scale_pixels(HOUGH_MIN_LINE_LENGTH, scale),
+                        scale_pixels(HOUGH_MAX_LINE_GAP, scale), scale_pixels(HOUGH_THRESHOLD, scale))
+
+def find_chessboard_corners(img, merge=MERGE_LINES, scale=1.0):
+    """
+    Finds the 4 corners of the chessboard area in the image.
     img: original image.
-    Returns: the warped perspective of the selected area.
+    merge: merge duplicated lines before detecting intersections.
+    scale: resolution of img over the reference resolution, used to scale the pixel thresholds.
+    Returns: the corners ordered as top-left, top-right, bottom-right, bottom-left.
+    """
+    return find_extreme_points(find_board_intersections(img, merge, scale))
+
+def find_board_intersections(img, merge=MERGE_LINES, scale=1.0):
     """
-    show_image(img)
-    pre_processed = pre_process(img)
-    show_image(pre_processed)
-    dilated_edges = edge_and_dilate(pre_processed, 2)
-    show_image(dilated_edges)
-    lines = detect_lines(dilated_edges)
+    Finds the intersections of the lines of the original image, whose extreme points are the board corners
+    (see find_chessboard_corners) and which include most of the inner grid corners.
+    """
+    show_image(img, "image")
+    lines = detect_scaled_lines(img, 2, scale)
     extrapolated_lines = [extrapolate_line(*line[0], img.shape) for line in lines]
-    intersections = detect_intersections(extrapolated_lines)
+    if merge:
+        # The jitter between duplicated lines used to let the slightly skewed board edges
+        # pass the 90 degrees filter, so merged lines need a wider tolerance
+        extrapolated_lines = merge_lines(extrapolated_lines, img.shape)
+        intersections = detect_intersections(extrapolated_lines, tolerance=8)
+    else:
+        intersections = detect_intersections(extrapolated_lines)
     draw_extrapolated_lines(img, extrapolated_lines)
     draw_intersections(img, intersections)
-    corners = find_extreme_points(intersections)
+    return intersections
+
+def select_chessboard_area(img, ouput_path=None, merge=MERGE_LINES):
+    """
+    Selects the area of the chessboard in the image.
+    img: original image.
+    merge: merge duplicated lines before detecting intersections.
+    Returns: the warped perspective of the selected area.
+    """
+    corners = find_chessboard_corners(img, merge)
     warped = warp_perspective(img, corners)
-    show_image(warped)
+    show_image(warped, "warped")
 
     if ouput_path is not None:
         save_image(warped, ouput_path)
@@ -32,31 +71,179 @@ def select_chessboard_area(img, ouput_path=None):
     return warped
 
 
-def map_chessboard(img):
+def find_grid_points(img, merge=MERGE_LINES, scale=1.0):
     """
-    Maps the chessboard grid to a 8x8 matrix
+    Finds the 81 intersections of the chessboard grid.
     img: selected area of the chessboard.
-    Returns: the 8x8 matrix.
+    merge: merge duplicated lines before detecting intersections.
+    scale: resolution of img over the reference resolution, used to scale the pixel thresholds.
+    Returns: np.ndarray with the 81 points.
     """
-    show_image(img)
-
-    pre_processed = pre_process(img)
-    show_image(pre_processed)
-
-    dilated_edges = edge_and_dilate(pre_processed)
-    show_image(dilated_edges)
-
-    lines = detect_lines(dilated_edges)
+    show_image(img, "image")
+    lines = detect_scaled_lines(img, 1, scale)
     extrapolated_lines = [extrapolate_line(*line[0], img.shape) for line in lines]
+    if merge:
+        extrapolated_lines = merge_lines(extrapolated_lines, img.shape)
 
     intersections = detect_intersections(extrapolated_lines)
-    filtered_intersections = dbscan_cluster_points(intersections, eps=img.shape[0]/12, min_samples=5)
+    # After merging, each grid corner is the intersection of a single pair of lines
+    # Each grid corner gathers the intersections of every pair of duplicated lines, and lines have
+    # fewer duplicates the thinner they are in pixels
+    min_samples = 1 if merge else max(1, int(round(GRID_CLUSTER_MIN_SAMPLES * scale**2)))
+    filtered_intersections = dbscan_cluster_points(intersections, eps=img.shape[0]/GRID_CLUSTER_EPS_DIVISOR,
+                                                   min_samples=min_samples)
 
     draw_extrapolated_lines(img, extrapolated_lines)
     draw_intersections(img, intersections)
     draw_filtered_points(img, filtered_intersections)
 
-    return ChessboardMatrix(filtered_intersections)
+    return filtered_intersections
+
+def fit_grid_from_intersections(intersections, corners, min_nodes=GRID_FIT_MIN_NODES, max_residual=GRID_FIT_MAX_RESIDUAL):
+    """
+    Finds the 81 grid points of the warped board from the intersections of the original image, without
+    detecting the lines of the warped board again: the intersections are projected with the perspective
+    of warp_perspective and the 9x9 lattice is fitted to them, see fit_grid_lattice.
+    intersections, corners: in the coordinates of the original image.
+    min_nodes: minimum number of grid points found among the intersections.
+    max_residual: maximum median distance, in cells, between these points and the fitted lattice.
+    Returns: the 81 grid points in the coordinates of the warped board, or None if the fit is poor.
+    """
+    transform, (width, height) = perspective_transform(corners)
+    projected = cv2.perspectiveTransform(np.asarray(intersections, dtype=np.float64).reshape(-1, 1, 2), transform).reshape(-1, 2)
+    lattice, nodes, residuals = fit_grid_lattice(projected, width, height)
+    if lattice is None or nodes < min_nodes or np.median(residuals) > max_residual:
+        print(f"[debug] grid lattice fit rejected ({nodes} points found, median residual {np.median(residuals):.3f} cells), detecting the grid again")
+        return None
+    return lattice
+
+# Boards located by locate_chessboard on the downscaled image and at full resolution, accumulated over every call
+pyramid_stats = {"downscaled": 0, "full_resolution": 0}
+# Grids fitted to the intersections of the original image, and grids found by detecting the lines of the warped board
+grid_stats = {"single_pass": 0, "second_pass": 0}
+
+def locate_chessboard(img, merge=MERGE_LINES, working_side=PYRAMID_WORKING_SIDE, allocate=None, single_pass=SINGLE_PASS_GRID):
+    """
+    Finds the board corners and the grid on a copy of the image downscaled to working_side pixels on its
+    longest side, and projects them back to the full resolution, where the board area is warped
+    for the piece detection. The thresholds are tuned for REFERENCE_IMAGE_SIDE, so they are scaled to
+    working_side whatever the resolution of the camera. If the board or its 81 points are not found on
+    the downscaled copy, the full resolution image is used.
+    img: original image.
+    merge: merge duplicated lines before detecting intersections.
+    working_side: longest side of the downscaled copy, or None to work on the full resolution image.
+    allocate: passed to warp_perspective, to write the warped board area to a given array.
+    single_pass: fit the grid to the intersections found with the corners (see fit_grid_from_intersections),
+    detecting the lines of the warped board only when the fit is poor.
+    Returns: the board corners, the warped board area and its 81 grid points, all in full resolution.
+    """
+    factor = 1.0 if working_side is None else min(1.0, working_side / max(img.shape[:2]))
+    if factor < 1.0:
+        try:
+            located = _locate_chessboard_downscaled(img, merge, factor, working_side / REFERENCE_IMAGE_SIDE, allocate, single_pass)
+            pyramid_stats["downscaled"] += 1
+            return located
+        except ValueError as error: # GridDetectionError when the 81 points are not found
+            print(f"[debug] board not found on the downscaled image ({error}), retrying at full resolution")
+
+    with profiler.stage("select_chessboard_area"):
+        intersections = find_board_intersections(img, merge)
+        corners = find_extreme_points(intersections)
+        warped = warp_perspective(img, corners, allocate)
+    with profiler.stage("map_chessboard"):
+        grid_points = _fit_grid(warped, intersections, corners) if single_pass else None
+        if grid_points is None:
+            grid_points = find_grid_points(warped, merge)
+            grid_stats["second_pass"] += 1
+    pyramid_stats["full_resolution"] += 1
+    return corners, warped, grid_points
+
+def _locate_chessboard_downscaled(img, merge, factor, scale, allocate=None, single_pass=SINGLE_PASS_GRID):
+    # the two steps keep the stage names of select_chessboard_area and map_chessboard, compared by the benchmarks
+    with profiler.stage("select_chessboard_area"):
+        small = downscale(img, factor)
+        intersections = find_board_intersections(small, merge, scale)
+        # resize maps pixel centers, so (x + 0.5) / factor - 0.5 goes back to the full resolution pixel
+        corners = ((find_extreme_points(intersections) + 0.5) / factor - 0.5).astype(np.float32)
+        warped = warp_perspective(img, corners, allocate)
+    with profiler.stage("map_chessboard"):
+        grid_points = _fit_grid(warped, (intersections + 0.5) / factor - 0.5, corners) if single_pass else None
+        if grid_points is None:
+            small_warped = downscale(warped, factor)
+            ratio = np.array([warped.shape[1] / small_warped.shape[1], warped.shape[0] / small_warped.shape[0]])
+            grid_points = (find_grid_points(small_warped, merge, scale) + 0.5) * ratio - 0.5
+            grid_stats["second_pass"] += 1
+    return corners, warped, grid_points
+
+def _fit_grid(warped, intersections, corners):
+    grid_points = fit_grid_from_intersections(intersections, corners)
+    if grid_points is not None:
+        grid_stats["single_pass"] += 1
+        draw_filtered_points(warped, grid_points)
+    return grid_points
+
+def find_board_regions(img, working_side=PYRAMID_WORKING_SIDE, min_area=MULTI_BOARD_MIN_AREA, margin=MULTI_BOARD_MARGIN):
+    """
+    Finds the region of every board of a frame showing several boards, e.g. from a camera over a tournament.
+    The line segments of the downscaled frame (not extrapolated, so the lines of a board don't cross the others)
+    are drawn on a mask and joined by a morphological closing; each connected region large enough and not too
+    elongated (unlike the edge of a table) is a board.
+    min_area: smallest region, as a fraction of the frame area.
+    margin: added around each region, as a fraction of its size, so the corners of the board are inside it.
+    Returns: the (x0, y0, x1, y1) full resolution rectangle of each board, from top to bottom and left to right.
+    """
+    factor = 1.0 if working_side is None else min(1.0, working_side / max(img.shape[:2]))
+    small = downscale(img, factor) if factor < 1.0 else img
+    scale = max(small.shape[:2]) / REFERENCE_IMAGE_SIDE
+    mask = np.zeros(small.shape[:2], dtype=np.uint8)
+    for x1, y1, x2, y2 in detect_scaled_lines(small, 2, scale).reshape(-1, 4):
+        cv2.line(mask, (int(x1), int(y1)), (int(x2), int(y2)), 255, scale_pixels(9, scale))
+    size = scale_kernel(MULTI_BOARD_CLOSING_SIZE, scale)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((size, size), dtype=np.uint8))
+    _, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+
+    height, width = img.shape[:2]
+    regions = []
+    boxes = [(x, y, w, h) for x, y, w, h, _ in stats[1:] if w * h >= min_area * mask.size and 0.5 <= w / h <= 2.0]
+    for x, y, w, h in boxes:
+        # a region inside a larger one is the inner part of a board or the edge of a table between two boards
+        overlap = sum(max(0, min(x + w, x0 + w0) - max(x, x0)) * max(0, min(y + h, y0 + h0) - max(y, y0))
+                      for x0, y0, w0, h0 in boxes if w0 * h0 > w * h)
+        if overlap > 0.1 * w * h:
+            continue
+        x0, y0, x1, y1 = (np.array([x - w * margin, y - h * margin, x + w * (1 + margin), y + h * (1 + margin)]) + 0.5) / factor - 0.5
+        regions.append((max(int(x0), 0), max(int(y0), 0), min(int(np.ceil(x1)), width), min(int(np.ceil(y1)), height)))
+    profiler.record("board_regions", len(regions))
+    return sorted(regions, key=lambda region: (region[1] // (height // 4), region[0]))
+
+def locate_chessboards(img, merge=MERGE_LINES, working_side=PYRAMID_WORKING_SIDE, board_side=MULTI_BOARD_WORKING_SIDE, executor=None):
+    """
+    Locates every board of a frame showing several boards, see find_board_regions and locate_chessboard.
+    The regions are searched on a copy of the frame downscaled to working_side, then each board is located in its
+    own region downscaled to board_side, as a task of executor (OpenCV releases the GIL, so a ThreadPoolExecutor
+    runs them in parallel), or one after the other if there is no executor.
+    Returns: for each board, its region, the result of locate_chessboard (with the corners in the coordinates
+    of the frame) and None, or its region, None and the error raised when it couldn't be located.
+    """
+    def locate(region):
+        x0, y0, x1, y1 = region
+        try:
+            corners, warped, grid_points = locate_chessboard(img[y0:y1, x0:x1], merge, board_side)
+        except ValueError as error: # GridDetectionError, or not enough intersections for the corners
+            return region, None, error
+        return region, (corners + np.array([x0, y0], dtype=np.float32), warped, grid_points), None
+
+    regions = find_board_regions(img, working_side)
+    return list(executor.map(locate, regions) if executor is not None else map(locate, regions))
+
+def map_chessboard(img, merge=MERGE_LINES):
+    """
+    Maps the chessboard grid to a 8x8 matrix
+    img: selected area of the chessboard.
+    merge: merge duplicated lines before detecting intersections.
+    Returns: the 8x8 matrix.
+    """
+    return ChessboardMatrix(find_grid_points(img, merge))
 
 def map_single_piece(matrix: ChessboardMatrix, piece):
     """
@@ -74,14 +261,54 @@ def map_single_piece(matrix: ChessboardMatrix, piece):
                     matrix.get_cell((column, row)).set_piece(piece["class"])
                     return True
 
-def map_all_pieces(matrix: ChessboardMatrix, pieces):
+def map_pieces_to_cells(matrix: ChessboardMatrix, pieces):
+    """
+    Finds the cell of every piece at once, projecting the bounding box centers
+    to board coordinates with the homography of the grid.
+    Returns: np.ndarray (n, 2) with the (x, y) cell of each piece, -1 for pieces outside the board.
+    """
+    if len(pieces) == 0:
+        return np.empty((0, 2), dtype=int)
+    centers = np.array([(piece["x"], piece["y"]) for piece in pieces], dtype=np.float32)
+    board_coordinates = cv2.perspectiveTransform(centers.reshape(-1, 1, 2), matrix.get_board_homography()).reshape(-1, 2)
+    cells = np.floor(board_coordinates).astype(int)
+    cells[((cells < 0) | (cells > 7)).any(axis=1)] = -1
+    return cells
+
+def map_all_pieces_vectorized(matrix: ChessboardMatrix, pieces):
+    """
+    Maps all pieces to the chessboard matrix in one step, see map_pieces_to_cells.
+    When two pieces land on the same cell, the one with the highest confidence is kept.
+    Returns: True if every piece was mapped to a cell.
+    """
+    cells = map_pieces_to_cells(matrix, pieces)
+    all_mapped = True
+    for index in np.nonzero(cells[:, 0] < 0)[0]:
+        print(f"[error] Piece {pieces[index]['class']} couldn't be mapped to the chessboard.")
+        all_mapped = False
+
+    mapped = np.nonzero(cells[:, 0] >= 0)[0]
+    confidences = np.array([pieces[index]["confidence"] for index in mapped], dtype=float)
+    mapped = mapped[np.argsort(-confidences, kind='stable')]
+    _, first = np.unique(cells[mapped, 0] * 8 + cells[mapped, 1], return_index=True)
+    if len(first) < len(mapped):
+        print(f"[debug] {len(mapped) - len(first)} piece(s) discarded on already occupied cells")
+    winners = mapped[first]
+    matrix.pieces[cells[winners, 0], cells[winners, 1]] = [piece_to_code(pieces[index]["class"]) for index in winners]
+    return all_mapped
+
+@profiled("map_all_pieces")
+def map_all_pieces(matrix: ChessboardMatrix, pieces, vectorized=VECTORIZED_PIECE_MAPPING):
     """
     Maps all pieces detected in the image to the chessboard matrix.
     results: Roboflow YOLO model output
+    vectorized: use map_all_pieces_vectorized instead of scanning the cells of each piece.
     Returns: the chessboard matrix with the pieces mapped.
     """
+    if vectorized:
+        return map_all_pieces_vectorized(matrix, pieces)
     for piece in pieces:
         if not map_single_piece(matrix, piece):
             print(f"[error] Piece {piece['class']} couldn't be mapped to the chessboard.")
             return False
-    return True
\ No newline at end of file
+    return True
@@ -0,0 +1,159 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import chess
+
+from application.config import MAX_GAP_PLIES, MOVE_INFERENCE_MAX_MISMATCHES
+from application.ifsc_chess.chessboard import ChessboardMatrix
+from application.ifsc_chess.chess_logic import find_san_move, is_conversion_successful, validate_board_matrix
+from application.ifsc_chess.gap_recovery import find_move_sequence
+
+class GameSession:
+    """
+    State of one game being recognized: the current position and the moves played so far.
+    Each board matrix recognized from a new frame is passed to update, in the order of the frames.
+    max_mismatches: misdetected squares tolerated on a frame when a single move explains the others, see find_san_move.
+    """
+    def __init__(self, game_id="game", max_gap_plies=MAX_GAP_PLIES, max_mismatches=MOVE_INFERENCE_MAX_MISMATCHES):
+        self.game_id = game_id
+        self.max_gap_plies = max_gap_plies
+        self.max_mismatches = max_mismatches
+        self.board = None
+        self.moves = []
+
+    def update(self, board_matrix: ChessboardMatrix):
+        """
+        Finds the moves that lead from the current position to the one detected on board_matrix.
+        The first matrix sets the initial position.
+        Returns: a dict with the "status" ("initial", "move", "unchanged" or "error"),
+        the SAN "moves" found, the current "fen" and the "error" message, if any (the PGN is built by pgn() when needed).
+        """
+        matrix_fen = board_matrix.export_to_fen()
+        if not validate_board_matrix(matrix_fen):
+            return self.result("error", error="Invalid board matrix detected.")
+        new_board = chess.Board(fen=matrix_fen)
+
+        if self.board is None: # initial state
+            self.board = new_board.copy()
+            print(f"[info] [{self.game_id}] Initial state: {self.board.fen()}")
+            return self.result("initial")
+        if new_board.board_fen() == self.board.board_fen():
+            return self.result("unchanged")
+
+        tolerance = 0
+        san_move = find_san_move(self.board, new_board, 0)
+        if san_move is not None:
+            san_moves = [san_move]
+            print(f"[info] [{self.game_id}] Detected move: {san_move}")
+        else:
+            # frames may be missing between the two images, look for a short sequence of moves
+            recovery = find_move_sequence(self.board, new_board, self.max_gap_plies)
+            if recovery.moves is not None:
+                san_moves = recovery.san
+                print(f"[info] [{self.game_id}] Recovered {len(san_moves)} moves from missing frames: {' '.join(san_moves)} "
+                      f"(searched {recovery.nodes} positions in {recovery.elapsed*1000:.1f} ms)")
+            else:
+                # last, a single move explaining the position but for a few misdetected squares
+                san_move = find_san_move(self.board, new_board, self.max_mismatches) if self.max_mismatches else None
+                if san_move is None:
+                    return self.result("error", error="No legal move leads to the detected position. White must be first to move!")
+                san_moves, tolerance = [san_move], self.max_mismatches
+                print(f"[info] [{self.game_id}] Detected move: {san_move} (ignoring misdetected squares)")
+
+        board = self.board.copy()
+        for san_move in san_moves:
+            board.push_san(san_move)
+        if not is_conversion_successful(board_matrix, board, tolerance):
+            return self.result("error", error="Conversion from board matrix to chess.Board failed. \nThere must have been an error on the chess piece detection/classification or the sequence of images does not start with the initial board state.")
+        self.board = board
+        self.moves.extend(san_moves)
+        print(f"[info] [{self.game_id}] New board state: {self.board.fen()}")
+        return self.result("move", san_moves)
+
+    def fen(self):
+        return self.board.fen() if self.board is not None else None
+
+    def checkpoint(self):
+        """Returns the state of the session as a JSON-serializable dict, see from_checkpoint."""
+        return {
+            "game_id": self.game_id,
+            "initial_fen": self.board.root().fen() if self.board is not None else None,
+            "moves": list(self.moves),
+            "max_mismatches": self.max_mismatches,
+        }
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint, max_gap_plies=MAX_GAP_PLIES, max_mismatches=None):
+        """
+        Restores a session saved by checkpoint, replaying its moves from the initial position.
+        max_mismatches: overrides the one of the checkpoint (MOVE_INFERENCE_MAX_MISMATCHES if it has none).
+        """
+        if max_mismatches is None:
+            max_mismatches = checkpoint.get("max_mismatches", MOVE_INFERENCE_MAX_MISMATCHES)
+        session = cls(checkpoint["game_id"], max_gap_plies, max_mismatches)
+        if checkpoint["initial_fen"] is not None:
+            session.board = chess.Board(checkpoint["initial_fen"])
+            for san_move in checkpoint["moves"]:
+                session.board.push_san(san_move)
+            session.moves = list(checkpoint["moves"])
+        return session
+
+    def pgn(self):
+        """Returns the moves played so far in PGN."""
+        if self.board is None:
+            return ""
+        import chess.pgn # imported on first use, the CLI and the worker processes start without it
+        game = chess.pgn.Game.from_board(self.board)
+        game.headers["Event"] = self.game_id
+        return str(game)
+
+    def result(self, status, moves=(), error=None):
+        return {
+            "status": status,
+            "moves": list(moves),
+            "fen": self.fen(),
+            "error": error,
+        }
+
+class MultiBoardSession:
+    """
+    Games of several boards seen by the same camera, each one with its own GameSession.
+    The boards found on a frame are matched to the games by their position: a board whose center is inside
+    the last region of a game continues it, any other board starts a new game "<prefix>-<n>".
+    A region that couldn't be located and doesn't continue a game is ignored, it was not a board.
+    max_gap_plies, max_mismatches: passed to the GameSession of each game.
+    """
+    def __init__(self, prefix="board", max_gap_plies=MAX_GAP_PLIES, max_mismatches=MOVE_INFERENCE_MAX_MISMATCHES):
+        self.prefix = prefix
+        self.max_gap_plies = max_gap_plies
+        self.max_mismatches = max_mismatches
+        self.sessions = {}
+        self.regions = {}
+
+    def match(self, region, taken=()):
+        """Returns: the id of the game whose last region contains the center of region and is not in taken, or None."""
+        x, y = (region[0] + region[2]) / 2, (region[1] + region[3]) / 2
+        for game_id, (x0, y0, x1, y1) in self.regions.items():
+            if game_id not in taken and x0 <= x < x1 and y0 <= y < y1:
+                return game_id
+        return None
+
+    def update(self, boards):
+        """
+        Passes each board of a frame to its game, see GameSession.update.
+        boards: (region, board matrix, error) of each board, as returned by generate_board_matrices.
+        Returns: the result of each board by game id; a board of a game that couldn't be located gets an "error" result.
+        """
+        results = {}
+        for region, board_matrix, error in boards:
+            game_id = self.match(region, results)
+            if game_id is None and board_matrix is None:
+                continue
+            if game_id is None:
+                game_id = f"{self.prefix}-{len(self.sessions) + 1}"
+                self.sessions[game_id] = GameSession(game_id, self.max_gap_plies, self.max_mismatches)
+            self.regions[game_id] = region
+            session = self.sessions[game_id]
+            results[game_id] = session.update(board_matrix) if board_matrix is not None else session.result("error", error=str(error))
+        return results
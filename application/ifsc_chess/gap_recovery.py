@@ -0,0 +1,88 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import time
+
+import chess
+import chess.polyglot
+import numpy as np
+
+from application.ifsc_chess.move_inference import board_to_codes, apply_move_to_codes
+
+class GapRecoveryResult:
+    """
+    moves: shortest list of legal moves leading to the observed position, or None if none was found.
+    san: the moves in SAN notation.
+    elapsed: search time in seconds.
+    nodes: number of positions visited.
+    """
+    def __init__(self, moves, san, elapsed, nodes):
+        self.moves = moves
+        self.san = san
+        self.elapsed = elapsed
+        self.nodes = nodes
+
+    def __repr__(self):
+        return f"GapRecoveryResult(san={self.san}, elapsed={self.elapsed*1000:.1f} ms, nodes={self.nodes})"
+
+
+def find_move_sequence(board: chess.Board, board_after: chess.Board, max_plies=3):
+    """
+    Finds the shortest sequence of 1 to max_plies legal moves from board to the piece placement
+    of board_after, for when frames between two images are missing.
+    Iterative deepening search where:
+    - only moves from or to a square that differs between both positions are tried;
+    - a branch is cut when the remaining plies cannot fix the squares that still differ,
+      since a move changes at most 4 squares (castling);
+    - positions already searched with as many remaining plies are skipped, keyed by their Zobrist hash.
+    Returns: GapRecoveryResult.
+    """
+    start = time.perf_counter()
+    target = board_to_codes(board_after)
+    initial = board_to_codes(board)
+    changed_mask = chess.SquareSet(np.nonzero(initial != target)[0].tolist()).mask
+    board = board.copy(stack=False)
+    nodes = 0
+
+    def search(codes, remaining, path, transpositions):
+        nonlocal nodes
+        nodes += 1
+        differences = int(np.count_nonzero(codes != target))
+        if differences == 0:
+            return list(path)
+        if remaining == 0 or (differences + 3) // 4 > remaining:
+            return None
+        key = chess.polyglot.zobrist_hash(board)
+        if transpositions.get(key, -1) >= remaining:
+            return None
+        transpositions[key] = remaining
+
+        for move in list(board.legal_moves):
+            if not (chess.BB_SQUARES[move.from_square] | chess.BB_SQUARES[move.to_square]) & changed_mask:
+                continue
+            next_codes = apply_move_to_codes(board, move, codes)
+            board.push(move)
+            path.append(move)
+            found = search(next_codes, remaining - 1, path, transpositions)
+            path.pop()
+            board.pop()
+            if found is not None:
+                return found
+        return None
+
+    moves = None
+    if changed_mask:
+        for depth in range(1, max_plies + 1):
+            moves = search(initial, depth, [], {})
+            if moves is not None:
+                break
+
+    san = None
+    if moves is not None:
+        replay = board.copy(stack=False)
+        san = []
+        for move in moves:
+            san.append(replay.san(move))
+            replay.push(move)
+    return GapRecoveryResult(moves, san, time.perf_counter() - start, nodes)
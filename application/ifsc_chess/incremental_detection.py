@@ -0,0 +1,165 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import time
+
+from application.ifsc_chess.chessboard_operations import *
+from application.detection.detectors import Detector
+from application.config import INCREMENTAL_CHANGE_THRESHOLD, INCREMENTAL_MAX_CHANGED_CELLS
+
+def pack_crops(crops, max_width, gap=16):
+    """
+    Packs the crops in rows of a single image, no wider than max_width (or the widest crop), separated by gap pixels.
+    Returns: the mosaic and the (x, y) position of each crop in it.
+    """
+    max_width = max(max_width, max(crop.shape[1] for crop in crops))
+    positions, x, y, row_height = [], 0, 0, 0
+    for crop in crops:
+        if x > 0 and x + crop.shape[1] > max_width:
+            x, y, row_height = 0, y + row_height + gap, 0
+        positions.append((x, y))
+        x += crop.shape[1] + gap
+        row_height = max(row_height, crop.shape[0])
+    width = max(px + crop.shape[1] for (px, _), crop in zip(positions, crops))
+    mosaic = np.zeros((y + row_height, width) + crops[0].shape[2:], dtype=crops[0].dtype)
+    for (px, py), crop in zip(positions, crops):
+        mosaic[py:py + crop.shape[0], px:px + crop.shape[1]] = crop
+    return mosaic, positions
+
+def unpack_predictions(predictions, crops, positions):
+    """Returns: the predictions found on the mosaic of pack_crops split by crop, in the coordinates of each crop."""
+    results = [[] for _ in crops]
+    for prediction in predictions:
+        for result, crop, (px, py) in zip(results, crops, positions):
+            if px <= prediction["x"] < px + crop.shape[1] and py <= prediction["y"] < py + crop.shape[0]:
+                result.append({**prediction, "x": prediction["x"] - px, "y": prediction["y"] - py})
+                break
+    return results
+
+class IncrementalDetector:
+    """
+    Runs the piece detection only where the board changed since the previous frame.
+    Each cell of the warped board is reduced to a small color thumbnail and compared with the same cell
+    of the previous frame; a cell changed when its mean absolute difference is more than change_threshold
+    above the median difference of the board, which absorbs the lighting and alignment noise between frames.
+    The changed cells and their neighbors (a piece leaving a cell is often hidden by the pieces in front of it)
+    are cropped, with context_cells of margin, and sent to the detector in a single batch, or packed into a single
+    image (see pack_crops) when the detector is not batched and would send each crop as a request. The predictions of
+    the other cells are kept from the previous frame, projected through the grids of both frames.
+    The whole board is detected on the first frame and when more than max_changed_cells cells changed,
+    e.g. because the camera moved.
+    detector: the Detector used for the whole board and for the crops.
+    thumbnail_size: side of the thumbnail of each cell, in pixels.
+    """
+    def __init__(self, detector: Detector, change_threshold=INCREMENTAL_CHANGE_THRESHOLD,
+                 max_changed_cells=INCREMENTAL_MAX_CHANGED_CELLS, thumbnail_size=8, context_cells=0.5):
+        self.detector = detector
+        self.change_threshold = change_threshold
+        self.max_changed_cells = max_changed_cells
+        self.thumbnail_size = thumbnail_size
+        self.context_cells = context_cells
+        self.previous = None # (thumbnails, chessboard matrix, predictions) of the previous frame
+        self.history = [] # (path taken, seconds, detector requests, images sent, pixels sent to the detector) of each frame
+
+    def cell_thumbnails(self, warped, matrix: ChessboardMatrix):
+        """Returns: np.ndarray (8, 8, thumbnail_size * thumbnail_size * channels) with the thumbnail of each cell."""
+        size = self.thumbnail_size
+        # the thumbnails are a few pixels wide, so they are taken from a copy about 8 times their size
+        factor = min(1.0, 8 * size * 8 / max(warped.shape[:2]))
+        small = downscale(warped, factor) if factor < 1.0 else warped
+        lows = np.floor(np.minimum(matrix.get_bottom_left_corners(), matrix.get_top_right_corners()) * factor).astype(int)
+        highs = np.ceil(np.maximum(matrix.get_bottom_left_corners(), matrix.get_top_right_corners()) * factor).astype(int)
+        lows = np.maximum(lows, 0)
+        thumbnails = np.zeros((8, 8, size * size * (small.shape[2] if small.ndim == 3 else 1)), dtype=np.float32)
+        for x in range(8):
+            for y in range(8):
+                (x0, y0), (x1, y1) = lows[x, y], highs[x, y]
+                cell = small[y0:max(y1, y0 + 1), x0:max(x1, x0 + 1)]
+                thumbnails[x, y] = cv2.resize(cell, (size, size), interpolation=cv2.INTER_AREA).reshape(-1)
+        return thumbnails
+
+    def changed_cells(self, thumbnails):
+        """Returns: np.ndarray (8, 8) bool with the cells that changed since the previous frame."""
+        differences = np.abs(thumbnails - self.previous[0]).mean(axis=2)
+        return differences - np.median(differences) > self.change_threshold
+
+    def crop_regions(self, cells, matrix: ChessboardMatrix, shape):
+        """
+        Groups the cells to detect again into connected regions.
+        Returns: the (x0, y0, x1, y1) pixel rectangle of each region, with context_cells of margin.
+        """
+        count, labels = cv2.connectedComponents(cells.astype(np.uint8), connectivity=8)
+        height, width = shape[:2]
+        regions = []
+        for label in range(1, count):
+            xs, ys = np.nonzero(labels == label)
+            x_low, x_high, y_low, y_high = xs.min(), xs.max() + 1, ys.min(), ys.max() + 1
+            points = matrix.corners[x_low:x_high + 1, y_low:y_high + 1].reshape(-1, 2)
+            cell_size = (points.max(axis=0) - points.min(axis=0)) / np.array([x_high - x_low, y_high - y_low])
+            x0, y0 = np.floor(points.min(axis=0) - cell_size * self.context_cells).astype(int)
+            x1, y1 = np.ceil(points.max(axis=0) + cell_size * self.context_cells).astype(int)
+            regions.append((max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)))
+        return regions
+
+    def reproject(self, predictions, previous: ChessboardMatrix, matrix: ChessboardMatrix):
+        """Moves the bounding box centers from the image of the previous frame to the image of this frame."""
+        if not predictions or np.array_equal(previous.corners, matrix.corners):
+            return [dict(prediction) for prediction in predictions]
+        centers = np.array([(prediction["x"], prediction["y"]) for prediction in predictions], dtype=np.float32).reshape(-1, 1, 2)
+        transform = np.linalg.inv(matrix.get_board_homography()) @ previous.get_board_homography()
+        centers = cv2.perspectiveTransform(centers, transform).reshape(-1, 2)
+        return [{**prediction, "x": float(x), "y": float(y)} for prediction, (x, y) in zip(predictions, centers)]
+
+    def predict(self, warped, matrix: ChessboardMatrix):
+        """
+        Detects the pieces of the warped board, whose grid is in matrix.
+        Returns: the predictions of the whole board, in the coordinates of warped.
+        """
+        start = time.perf_counter()
+        thumbnails = self.cell_thumbnails(warped, matrix)
+        changed = self.changed_cells(thumbnails) if self.previous is not None else None
+        if changed is None or changed.sum() > self.max_changed_cells:
+            path, requests, images, pixels = "full", 1, 1, warped.shape[0] * warped.shape[1]
+            predictions = self.detector.predict(warped)
+        else:
+            kept = self.reproject(self.previous[2], self.previous[1], matrix)
+            redetect = cv2.dilate(changed.astype(np.uint8), np.ones((3, 3), np.uint8)).astype(bool) if changed.any() else changed
+            if redetect.any():
+                path = "incremental"
+                regions = self.crop_regions(redetect, matrix, warped.shape)
+                crops = [warped[y0:y1, x0:x1] for x0, y0, x1, y1 in regions]
+                if self.detector.batched or len(crops) == 1:
+                    results = self.detector.predict_batch(crops)
+                    images, pixels = len(crops), sum(crop.shape[0] * crop.shape[1] for crop in crops)
+                else:
+                    mosaic, positions = pack_crops(crops, warped.shape[1])
+                    results = unpack_predictions(self.detector.predict(mosaic), crops, positions)
+                    images, pixels = 1, mosaic.shape[0] * mosaic.shape[1]
+                found = [{**prediction, "x": prediction["x"] + x0, "y": prediction["y"] + y0}
+                         for (x0, y0, _, _), result in zip(regions, results) for prediction in result]
+                requests = 1
+            else:
+                path, found, requests, images, pixels = "unchanged", [], 0, 0, 0
+            # the kept predictions fill the cells that didn't change, the new ones the cells detected again
+            kept_cells, found_cells = map_pieces_to_cells(matrix, kept), map_pieces_to_cells(matrix, found)
+            predictions = (
+                [prediction for prediction, (x, y) in zip(kept, kept_cells) if x >= 0 and not redetect[x, y]]
+                + [prediction for prediction, (x, y) in zip(found, found_cells) if x >= 0 and redetect[x, y]]
+            )
+        self.previous = (thumbnails, matrix, predictions)
+        elapsed = time.perf_counter() - start
+        self.history.append((path, elapsed, requests, images, pixels))
+        print(f"[debug] pieces detected ({path}) on {pixels / (warped.shape[0] * warped.shape[1]):.0%} of the board in {elapsed*1000:.0f} ms")
+        return predictions
+
+    def reset(self):
+        self.previous = None
+
+    def report(self):
+        for path in ("full", "incremental", "unchanged"):
+            frames = [entry for entry in self.history if entry[0] == path]
+            if frames:
+                print(f"[info] Pieces detected ({path}) in {len(frames)} frames, mean {1000 * np.mean([entry[1] for entry in frames]):.0f} ms, "
+                      f"{sum(entry[2] for entry in frames)} detector requests, {sum(entry[3] for entry in frames)} images, "
+                      f"{np.mean([entry[4] for entry in frames]) / 1e6:.1f} Mpixels per frame")
@@ -0,0 +1,100 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import chess
+import numpy as np
+
+def board_to_codes(board: chess.Board):
+    """
+    Returns: np.ndarray (64,) int8 with the piece code of each square (indexed like chess.SQUARES),
+    python-chess piece types, positive for white and negative for black, 0 for empty squares.
+    """
+    codes = np.zeros(64, dtype=np.int8)
+    for color, sign in ((chess.WHITE, 1), (chess.BLACK, -1)):
+        for piece_type in chess.PIECE_TYPES:
+            codes[list(board.pieces(piece_type, color))] = sign * piece_type
+    return codes
+
+def apply_move_to_codes(board: chess.Board, move: chess.Move, codes):
+    """Returns a copy of the square codes after the move, without pushing it on the board."""
+    result = codes.copy()
+    piece = result[move.from_square]
+    result[move.from_square] = 0
+    if move.promotion:
+        piece = move.promotion if piece > 0 else -move.promotion
+    result[move.to_square] = piece
+
+    if board.is_castling(move):
+        rank = chess.square_rank(move.from_square)
+        if chess.square_file(move.to_square) > chess.square_file(move.from_square):
+            rook_from, rook_to = chess.square(7, rank), chess.square(5, rank)
+        else:
+            rook_from, rook_to = chess.square(0, rank), chess.square(3, rank)
+        result[rook_to] = result[rook_from]
+        result[rook_from] = 0
+    elif board.is_en_passant(move):
+        result[move.to_square + (-8 if board.turn == chess.WHITE else 8)] = 0
+    return result
+
+
+class MoveInferenceResult:
+    """
+    move: the legal move that leads to the observed position, or None if there is no matching move.
+    san: the move in SAN notation, or None.
+    exact: True if the move explains every changed square.
+    candidates: legal moves touching the changed squares, ranked by the number of squares
+    that still differ from the observed position after the move, as (move, mismatches).
+    """
+    def __init__(self, move, san, exact, candidates):
+        self.move = move
+        self.san = san
+        self.exact = exact
+        self.candidates = candidates
+
+    def __repr__(self):
+        return f"MoveInferenceResult(san={self.san}, exact={self.exact}, candidates={len(self.candidates)})"
+
+
+def infer_move(board_before: chess.Board, board_after: chess.Board, max_mismatches=0):
+    """
+    Finds the move played between two positions by comparing their squares.
+    Only legal moves from and to the changed squares are considered, including castling,
+    en passant and promotions, and each one is checked against the observed position.
+    board_before: position before the move, with the side to move and castling rights.
+    board_after: observed position, only the piece placement is used.
+    max_mismatches: when no move explains the position exactly, accept the best ranked move
+    if it leaves at most this many wrong squares, none of them touched by the move, and no other move
+    ties with it, to tolerate detection noise. A single misdetected piece is not taken for a move of its own.
+    Returns: MoveInferenceResult.
+    """
+    before = board_to_codes(board_before)
+    after = board_to_codes(board_after)
+    changed = np.nonzero(before != after)[0]
+    if len(changed) == 0:
+        return MoveInferenceResult(None, None, False, [])
+
+    changed_mask = chess.SquareSet(changed.tolist()).mask
+    # Without noise both squares of a move change; with noise also consider moves touching one changed square
+    from_mask = changed_mask if max_mismatches == 0 else chess.BB_ALL
+    candidates = []
+    # moves whose own squares (from, to, and the rook or the pawn taken en passant) all match the observed position
+    consistent = set()
+    for move in board_before.generate_legal_moves(from_mask=from_mask, to_mask=chess.BB_ALL if max_mismatches else changed_mask):
+        if max_mismatches and not (chess.BB_SQUARES[move.from_square] | chess.BB_SQUARES[move.to_square]) & changed_mask:
+            continue
+        moved = apply_move_to_codes(board_before, move, before)
+        wrong = moved != after
+        candidates.append((move, int(np.count_nonzero(wrong))))
+        if not np.any(wrong & (moved != before)):
+            consistent.add(move)
+    candidates.sort(key=lambda candidate: candidate[1])
+
+    if candidates and candidates[0][1] == 0:
+        move = candidates[0][0]
+        return MoveInferenceResult(move, board_before.san(move), True, candidates)
+    if (candidates and candidates[0][1] <= max_mismatches and candidates[0][0] in consistent
+            and (len(candidates) == 1 or candidates[1][1] > candidates[0][1])):
+        move = candidates[0][0]
+        return MoveInferenceResult(move, board_before.san(move), False, candidates)
+    return MoveInferenceResult(None, None, False, candidates)
@@ -1,160 +1,158 @@
-from ifsc_chess.chessboard_operations import *
-from ifsc_chess.chessboard import *
-from ifsc_chess.enums import *
-from detection.roboflow_detection import *
-from utils.image_utils import *
-import chess
-import ifsc_chess.chessboard as chessboard
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent))
 
-images = [
-    "../test_images/0001.jpg", # initial
-    "../test_images/0002.jpg", # e4
-    "../test_images/0003.jpg", # e5
-    "../test_images/0004.jpg", # Nf3
-    "../test_images/0005.jpg", # d6
-    "../test_images/0006.jpg", # d4
-    "../test_images/0007.jpg", # Bg4
-    "../test_images/0008.jpg", # dxe5
-    "../test_images/0009.jpg", # Bxf3
-    "../test_images/0010.jpg", # Qxf3
-    "../test_images/0011.jpg", # dxe5
-    "../test_images/0012.jpg", # Bc4
-    "../test_images/0013.jpg", # Nf6
-    "../test_images/0014.jpg", # Qb3
-    "../test_images/0015.jpg", # Qe7
-    "../test_images/0016.jpg", # Nc3
-    "../test_images/0017.jpg", # c6
-    "../test_images/0018.jpg", # Bg5
-    "../test_images/0019.jpg", # b5
-    "../test_images/0020.jpg", # Nxb5
-    "../test_images/0021.jpg", # cxb5
-    "../test_images/0022.jpg", # Bxb5+
-    "../test_images/0023.jpg", # Nbd7
-    # for the castle to be detected, you need the whole sequence of moves - since 0001.jpg, because of the python-chess lib's FEN notation "KQkq", which is not created if you don't build the Board object from the initial state
-    "../test_images/0024.jpg", # O-O-O 
-    "../test_images/0025.jpg", # Rd8
-    "../test_images/0026.jpg", # Rxd7
-    "../test_images/0027.jpg", # Rxd7
-    "../test_images/0028.jpg", # Rd1
-    "../test_images/0029.jpg", # Qe6
-    "../test_images/0030.jpg", # Bxd7+
-    "../test_images/0031.jpg", # Nxd7
-    "../test_images/0032.jpg", # Qb8+
-    "../test_images/0033.jpg", # Nxb8
-    "../test_images/0034.jpg", # Rd8#
-]
-
-board_state = None
-moves_list = []
-
-def is_conversion_successful(board_matrix: chessboard.ChessboardMatrix, chessboard: chess.Board):
-    fen1 = board_matrix.export_to_fen()
-    fen2 = chessboard.board_fen()
-    if fen1 == fen2:
-        return True
-    print(f"[debug] board matrix FEN: {fen1}")
-    print(f"[debug] chess.Board  FEN: {fen2}")
-    return False
-
-def validate_board_matrix(fen: str):
-    piece_counts = {
-        'K': 0, 'Q': 0, 'R': 0, 'B': 0, 'N': 0, 'P': 0,
-        'k': 0, 'q': 0, 'r': 0, 'b': 0, 'n': 0, 'p': 0
-    }
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
 
-    # Contar as peças no FEN
-    for char in fen.split()[0]:
-        if char in piece_counts:
-            piece_counts[char] += 1
+from application.pipeline import *
+from application.streaming import *
+from application.ifsc_chess.game_session import *
+from application.utils.profiling import profiler
+from application.utils.debug_writer import debug_writer
 
-    # Validar o número de peças
-    if piece_counts['K'] != 1:
-        print(f"[error] the number of white king detected was not 1: {fen}")
-        return False
-    if piece_counts['k'] != 1:
-        print(f"[error] the number of black king detected was not 1: {fen}")
-        return False
-    if piece_counts['P'] > 8:
-        print(f"[error] more than 8 white pawns were detected: {fen}")
-        return False
-    if piece_counts['p'] > 8:
-        print(f"[error] more than 8 black pawns were detected: {fen}")
-        return False
+TEST_IMAGES_DIR = Path(__file__).absolute().parent.parent / "test_images"
 
-    # Verificar o número total de peças
-    total_pieces = sum(piece_counts.values())
-    if total_pieces > 32:
-        print("[error] {total_pieces} pieces detected. The board cannot have more than 32 pieces.")
-        return False
-
-    return True
+images = [
+    "0001.jpg", # initial
+    "0002.jpg", # e4
+    "0003.jpg", # e5
+    "0004.jpg", # Nf3
+    "0005.jpg", # d6
+    "0006.jpg", # d4
+    "0007.jpg", # Bg4
+    "0008.jpg", # dxe5
+    "0009.jpg", # Bxf3
+    "0010.jpg", # Qxf3
+    "0011.jpg", # dxe5
+    "0012.jpg", # Bc4
+    "0013.jpg", # Nf6
+    "0014.jpg", # Qb3
+    "0015.jpg", # Qe7
+    "0016.jpg", # Nc3
+    "0017.jpg", # c6
+    "0018.jpg", # Bg5
+    "0019.jpg", # b5
+    "0020.jpg", # Nxb5
+    "0021.jpg", # cxb5
+    "0022.jpg", # Bxb5+
+    "0023.jpg", # Nbd7
+    # for the castle to be detected, you need the whole sequence of moves - since 0001.jpg, because of the python-chess lib's FEN notation "KQkq", which is not created if you don't build the Board object from the initial state
+    "0024.jpg", # O-O-O 
+    "0025.jpg", # Rd8
+    "0026.jpg", # Rxd7
+    "0027.jpg", # Rxd7
+    "0028.jpg", # Rd1
+    "0029.jpg", # Qe6
+    "0030.jpg", # Bxd7+
+    "0031.jpg", # Nxd7
+    "0032.jpg", # Qb8+
+    "0033.jpg", # Nxb8
+    "0034.jpg", # Rd8#
+]
+# 0006.jpg and 0009.jpg are missing from test_images, the session recovers their moves from the next frame
+images = [str(TEST_IMAGES_DIR / image) for image in images if (TEST_IMAGES_DIR / image).is_file()]
+
+def play_multi_board(images, detector):
+    """Recognizes the game of every board shown on the images, locating the boards of each image in parallel."""
+    session = MultiBoardSession()
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for image in images:
+            profiler.start_frame(image)
+            debug_writer.start_frame(image)
+            for game_id, result in session.update(generate_board_matrices(load_image(image), detector, executor)).items():
+                if result["status"] == "error":
+                    print(f"[error] [{game_id}] {result['error']}")
+            profiler.end_frame()
 
-def find_san_move(board_before: chess.Board, board_after: chess.Board):
-    move_uci = None
-    for move in board_before.legal_moves:
-        board_before.push(move)
-        if board_before.board_fen() == board_after.board_fen():
-            move_uci = move
-            break
-        board_before.pop()
-    if move_uci is not None:
-        board_before.pop()
-    return board_before.san(move)
+    print("========================================")
+    for game_id, game in session.sessions.items():
+        print(f"[info] [{game_id}] {len(game.moves)} moves: {' '.join(game.moves)}")
+    print("========================================")
 
-def update_board_state(board: chess.Board, san_move: str):
-    global board_state
-    if board_state is None:
-        board_state = board.copy()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recognizes a chess game from a sequence of images.")
+    parser.add_argument("--no-cache", action="store_true", help="don't read or write the results cache")
+    parser.add_argument("--clear-cache", action="store_true", help="remove every cached result before running")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes used for the image processing")
+    parser.add_argument("--video", help="read the game from a video file (or camera index) instead of the test images")
+    parser.add_argument("--track", action="store_true", help="reuse the board corners and grid while the camera doesn't move")
+    parser.add_argument("--incremental", action="store_true", help="detect the pieces only on the cells that changed since the previous frame")
+    parser.add_argument("--profile", metavar="PATH", help="write the time of each pipeline stage per frame to a JSON lines file")
+    parser.add_argument("--debug-output", metavar="DIR", help="write the debug overlays (lines, grid points, pieces) of each frame to a directory")
+    parser.add_argument("--contact-sheet", action="store_true", help="with --debug-output, write a single contact sheet of thumbnails per game")
+    parser.add_argument("--stable-frames", type=int, default=5, help="frames the board must stay still before a video frame is processed")
+    parser.add_argument("--multi-board", action="store_true", help="follow every board shown on the images, each one as a game of its own")
+    args = parser.parse_args(argv)
+    if args.multi_board and (args.video is not None or args.workers > 1 or args.track or args.incremental):
+        parser.error("--multi-board reads the test images in a single process, without --video, --workers, --track or --incremental")
+
+    cache = None if args.no_cache else ResultCache()
+    if args.clear_cache:
+        (cache or ResultCache()).clear()
+
+    if args.profile is not None:
+        profiler.enable(args.profile)
+    if args.debug_output is not None:
+        debug_writer.enable(args.debug_output, args.contact_sheet)
+        debug_writer.start_game(Path(args.video).stem if args.video is not None else TEST_IMAGES_DIR.name)
+
+    tracker = BoardTracker() if args.track else None
+    detector = load_detector()
+    if args.multi_board:
+        play_multi_board(images, detector)
+        profiler.summary()
+        profiler.disable()
+        if debug_writer.enabled:
+            debug_writer.disable()
+            debug_writer.report()
+        return
+    incremental = IncrementalDetector(detector) if args.incremental else None
+    change_detector = None
+    if args.video is not None:
+        change_detector = BoardChangeDetector(stable_frames=args.stable_frames)
+        video_source = int(args.video) if args.video.isdigit() else args.video
+        board_matrices = iter_video_board_matrices(video_source, detector, change_detector, tracker, incremental)
     else:
-        board_state.push_san(san_move)
-
-def generate_board_matrix_from_image(imgPath : str, model):
-    img = load_image(imgPath)
-    warped = select_chessboard_area(img)
-    chessboard_matrix = map_chessboard(warped)
-    results = roboflow_detect_objects(model, warped)
-    draw_bounding_boxes(warped, results)
-    map_all_pieces(chessboard_matrix, results)
-    return chessboard_matrix
-
-if __name__ == '__main__':
-
-    model = load_roboflow_model()
-
-    for image in images:
-        board_matrix = generate_board_matrix_from_image(image, model)
-        matrix_fen = board_matrix.export_to_fen()
-
-        if not validate_board_matrix(matrix_fen):
-            print("[error] Invalid board matrix detected. Try another image. Exiting...")
-            exit()
-
-        new_board = chess.Board(fen=matrix_fen)
-
-        if image == images[0]: # initial state
-            board_state = new_board.copy()
-            print(f"[info] Initial state: {board_state.fen()}")
-        else:
-            san_move = find_san_move(board_state, new_board)
-            if san_move == None:
-                print("[error] White must be first to move!")
+        board_matrices = iter_board_matrices(images, cache=cache, workers=args.workers, tracker=tracker, incremental=incremental)
+
+    session = GameSession()
+    try:
+        for image, board_matrix in board_matrices:
+            result = session.update(board_matrix)
+            if result["status"] == "error":
+                print(f"[error] {result['error']} \nExiting...")
                 exit()
-            print(f"[info] Detected move: {san_move}")
-
-            update_board_state(new_board, san_move)
-            if not is_conversion_successful(board_matrix, board_state):
-                print("[error] Conversion from board matrix to chess.Board failed. \nThere must have been an error on the chess piece detection/classification or the sequence of images does not start with the initial board state. \nExiting...")
-                exit()
-            print(f"[info] New board state: {board_state.fen()}")
-            moves_list.append(san_move)
+            profiler.end_frame()
+    except (ValueError, OSError) as error: # GridDetectionError, or an image that could not be read
+        print(f"[error] {error} \nExiting...")
+        exit()
 
     print("========================================")
     print("======== GAME FINISHED! MOVES: =========")
-    for i, move in enumerate(moves_list):
+    for i, move in enumerate(session.moves):
         if i % 2 == 0:
             print(f"{(i // 2) + 1}. {move}", end=" ")
         else:
             print(move)
     print("\n========================================")
 
+    if cache is not None:
+        cache.report()
+    if change_detector is not None:
+        change_detector.report()
+    if tracker is not None:
+        tracker.report()
+    if incremental is not None:
+        incremental.report()
+    if isinstance(detector, RemoteDetector):
+        detector.report()
+    profiler.summary()
+    profiler.disable()
+    if debug_writer.enabled:
+        debug_writer.disable()
+        debug_writer.report()
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent))
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from application.ifsc_chess.chessboard_operations import *
+from application.ifsc_chess.board_tracker import *
+from application.ifsc_chess.incremental_detection import *
+from application.detection.detectors import *
+from application.utils.result_cache import *
+
+def generate_board_matrix_from_image(imgPath : str, detector: Detector, cache: ResultCache = None, tracker: BoardTracker = None,
+                                     incremental: IncrementalDetector = None):
+    profiler.start_frame(imgPath)
+    debug_writer.start_frame(imgPath)
+    if cache is not None:
+        key = cache.make_key(imgPath, pipeline_parameters(detector.identifier(), tracker, incremental))
+        entry = cache.get(key)
+        if entry is not None:
+            print(f"[debug] Using cached results for image: {imgPath}")
+            if incremental is not None:
+                # its previous frame is older than this one, the next frame not cached is detected whole
+                incremental.reset()
+            chessboard_matrix = ChessboardMatrix(np.array(entry["grid_points"]))
+            map_all_pieces(chessboard_matrix, entry["predictions"])
+            return chessboard_matrix
+
+    img = load_image(imgPath)
+    chessboard_matrix, corners, grid_points, results = generate_board_matrix(img, detector, tracker, incremental)
+
+    if cache is not None:
+        cache.put(key, corners, grid_points, results)
+    return chessboard_matrix
+
+def generate_board_matrix(img, detector: Detector, tracker: BoardTracker = None, incremental: IncrementalDetector = None):
+    """
+    Runs the whole recognition pipeline on an image already in memory.
+    tracker: BoardTracker used to reuse the board geometry of the previous frames, or None.
+    incremental: IncrementalDetector used instead of detector to detect only the cells that changed, or None.
+    Returns: the board matrix, the board corners, the 81 grid points and the predictions.
+    """
+    if tracker is not None:
+        corners, warped, grid_points = tracker.locate(img)
+    else:
+        corners, warped, grid_points = locate_chessboard(img)
+    show_image(warped, "warped")
+    chessboard_matrix = ChessboardMatrix(grid_points)
+    with profiler.stage("detection"):
+        results = incremental.predict(warped, chessboard_matrix) if incremental is not None else detector.predict(warped)
+    profiler.record("predictions", len(results))
+    draw_bounding_boxes(warped, results)
+    map_all_pieces(chessboard_matrix, results)
+    return chessboard_matrix, corners, grid_points, results
+
+def generate_board_matrices(img, detector: Detector, executor=None):
+    """
+    Runs the recognition pipeline on an image showing several boards, see locate_chessboards.
+    The boards are located in parallel on executor, if any, and their pieces detected in a single batch.
+    Returns: for each board, its region of the image, its board matrix and None,
+    or its region, None and the error raised when it couldn't be located.
+    """
+    located = locate_chessboards(img, executor=executor)
+    boards = [(region, board) for region, board, _ in located if board is not None]
+    for _, (_, warped, _) in boards:
+        show_image(warped, "warped")
+    with profiler.stage("detection"):
+        results = detector.predict_batch([warped for _, (_, warped, _) in boards]) if boards else []
+    profiler.record("predictions", sum(len(predictions) for predictions in results))
+
+    matrices = {}
+    for (region, (_, warped, grid_points)), predictions in zip(boards, results):
+        draw_bounding_boxes(warped, predictions)
+        chessboard_matrix = ChessboardMatrix(grid_points)
+        map_all_pieces(chessboard_matrix, predictions)
+        matrices[region] = chessboard_matrix
+    return [(region, matrices.get(region), error) for region, _, error in located]
+
+
+# State of each worker process, created once by _init_worker
+_worker = {}
+
+def _init_worker(detector_backend, detector_args, cache_directory, track, incremental, profile, debug=None):
+    if profile:
+        profiler.enable()
+    if debug is not None:
+        # the frames of the game are split between the workers, so each one writes its own contact sheet
+        debug_writer.enable(**debug, sheet_name=f"contact_sheet-{os.getpid()}.jpg")
+    _worker["detector"] = load_detector(detector_backend, *detector_args)
+    _worker["cache"] = ResultCache(cache_directory) if cache_directory is not None else None
+    _worker["tracker"] = BoardTracker() if track else None
+    _worker["incremental"] = IncrementalDetector(_worker["detector"]) if incremental else None
+
+def _process_image(imgPath):
+    cache = _worker["cache"]
+    stats_before = dict(cache.stats) if cache is not None else {}
+    chessboard_matrix = generate_board_matrix_from_image(imgPath, _worker["detector"], cache, _worker["tracker"], _worker["incremental"])
+    stats = {key: value - stats_before[key] for key, value in cache.stats.items()} if cache is not None else {}
+    return chessboard_matrix, stats, profiler.end_frame()
+
+def iter_board_matrices(images, detector_backend=DETECTOR_BACKEND, detector_args=(), cache=None, workers=1, tracker=None, incremental=None):
+    """
+    Generates the board matrix of each image, yielding (image, matrix) in the order of images.
+    With more than one worker the images are processed by a pool of processes, each one with
+    its own detector, and results wait in a reorder window until every previous image is done,
+    so the chess logic can consume them as soon as the next frame in sequence is ready.
+    detector_backend, detector_args: passed to load_detector.
+    cache: ResultCache shared by all the workers, or None.
+    workers: number of worker processes.
+    tracker: BoardTracker used to reuse the board geometry between frames, or None.
+    Each worker process keeps its own tracker.
+    incremental: IncrementalDetector, with its own detector, used to detect only the cells that changed, or None.
+    Each worker process keeps its own IncrementalDetector, comparing the frames it processes.
+    The frames profiled by the workers are added to the profiler of this process.
+    If the debug writer is enabled, each worker process writes the overlays of its frames with the same settings.
+    """
+    if workers <= 1:
+        detector = load_detector(detector_backend, *detector_args)
+        for image in images:
+            yield image, generate_board_matrix_from_image(image, detector, cache, tracker, incremental)
+        return
+
+    cache_directory = str(cache.directory) if cache is not None else None
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(detector_backend, tuple(detector_args), cache_directory, tracker is not None,
+                                             incremental is not None, profiler.enabled, debug_writer.settings()))
+    try:
+        images = iter(images)
+        pending = deque()
+        # Keep every worker busy with one image queued ahead, without submitting the whole game at once
+        for image in images:
+            pending.append((image, executor.submit(_process_image, image)))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            image, future = pending.popleft()
+            chessboard_matrix, stats, profile = future.result()
+            profiler.add_frame(profile)
+            if cache is not None:
+                for key, value in stats.items():
+                    cache.stats[key] += value
+            next_image = next(images, None)
+            if next_image is not None:
+                pending.append((next_image, executor.submit(_process_image, next_image)))
+            yield image, chessboard_matrix
+    finally:
+        executor.shutdown(cancel_futures=True)
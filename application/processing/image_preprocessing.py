@@ -4,22 +4,40 @@ sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
 
 import cv2
 import numpy as np
-from sklearn.cluster import DBSCAN
 
-def pre_process(img):
+from application.utils.profiling import profiled, profiler
+from application.config import CANNY_THRESHOLDS, HOUGH_THRESHOLD, HOUGH_MIN_LINE_LENGTH, HOUGH_MAX_LINE_GAP, MEDIAN_BLUR_SIZE, DILATION_KERNEL_SIZE
+
+def scale_pixels(value, scale, minimum=1):
+    """Scales a length in pixels tuned for the reference resolution (REFERENCE_IMAGE_SIDE) to the working resolution."""
+    return max(minimum, int(round(value * scale)))
+
+def scale_kernel(size, scale):
+    """Scales a kernel size like scale_pixels, keeping it odd (a size of 1 leaves the image unchanged)."""
+    return int(round(size * scale)) | 1
+
+def downscale(img, factor):
+    """Resizes the image by factor (< 1) averaging the pixels, so thin lines are not lost."""
+    return cv2.resize(img, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+
+@profiled("pre_process")
+def pre_process(img, blur_size=MEDIAN_BLUR_SIZE):
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.medianBlur(gray, 7)
+    blurred = cv2.medianBlur(gray, blur_size)
     return blurred
 
-def edge_and_dilate(img, dilate_iterations=1):
-    edges = cv2.Canny(img, 30, 120, apertureSize=3, L2gradient=True)
-    dilated = cv2.dilate(edges, np.ones((3, 3), np.uint8), iterations=dilate_iterations)
+@profiled("edge_and_dilate")
+def edge_and_dilate(img, dilate_iterations=1, kernel_size=DILATION_KERNEL_SIZE):
+    edges = cv2.Canny(img, *CANNY_THRESHOLDS, apertureSize=3, L2gradient=True)
+    dilated = cv2.dilate(edges, np.ones((kernel_size, kernel_size), np.uint8), iterations=dilate_iterations)
     return dilated
 
-def detect_lines(edges, minLength=200, maxGap=20):
-    lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=100, minLineLength=minLength, maxLineGap=maxGap)
+@profiled("detect_lines")
+def detect_lines(edges, minLength=HOUGH_MIN_LINE_LENGTH, maxGap=HOUGH_MAX_LINE_GAP, threshold=HOUGH_THRESHOLD):
+    lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=threshold, minLineLength=minLength, maxLineGap=maxGap)
     if lines is None:
         raise ValueError("No lines detected in the image.")
+    profiler.record("lines", len(lines))
     return lines
 
 def extrapolate_line(x1, y1, x2, y2, img_shape):
@@ -35,6 +53,83 @@ def extrapolate_line(x1, y1, x2, y2, img_shape):
     else:
         return x1, 0, x2, height  # Vertical line
     
+# Number of lines before and after merge_lines, accumulated over every call
+line_merge_stats = {"raw": 0, "merged": 0}
+
+def reset_line_merge_stats():
+    line_merge_stats["raw"] = 0
+    line_merge_stats["merged"] = 0
+
+def _split_by_gap(values, tolerance):
+    """
+    Groups 1D values so that consecutive sorted values closer than tolerance share a group.
+    Returns: list of index arrays, one per group.
+    """
+    order = np.argsort(values, kind='stable')
+    breaks = np.nonzero(np.diff(values[order]) > tolerance)[0] + 1
+    return np.split(order, breaks)
+
+def merge_lines(lines, img_shape, angle_tolerance=2, distance_tolerance=None):
+    """
+    Merges nearly identical extrapolated lines into one representative line.
+    Lines are grouped by the angle of their normal and by their distance to the
+    image center, and each group is replaced by the line with the median angle and distance.
+    lines: list of extrapolated lines (x1, y1, x2, y2).
+    img_shape: shape of the image the lines were extrapolated to.
+    angle_tolerance: maximum angle difference inside a group, in degrees.
+    distance_tolerance: maximum distance difference inside a group, in pixels.
+    Defaults to 1/150 of the smallest image dimension.
+    Returns: list of merged extrapolated lines.
+    """
+    height, width = img_shape[:2]
+    if distance_tolerance is None:
+        distance_tolerance = min(height, width) / 150
+
+    line_merge_stats["raw"] += len(lines)
+    if len(lines) == 0:
+        return []
+
+    x1, y1, x2, y2 = np.asarray(lines, dtype=np.float64).reshape(-1, 4).T
+
+    # Normal form x*cos(theta) + y*sin(theta) = rho, with theta in [-45, 135) degrees
+    # so that both horizontal and vertical lines stay away from the wrap-around
+    theta = np.arctan2(x2 - x1, y1 - y2)
+    theta = np.mod(theta + np.pi / 4, 2 * np.pi) - np.pi / 4
+    rho = x1 * np.cos(theta) + y1 * np.sin(theta)
+    flipped = theta >= 3 * np.pi / 4
+    theta[flipped] -= np.pi
+    rho[flipped] *= -1
+
+    # Distance relative to the image center, so lines that cross far from the origin are not confused
+    offset = rho - (width / 2 * np.cos(theta) + height / 2 * np.sin(theta))
+
+    merged = []
+    angle_tolerance = np.deg2rad(angle_tolerance)
+    for angle_group in _split_by_gap(theta, angle_tolerance):
+        for offset_group in _split_by_gap(offset[angle_group], distance_tolerance):
+            offset_group = angle_group[offset_group]
+            # Split again by angle: the first split chains the whole fan of grid lines together
+            for group in _split_by_gap(theta[offset_group], angle_tolerance):
+                indices = offset_group[group]
+                line_theta = np.median(theta[indices])
+                line_rho = np.median(offset[indices]) + width / 2 * np.cos(line_theta) + height / 2 * np.sin(line_theta)
+                merged.append(normal_form_to_line(line_theta, line_rho, img_shape))
+
+    line_merge_stats["merged"] += len(merged)
+    print(f"[debug] merged {len(lines)} lines into {len(merged)}")
+    return merged
+
+def normal_form_to_line(theta, rho, img_shape):
+    """Converts a line in normal form to an extrapolated line, like extrapolate_line."""
+    height, width = img_shape[:2]
+    cos_theta, sin_theta = np.cos(theta), np.sin(theta)
+    if abs(sin_theta) < 1e-3:
+        x = int(rho / cos_theta)
+        return x, 0, x, height  # Vertical line
+    y0 = int(rho / sin_theta)  # Left intersection
+    y_max = int((rho - width * cos_theta) / sin_theta)  # Right intersection
+    return 0, y0, width, y_max
+
 def calculate_angle(line1, line2):
     """Calculates the angle between two lines."""
     dx1, dy1 = line1[2] - line1[0], line1[3] - line1[1]
@@ -73,8 +168,11 @@ def line_intersection(line1, line2, tolerance=5):
                 return None
     return None
 
-def detect_intersections(lines):
-    """Detects intersections between detected lines."""
+def detect_intersections_pairwise(lines):
+    """
+    Detects intersections between detected lines, one pair at a time.
+    Reference implementation for detect_intersections.
+    """
     intersections = []
     for i in range(len(lines)):
         for j in range(i + 1, len(lines)):
@@ -84,9 +182,75 @@ def detect_intersections(lines):
 
     return np.array(intersections)
 
+def batch_line_intersections(lines, tolerance=5, block_size=256):
+    """
+    Computes the intersections of every pair of lines as array operations.
+    Produces the same points, in the same order, as calling line_intersection
+    for every pair (i, j) with i < j.
+    lines: sequence of (x1, y1, x2, y2) lines.
+    tolerance: maximum deviation from 90 degrees, in degrees.
+    block_size: number of lines processed per block, bounds the memory used
+    when there are thousands of lines.
+    Returns: np.ndarray of shape (n, 2) with the integer intersection points.
+    """
+    lines = np.asarray(lines, dtype=np.int64).reshape(-1, 4)
+    n = len(lines)
+    if n < 2:
+        return np.empty((0, 2), dtype=np.int64)
+
+    x1, y1, x2, y2 = lines.T
+    dx, dy = x2 - x1, y2 - y1
+    mag = np.sqrt(dx**2 + dy**2)
+
+    # Line equations A*x + B*y = C, same as line_intersection
+    A = dy.astype(np.float64)
+    B = (x1 - x2).astype(np.float64)
+    C = (dy * x1 + (x1 - x2) * y1).astype(np.float64)
+
+    columns = np.arange(n)
+    blocks = []
+    for start in range(0, n - 1, block_size):
+        stop = min(start + block_size, n - 1)
+        rows = np.arange(start, stop)
+        i, j = np.nonzero(columns[None, :] > rows[:, None])
+        i += start
+
+        # Angle between each pair of lines
+        dot_product = dx[i] * dx[j] + dy[i] * dy[j]
+        mag_product = mag[i] * mag[j]
+        degenerate = mag_product == 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cos_angle = np.clip(dot_product / mag_product, -1.0, 1.0)
+        angle = np.arccos(cos_angle) * (180.0 / np.pi)
+        perpendicular = degenerate | (((90 - tolerance) <= angle) & (angle <= (90 + tolerance)))
+
+        i, j = i[perpendicular], j[perpendicular]
+        determinant = A[i] * B[j] - A[j] * B[i]
+        valid = np.abs(determinant) >= 1e-10
+        i, j, determinant = i[valid], j[valid], determinant[valid]
+
+        with np.errstate(over='ignore', invalid='ignore'):
+            x = (B[j] * C[i] - B[i] * C[j]) / determinant
+            y = (A[i] * C[j] - A[j] * C[i]) / determinant
+        finite = np.isfinite(x) & np.isfinite(y)
+        blocks.append(np.stack((x[finite], y[finite]), axis=1))
+
+    return np.trunc(np.concatenate(blocks)).astype(np.int64)
+
+@profiled("detect_intersections")
+def detect_intersections(lines, tolerance=5):
+    """Detects intersections between detected lines."""
+    intersections = batch_line_intersections(lines, tolerance)
+    profiler.record("intersections", len(intersections))
+    if len(intersections) == 0:
+        return np.array([])
+    return intersections
+
 def find_extreme_points(intersections):
     """Finds the 4 extreme points of the chessboard using the Convex Hull."""
-    hull = cv2.convexHull(intersections)
+    if len(intersections) < 4:
+        raise ValueError(f"Found {len(intersections)} intersections, not enough to calculate the extremes.")
+    hull = cv2.convexHull(np.asarray(intersections, dtype=np.float32).reshape(-1, 1, 2))
     if len(hull) < 4:
         raise ValueError("Convex Hull does not have enough points to calculate the extremes.")
 
@@ -115,40 +279,214 @@ def calculate_image_size(rect):
 
     return width, height
 
-def warp_perspective(img, corners):
-    """Applies perspective transformation to the image."""
+def perspective_transform(corners):
+    """Returns: the perspective matrix from the image to the warped board area and the (width, height) of the warped image."""
     width, height = calculate_image_size(corners)
-    
     dst_points = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype='float32')
-    M = cv2.getPerspectiveTransform(corners, dst_points)
-    
-    return cv2.warpPerspective(img, M, (width, height))
+    return cv2.getPerspectiveTransform(corners, dst_points), (width, height)
+
+@profiled("warp_perspective")
+def warp_perspective(img, corners, allocate=None):
+    """
+    Applies perspective transformation to the image.
+    allocate: function called with the shape of the warped image, returning the array it is written to
+    (e.g. a view on a FrameStore) or None to write it to a new array.
+    """
+    M, (width, height) = perspective_transform(corners)
+
+    dst = allocate((height, width) + img.shape[2:]) if allocate is not None else None
+    if dst is None:
+        return cv2.warpPerspective(img, M, (width, height))
+    cv2.warpPerspective(img, M, (width, height), dst=dst)
+    return dst
+
+class GridDetectionError(ValueError):
+    """Raised when the grid clustering does not find the 81 intersections of the chessboard."""
+    def __init__(self, found, expected=81):
+        super().__init__(f"Detected {found} intersections instead of {expected}. Please try again using another image on better lighting conditions and less background noise.")
+        self.found = found
+        self.expected = expected
+
+    def __reduce__(self):
+        return type(self), (self.found, self.expected)
+
+def dbscan_labels(points, eps, min_samples):
+    """
+    Labels the points like sklearn's DBSCAN does (same clusters, numbered in the same order, -1 for noise),
+    looking for the neighbors in a grid of cells instead of a tree.
+    The cells have side eps / sqrt(2), so the points of a cell are all neighbors of each other:
+    a cell with min_samples points only has core points, two core points of the same cell are always
+    connected, and distances are only computed for the sparse cells and between neighboring cells.
+    points: np.ndarray (N, 2).
+    Returns: np.ndarray (N,) with the cluster of each point.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) == 0:
+        return np.empty(0, dtype=np.int64)
+    # duplicated points are neighbors of each other, so each one is handled once with its count as weight
+    unique, inverse, weights = _unique_rows(points)
+    first_index = np.full(len(unique), len(points))
+    np.minimum.at(first_index, inverse, np.arange(len(points)))
+    squared_eps = eps * eps
 
+    cell_keys, cell_of_point, _ = _unique_rows(np.floor(unique / (eps / np.sqrt(2))).astype(np.int64))
+    order = np.argsort(cell_of_point, kind='stable')
+    bounds = np.searchsorted(cell_of_point[order], np.arange(len(cell_keys) + 1))
+    members = [order[bounds[cell]:bounds[cell + 1]] for cell in range(len(cell_keys))]
+    cell_weights = np.add.reduceat(weights[order], bounds[:-1])
+
+    # pairs of cells up to 2 cells apart, the farthest a neighbor can be
+    origin = cell_keys.min(axis=0) - 2
+    stride = cell_keys[:, 1].max() - origin[1] + 3
+    codes = (cell_keys[:, 0] - origin[0]) * stride + (cell_keys[:, 1] - origin[1])
+    pair_cells, pair_neighbors = [], []
+    for dx in range(-2, 3):
+        for dy in range(-2, 3):
+            position = np.minimum(np.searchsorted(codes, codes + dx * stride + dy), len(codes) - 1)
+            found = codes[position] == codes + dx * stride + dy
+            pair_cells.append(np.flatnonzero(found))
+            pair_neighbors.append(position[found])
+    pair_cells, pair_neighbors = np.concatenate(pair_cells), np.concatenate(pair_neighbors)
+
+    def squared_distances(a, b):
+        return ((unique[a][:, None, :] - unique[b][None, :, :])**2).sum(axis=2)
+
+    def neighbor_cells(cell):
+        return pair_neighbors[pair_cells == cell]
+
+    is_core = np.repeat(cell_weights >= min_samples, np.diff(bounds))[np.argsort(order)]
+    for cell in np.flatnonzero(cell_weights < min_samples):
+        candidates = np.concatenate([members[neighbor] for neighbor in neighbor_cells(cell)])
+        neighbor_weights = (squared_distances(members[cell], candidates) <= squared_eps) @ weights[candidates]
+        is_core[members[cell]] = neighbor_weights >= min_samples
+
+    # bounding box of the core points of each cell, to skip the pairs of cells too far apart
+    core_order = order[is_core[order]]
+    core_cells = np.unique(cell_of_point[core_order])
+    starts = np.flatnonzero(np.diff(cell_of_point[core_order], prepend=-1))
+    boxes = np.zeros((len(cell_keys), 4))
+    boxes[core_cells, :2] = np.minimum.reduceat(unique[core_order], starts)
+    boxes[core_cells, 2:] = np.maximum.reduceat(unique[core_order], starts)
+    has_core = np.zeros(len(cell_keys), dtype=bool)
+    has_core[core_cells] = True
+    candidate = (pair_cells < pair_neighbors) & has_core[pair_cells] & has_core[pair_neighbors]
+    core_pairs = pair_cells[candidate], pair_neighbors[candidate]
+    gaps = np.maximum(np.maximum(boxes[core_pairs[1], :2] - boxes[core_pairs[0], 2:], boxes[core_pairs[0], :2] - boxes[core_pairs[1], 2:]), 0)
+    close = (gaps**2).sum(axis=1) <= squared_eps
+
+    # connect the cells whose core points are neighbors (union-find over the cells)
+    core_members = {cell: members[cell][is_core[members[cell]]] for cell in core_cells.tolist()}
+    parent = list(range(len(cell_keys)))
+    def find(cell):
+        while parent[cell] != cell:
+            parent[cell] = parent[parent[cell]]
+            cell = parent[cell]
+        return cell
+    for cell, neighbor in zip(core_pairs[0][close].tolist(), core_pairs[1][close].tolist()):
+        if find(cell) == find(neighbor):
+            continue
+        # only the points close to the bounding box of the other cell can be neighbors
+        near_a = core_members[cell][_squared_distance_to_box(unique[core_members[cell]], boxes[neighbor]) <= squared_eps]
+        near_b = core_members[neighbor][_squared_distance_to_box(unique[core_members[neighbor]], boxes[cell]) <= squared_eps]
+        if len(near_a) and len(near_b) and squared_distances(near_a, near_b).min() <= squared_eps:
+            parent[find(neighbor)] = find(cell)
+
+    # DBSCAN numbers the clusters in the order of their first core point, and a border point
+    # belongs to the first cluster that reaches it
+    roots = np.array([find(cell) for cell in core_cells.tolist()], dtype=np.int64)
+    first_core = np.full(len(cell_keys), len(points))
+    np.minimum.at(first_core, roots[np.searchsorted(core_cells, cell_of_point[core_order])], first_index[core_order])
+    cluster_roots = np.unique(roots)
+    cluster_of_root = np.full(len(cell_keys), -1)
+    cluster_of_root[cluster_roots[np.argsort(first_core[cluster_roots], kind='stable')]] = np.arange(len(cluster_roots))
+    cluster_of_cell = np.full(len(cell_keys), -1)
+    cluster_of_cell[core_cells] = cluster_of_root[roots]
+
+    labels = np.where(is_core, cluster_of_cell[cell_of_point], -1)
+    for cell in np.flatnonzero(cell_weights < min_samples):
+        border = members[cell][~is_core[members[cell]]]
+        candidates = [core_members[neighbor] for neighbor in neighbor_cells(cell).tolist() if neighbor in core_members]
+        if len(border) == 0 or not candidates:
+            continue
+        candidates = np.concatenate(candidates)
+        reachable = squared_distances(border, candidates) <= squared_eps
+        clusters = np.where(reachable, cluster_of_cell[cell_of_point[candidates]][None, :], len(cluster_roots)).min(axis=1)
+        labels[border] = np.where(clusters < len(cluster_roots), clusters, -1)
+    return labels[inverse]
+
+def _unique_rows(rows):
+    """Same as np.unique(rows, axis=0, return_inverse=True, return_counts=True) for 2 columns, without sorting a structured view."""
+    order = np.lexsort((rows[:, 1], rows[:, 0]))
+    sorted_rows = rows[order]
+    starts = np.concatenate(([True], (sorted_rows[1:] != sorted_rows[:-1]).any(axis=1)))
+    inverse = np.empty(len(rows), dtype=np.int64)
+    inverse[order] = np.cumsum(starts) - 1
+    counts = np.diff(np.append(np.flatnonzero(starts), len(rows)))
+    return sorted_rows[starts], inverse, counts
+
+def _squared_distance_to_box(points, box):
+    gap = np.maximum(np.maximum(box[:2] - points, points - box[2:]), 0)
+    return (gap**2).sum(axis=1)
+
+@profiled("dbscan_cluster_points")
 def dbscan_cluster_points(intersections, eps=10, min_samples=2):
     """
     Groups points based on Euclidean distance using DBSCAN.
     intersections: np.ndarray with detected points.
     eps: maximum distance to consider points in the same cluster.
     min_samples: minimum number of points to form a cluster.
+    Returns: the median point of each cluster.
+    Raises: GridDetectionError if there are not 81 clusters.
     """
-    clustering = DBSCAN(eps=eps, min_samples=min_samples).fit(intersections)
-    labels = clustering.labels_
-
-    # Calculate the central point of each cluster
-    unique_labels = set(labels)
-    clusters = []
-    for label in unique_labels:
-        if label != -1:  # Ignore noise
-            cluster_points = intersections[labels == label]
-            # centroid = cluster_points.mean(axis=0) # arithmetic mean
-            # centroid = cluster_points[np.argmin(np.linalg.norm(cluster_points - cluster_points.mean(axis=0), axis=1))] # densest point
-            centroid = np.median(cluster_points, axis=0) # median
-            clusters.append(centroid)
+    labels = dbscan_labels(intersections, eps, min_samples)
+
+    # Calculate the central point of each cluster, ignoring noise
+    clustered = labels != -1
+    order = np.argsort(labels[clustered], kind='stable')
+    groups = np.split(intersections[clustered][order], np.cumsum(np.bincount(labels[clustered]))[:-1])
+    # centroid = cluster_points.mean(axis=0) # arithmetic mean
+    # centroid = cluster_points[np.argmin(np.linalg.norm(cluster_points - cluster_points.mean(axis=0), axis=1))] # densest point
+    clusters = [np.median(cluster_points, axis=0) for cluster_points in groups if len(cluster_points)] # median
+    profiler.record("clusters", len(clusters))
     if (len(clusters) != 81):
-        print(f"[error] Detected {len(clusters)} intersections instead of 81. Please try again using another image on better lighting conditions and less background noise.")
-        exit()
+        raise GridDetectionError(len(clusters))
     return np.array(clusters)
 
+@profiled("fit_grid_lattice")
+def fit_grid_lattice(points, width, height, radius=0.3, iterations=3):
+    """
+    Fits the 9x9 lattice of the chessboard grid to intersections already in the coordinates of the warped board.
+    Starts from an even lattice over the whole warped image. Each intersection within radius (in cells) of a node
+    of the lattice votes for it, the median of the votes of each node is taken as its position, and the lattice
+    is fitted again to these positions with a homography (RANSAC, so a node voted by the intersections of a
+    piece or of the board margin doesn't pull the others), which absorbs the small errors of the board corners.
+    points: np.ndarray (n, 2) with the intersections, duplicates and lines outside the grid included.
+    width, height: size of the warped board.
+    Returns: the 81 lattice points (node (i, j) at index 9 * i + j, i along x), the number of nodes with votes
+    and the distance of each of these nodes to the lattice, in cells.
+    """
+    nodes = np.stack(np.meshgrid(np.arange(9), np.arange(9), indexing="ij"), axis=-1).reshape(-1, 2).astype(np.float32)
+    homography = np.array([[(width - 1) / 8, 0, 0], [0, (height - 1) / 8, 0], [0, 0, 1]])
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    for _ in range(iterations):
+        board = cv2.perspectiveTransform(points.reshape(-1, 1, 2), np.linalg.inv(homography)).reshape(-1, 2)
+        nearest = np.rint(board)
+        voting = (np.abs(board - nearest) < radius).all(axis=1) & ((nearest >= 0) & (nearest <= 8)).all(axis=1)
+        keys = (nearest[voting, 0] * 9 + nearest[voting, 1]).astype(int)
+        supported = np.unique(keys)
+        if len(supported) < 4:
+            return None, len(supported), np.array([np.inf])
+        voters = points[voting]
+        medians = np.array([np.median(voters[keys == key], axis=0) for key in supported])
+        homography, _ = cv2.findHomography(nodes[supported], medians, cv2.RANSAC, 0.1 * min(width, height) / 8)
+        if homography is None:
+            return None, len(supported), np.array([np.inf])
+    lattice = cv2.perspectiveTransform(nodes.reshape(-1, 1, 2).astype(np.float64), homography).reshape(-1, 2)
+    cell_size = np.array([width, height]) / 8
+    residuals = np.linalg.norm((lattice[supported] - medians) / cell_size, axis=1)
+    profiler.record("lattice_nodes", len(supported))
+    return lattice, len(supported), residuals
+
 def group_points_by_order(points):
     """
     Organize the points by row and column order.\n
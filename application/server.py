@@ -0,0 +1,447 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent))
+
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from application.pipeline import *
+from application.ifsc_chess.game_session import GameSession
+from application.utils.frame_store import FrameStore, shared_memory_slots
+
+HTTP_REASONS = {
+    200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict",
+    413: "Payload Too Large", 422: "Unprocessable Entity", 429: "Too Many Requests", 503: "Service Unavailable",
+}
+
+def locate_board(image_bytes):
+    """
+    Decodes an uploaded image and finds the board on it, the CPU-bound part of the pipeline.
+    Returns: the warped board area and its 81 grid points.
+    """
+    img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not decode the uploaded image.")
+    _, warped, grid_points = locate_chessboard(img)
+    return warped, grid_points
+
+# FrameStore of the server, opened once in each worker process by _attach_frame_store
+_worker_frame_store = {}
+
+def _attach_frame_store(name):
+    _worker_frame_store["store"] = FrameStore.attach(name)
+
+def locate_board_in_store(frame_id):
+    """
+    Same as locate_board, for an uploaded image put in the FrameStore of the server.
+    The warped board replaces the image bytes in the slot of the frame, since they are no longer
+    needed once decoded, so it goes back to the server without being pickled.
+    Returns: None (the warped board is the frame) or the warped board if it doesn't fit a slot, and its 81 grid points.
+    """
+    store = _worker_frame_store["store"]
+    img = cv2.imdecode(store.get(frame_id), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not decode the uploaded image.")
+    allocate = lambda shape: store.new_view(frame_id, shape) if store.fits(shape) else None
+    _, warped, grid_points = locate_chessboard(img, allocate=allocate)
+    return (None if store.holds(warped) else warped), grid_points
+
+def latency_summary(times):
+    if not times:
+        return {"count": 0}
+    return {
+        "median_ms": float(np.median(times)) * 1000,
+        "p95_ms": float(np.percentile(times, 95)) * 1000,
+        "count": len(times),
+    }
+
+
+class DetectionBatcher:
+    """
+    Groups the detection requests of every game into batches for a single detector.
+    A batch is sent as soon as it has max_batch_size images or max_delay seconds after its first image,
+    and the images arriving while the detector is busy wait for the next batch.
+    The detector runs on its own thread, one batch at a time.
+    """
+    def __init__(self, detector: Detector, max_batch_size=DETECTION_BATCH_SIZE, max_delay=DETECTION_BATCH_DELAY):
+        self.detector = detector
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue = None
+        self.task = None
+        self.batch_sizes = []
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.executor.shutdown()
+
+    async def predict(self, image):
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((image, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), max(deadline - loop.time(), 0)))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                predictions = await loop.run_in_executor(self.executor, self.detector.predict_batch, [image for image, _ in batch])
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            if len(predictions) != len(batch):
+                # a missing result would leave its frame, and every later frame of its game, waiting forever
+                error = RuntimeError(f"The detector returned {len(predictions)} results for {len(batch)} images.")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            self.batch_sizes.append(len(batch))
+            for (_, future), result in zip(batch, predictions):
+                if not future.done():
+                    future.set_result(result)
+
+
+class ServedGame:
+    """A GameSession with the bookkeeping of the server: frame ordering, pending frames and latencies."""
+    def __init__(self, game_id, history=1000):
+        self.session = GameSession(game_id)
+        self.turn = asyncio.Condition()
+        self.next_ticket = 0
+        self.applied = 0
+        self.pending = 0
+        self.frames = 0
+        self.errors = 0
+        self.latencies = {stage: deque(maxlen=history) for stage in ("vision", "detection", "chess_logic", "total")}
+
+    def metrics(self):
+        return {
+            "game_id": self.session.game_id,
+            "frames": self.frames,
+            "errors": self.errors,
+            "pending": self.pending,
+            "moves": len(self.session.moves),
+            "latency": {stage: latency_summary(times) for stage, times in self.latencies.items()},
+        }
+
+
+class GameServer:
+    """
+    Serves the recognition of many games at once over HTTP.
+    Each game keeps its own GameSession, fed with the frames uploaded for it in the order they were sent.
+    The board and grid detection of the frames run in a pool of processes, and the piece detection
+    of the frames of every game is batched by a DetectionBatcher.
+    Frames are refused with 503 when the server already has max_pending_frames in progress,
+    and with 429 when the game already has max_session_frames in progress.
+    The uploaded images and the warped boards go between the server and the workers through a
+    FrameStore of frame_store_slots slots (0 to pickle them instead), fewer if /dev/shm can't hold them;
+    the frames that find no free slot are pickled.
+    """
+    def __init__(self, detector: Detector, workers=SERVER_WORKERS, max_pending_frames=SERVER_MAX_PENDING_FRAMES,
+                 max_session_frames=SERVER_MAX_SESSION_FRAMES, max_upload_bytes=SERVER_MAX_UPLOAD_BYTES,
+                 batch_size=DETECTION_BATCH_SIZE, batch_delay=DETECTION_BATCH_DELAY, frame_store_slots=FRAME_STORE_SLOTS):
+        self.batcher = DetectionBatcher(detector, batch_size, batch_delay)
+        self.workers = workers
+        self.executor = None
+        self.frame_store_slots = frame_store_slots
+        self.frame_store = None
+        self.max_pending_frames = max_pending_frames
+        self.max_session_frames = max_session_frames
+        self.max_upload_bytes = max_upload_bytes
+        self.games = {}
+        self.pending = 0
+        self.rejected = 0
+        self.server = None
+        self.connections = set()
+
+    async def start(self, host=SERVER_HOST, port=SERVER_PORT):
+        """Starts listening, returns the port used (useful with port 0)."""
+        slots = shared_memory_slots(self.frame_store_slots)
+        if slots < self.frame_store_slots:
+            print(f"[info] The shared memory only fits {slots} of the {self.frame_store_slots} frame store slots")
+        if slots > 0:
+            self.frame_store = FrameStore(slots)
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_attach_frame_store,
+                                                initargs=(self.frame_store.name,))
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.batcher.start()
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        port = self.server.sockets[0].getsockname()[1]
+        print(f"[info] Serving on http://{host}:{port}")
+        return port
+
+    async def stop(self):
+        self.server.close()
+        # idle keep-alive connections would hold wait_closed forever
+        for writer in list(self.connections):
+            writer.close()
+        await self.server.wait_closed()
+        await self.batcher.stop()
+        self.executor.shutdown(cancel_futures=True)
+        if self.frame_store is not None:
+            self.frame_store.close()
+            self.frame_store = None
+
+    def create_game(self, game_id=None):
+        if game_id is None:
+            game_id = f"game-{len(self.games) + 1}"
+            while game_id in self.games:
+                game_id += "_"
+        elif game_id in self.games:
+            return None
+        self.games[game_id] = ServedGame(game_id)
+        return game_id
+
+    async def process_frame(self, game_id, image_bytes):
+        """
+        Recognizes one frame of a game.
+        Returns: the HTTP status and the result of GameSession.update, with the latency of the frame.
+        """
+        game = self.games.get(game_id)
+        if game is None:
+            return 404, {"error": f"Unknown game '{game_id}'."}
+        if self.pending >= self.max_pending_frames:
+            self.rejected += 1
+            return 503, {"error": "Server busy, try again later."}
+        if game.pending >= self.max_session_frames:
+            self.rejected += 1
+            return 429, {"error": f"Too many frames in progress for game '{game_id}'."}
+
+        loop = asyncio.get_running_loop()
+        ticket = game.next_ticket
+        game.next_ticket += 1
+        self.pending += 1
+        game.pending += 1
+        start = time.perf_counter()
+        frame_id = None
+        try:
+            board_matrix, error = None, None
+            try:
+                frame_id = self._store_upload(image_bytes)
+                if frame_id is None:
+                    warped, grid_points = await loop.run_in_executor(self.executor, locate_board, image_bytes)
+                else:
+                    warped, grid_points = await loop.run_in_executor(self.executor, locate_board_in_store, frame_id)
+                    if warped is None:
+                        warped = self.frame_store.get(frame_id)
+                located = time.perf_counter()
+                game.latencies["vision"].append(located - start)
+                predictions = await self.batcher.predict(warped)
+                game.latencies["detection"].append(time.perf_counter() - located)
+                board_matrix = ChessboardMatrix(grid_points)
+                map_all_pieces(board_matrix, predictions)
+            except Exception as exception: # GridDetectionError, no board lines found, undecodable image...
+                error = str(exception)
+            finally:
+                warped = None # a view on the slot, which is reused once released
+                if frame_id is not None:
+                    self.frame_store.release(frame_id)
+
+            # the frames of a game may finish out of order, but are applied in the order they arrived
+            async with game.turn:
+                await game.turn.wait_for(lambda: game.applied == ticket)
+                try:
+                    logic_start = time.perf_counter()
+                    if error is None:
+                        result = game.session.update(board_matrix)
+                        game.latencies["chess_logic"].append(time.perf_counter() - logic_start)
+                    else:
+                        result = game.session.result("error", error=error)
+                finally:
+                    game.applied += 1
+                    game.turn.notify_all()
+        finally:
+            self.pending -= 1
+            game.pending -= 1
+
+        elapsed = time.perf_counter() - start
+        game.frames += 1
+        game.latencies["total"].append(elapsed)
+        if result["status"] == "error":
+            game.errors += 1
+            return 422, {**result, "latency_ms": elapsed * 1000}
+        return 200, {**result, "latency_ms": elapsed * 1000}
+
+    def _store_upload(self, image_bytes):
+        """Puts an uploaded image in the frame store, returns its frame id or None to pickle it."""
+        if self.frame_store is None or not self.frame_store.fits((len(image_bytes),)):
+            return None
+        try:
+            frame_id = self.frame_store.allocate()
+        except RuntimeError: # every slot is in use
+            return None
+        self.frame_store.put(frame_id, image_bytes)
+        return frame_id
+
+    def metrics(self):
+        batch_sizes = self.batcher.batch_sizes
+        return {
+            "games": len(self.games),
+            "pending": self.pending,
+            "rejected": self.rejected,
+            "detection_batches": len(batch_sizes),
+            "mean_batch_size": float(np.mean(batch_sizes)) if batch_sizes else 0.0,
+            "frame_store": dict(self.frame_store.stats) if self.frame_store is not None else None,
+            "sessions": [game.metrics() for game in self.games.values()],
+        }
+
+    async def route(self, method, path, body):
+        parts = [part for part in urlsplit(path).path.split("/") if part]
+        if parts == ["games"]:
+            if method == "GET":
+                return 200, {"games": list(self.games)}
+            if method == "POST":
+                try:
+                    options = json.loads(body) if body else {}
+                except ValueError:
+                    return 400, {"error": "Invalid JSON body."}
+                if not isinstance(options, dict):
+                    return 400, {"error": "The JSON body must be an object."}
+                if not isinstance(options.get("game_id"), (str, type(None))):
+                    return 400, {"error": "The game_id must be a string."}
+                game_id = self.create_game(options.get("game_id"))
+                if game_id is None:
+                    return 409, {"error": f"Game '{options['game_id']}' already exists."}
+                return 201, {"game_id": game_id}
+        elif len(parts) == 2 and parts[0] == "games":
+            game = self.games.get(parts[1])
+            if game is None:
+                return 404, {"error": f"Unknown game '{parts[1]}'."}
+            if method == "GET":
+                return 200, {**game.metrics(), "move_list": game.session.moves, "fen": game.session.fen(), "pgn": game.session.pgn()}
+            if method == "DELETE":
+                del self.games[parts[1]]
+                return 200, {"game_id": parts[1]}
+        elif len(parts) == 3 and parts[0] == "games" and parts[2] == "frames":
+            if method == "POST":
+                return await self.process_frame(parts[1], body)
+        elif parts == ["metrics"]:
+            if method == "GET":
+                return 200, self.metrics()
+        else:
+            return 404, {"error": f"Unknown path '{path}'."}
+        return 405, {"error": f"Method {method} not allowed on '{path}'."}
+
+    async def _handle_connection(self, reader, writer):
+        self.connections.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode("latin-1").strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get("connection", "").lower() != "close"
+
+                length = int(headers.get("content-length", 0))
+                if length > self.max_upload_bytes:
+                    status, payload = 413, {"error": f"Uploads are limited to {self.max_upload_bytes} bytes."}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length)
+                    status, payload = await self.route(method, path, body)
+
+                content = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(content)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + content
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+
+class ServerClient:
+    """Client of the GameServer API, keeping the connection open between requests."""
+    def __init__(self, url=f"http://{SERVER_HOST}:{SERVER_PORT}"):
+        import requests # imported on first use, the server itself doesn't need it
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+
+    def create_game(self, game_id=None):
+        response = self.session.post(f"{self.url}/games", json={"game_id": game_id} if game_id is not None else {})
+        response.raise_for_status()
+        return response.json()["game_id"]
+
+    def send_frame(self, game_id, image):
+        """
+        Uploads a frame of the game, given as the path of an image file or its encoded bytes.
+        Returns: the HTTP status and the result of the frame.
+        """
+        if not isinstance(image, bytes):
+            image = Path(image).read_bytes()
+        response = self.session.post(f"{self.url}/games/{game_id}/frames", data=image)
+        return response.status_code, response.json()
+
+    def game(self, game_id):
+        return self.session.get(f"{self.url}/games/{game_id}").json()
+
+    def metrics(self):
+        return self.session.get(f"{self.url}/metrics").json()
+
+    def close(self):
+        self.session.close()
+
+
+async def serve(detector: Detector, host=SERVER_HOST, port=SERVER_PORT, **kwargs):
+    server = GameServer(detector, **kwargs)
+    await server.start(host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serves the recognition of many chess games over HTTP.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--backend", default=DETECTOR_BACKEND, help="piece detection backend")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="processes running the board and grid detection")
+    parser.add_argument("--max-pending-frames", type=int, default=SERVER_MAX_PENDING_FRAMES)
+    parser.add_argument("--max-session-frames", type=int, default=SERVER_MAX_SESSION_FRAMES)
+    parser.add_argument("--batch-size", type=int, default=DETECTION_BATCH_SIZE, help="images sent to the detector in a single call")
+    parser.add_argument("--frame-store-slots", type=int, default=FRAME_STORE_SLOTS, help="shared memory slots for the frames in progress (0 to pickle them)")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(load_detector(args.backend), args.host, args.port, workers=args.workers,
+                          max_pending_frames=args.max_pending_frames, max_session_frames=args.max_session_frames,
+                          batch_size=args.batch_size, frame_store_slots=args.frame_store_slots))
+    except KeyboardInterrupt:
+        pass
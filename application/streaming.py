@@ -0,0 +1,148 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent))
+
+from application.pipeline import *
+
+def read_video_frames(source):
+    """
+    Reads the frames of a video file or camera.
+    source: path of the video file or index of the camera.
+    Yields: (frame index, frame).
+    """
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"[error] Could not open video '{source}'.")
+    try:
+        index = 0
+        while True:
+            success, frame = capture.read()
+            if not success:
+                break
+            yield index, frame
+            index += 1
+    finally:
+        capture.release()
+
+def write_video_from_images(image_paths, output_path, frames_per_image=10, fps=10, scale=1.0, blank_frames=0):
+    """
+    Writes a video showing each image for frames_per_image frames, used to test the streaming mode.
+    blank_frames: black frames written before the first image, like a camera started before the board is in view.
+    """
+    writer = None
+    try:
+        for image_path in image_paths:
+            img = load_image(str(image_path))
+            if scale != 1.0:
+                img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            if writer is None:
+                height, width = img.shape[:2]
+                writer = cv2.VideoWriter(str(output_path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+                for _ in range(blank_frames):
+                    writer.write(np.zeros_like(img))
+            for _ in range(frames_per_image):
+                writer.write(img)
+    finally:
+        if writer is not None:
+            writer.release()
+    print(f"[debug] Video saved to '{output_path}'.")
+
+
+class BoardChangeDetector:
+    """
+    Decides which video frames must go through the full recognition pipeline.
+    Each frame is warped to a small grayscale thumbnail of the board, using the corners found
+    on the first frame where they can be found (the frames before are skipped), and compared with
+    the previous one by the mean absolute pixel difference.
+    A frame is selected when the board has been stable for stable_frames frames and differs
+    from the last selected frame, i.e. once the hand that moved a piece leaves the board.
+    working_side: longest side of the downscaled copy of the first frame where the corners are searched,
+    or None to search them at full resolution, see locate_chessboard.
+    """
+    def __init__(self, corners=None, stable_frames=5, motion_threshold=4.0, change_threshold=2.0, thumbnail_size=128,
+                 working_side=PYRAMID_WORKING_SIDE):
+        self.thumbnail_size = thumbnail_size
+        self.working_side = working_side
+        self.transform = None
+        if corners is not None:
+            self.set_corners(corners)
+        self.stable_frames = stable_frames
+        self.motion_threshold = motion_threshold
+        self.change_threshold = change_threshold
+        self.previous = None
+        self.last_selected = None
+        self.stable_count = 0
+        self.stats = {"processed": 0, "skipped": 0}
+
+    def set_corners(self, corners):
+        size = self.thumbnail_size
+        dst_points = np.array([[0, 0], [size - 1, 0], [size - 1, size - 1], [0, size - 1]], dtype='float32')
+        self.transform = cv2.getPerspectiveTransform(np.asarray(corners, dtype='float32'), dst_points)
+
+    def find_corners(self, frame):
+        """Finds the board corners on the downscaled frame, or at full resolution if they are not found there."""
+        factor = 1.0 if self.working_side is None else min(1.0, self.working_side / max(frame.shape[:2]))
+        if factor < 1.0:
+            try:
+                corners = find_chessboard_corners(downscale(frame, factor), scale=self.working_side / REFERENCE_IMAGE_SIDE)
+                return (corners + 0.5) / factor - 0.5
+            except ValueError as error:
+                print(f"[debug] board corners not found on the downscaled frame ({error}), retrying at full resolution")
+        return find_chessboard_corners(frame)
+
+    def thumbnail(self, frame):
+        board = cv2.warpPerspective(frame, self.transform, (self.thumbnail_size, self.thumbnail_size))
+        gray = cv2.cvtColor(board, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(gray, (5, 5), 0).astype(np.float32)
+
+    def update(self, frame):
+        """Returns True if the frame must be processed. The board corners are searched until a frame shows them."""
+        if self.transform is None:
+            try:
+                self.set_corners(self.find_corners(frame))
+            except ValueError as error: # no board yet, or hidden by a hand
+                print(f"[debug] board corners not found ({error}), retrying on the next frame")
+                self.stats["skipped"] += 1
+                return False
+        current = self.thumbnail(frame)
+        if self.previous is not None and np.abs(current - self.previous).mean() < self.motion_threshold:
+            self.stable_count += 1
+        else:
+            self.stable_count = 0
+        self.previous = current
+
+        selected = (
+            self.stable_count >= self.stable_frames
+            and (self.last_selected is None or np.abs(current - self.last_selected).mean() >= self.change_threshold)
+        )
+        if selected:
+            self.last_selected = current
+            self.stats["processed"] += 1
+        else:
+            self.stats["skipped"] += 1
+        return selected
+
+    def report(self):
+        total = self.stats["processed"] + self.stats["skipped"]
+        print(f"[info] Video: {total} frames, {self.stats['processed']} processed, {self.stats['skipped']} skipped")
+
+
+def iter_video_board_matrices(source, detector: Detector, change_detector: BoardChangeDetector = None, tracker: BoardTracker = None,
+                              incremental: IncrementalDetector = None):
+    """
+    Generates the board matrix of each frame where the board changed and then stayed still.
+    source: path of the video file or index of the camera.
+    change_detector: BoardChangeDetector used to select the frames, keeps the processed/skipped counts.
+    tracker: BoardTracker used to reuse the board geometry between frames, or None.
+    incremental: IncrementalDetector used to detect only the cells that changed, or None.
+    Yields: (frame label, board matrix).
+    """
+    if change_detector is None:
+        change_detector = BoardChangeDetector()
+    for index, frame in read_video_frames(source):
+        if change_detector.update(frame):
+            print(f"[debug] Processing frame {index}")
+            profiler.start_frame(f"frame {index}")
+            debug_writer.start_frame(f"frame {index}")
+            chessboard_matrix, _, _, _ = generate_board_matrix(frame, detector, tracker, incremental)
+            yield f"frame {index}", chessboard_matrix
@@ -0,0 +1,214 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import os
+import queue
+import re
+import threading
+import time
+from multiprocessing.util import Finalize
+
+import cv2
+import numpy as np
+
+from application.config import DEBUG_MAX_PENDING, DEBUG_OVERLAY_SIDE, DEBUG_SHEET_THUMBNAIL_SIDE
+
+def render_overlay(img, commands, scale=1.0):
+    """
+    Draws the commands on a copy of the image.
+    commands: list of ("lines", [(x1, y1, x2, y2), ...]), ("points", points, radius, (b, g, r)) or ("boxes", predictions),
+    in the coordinates of img.
+    scale: size of the returned image over the size of img, the coordinates and thicknesses are scaled with it.
+    """
+    if scale != 1.0:
+        # the overlays are drawn after resizing, so a linear resize (about 20x faster than INTER_AREA) is enough
+        canvas = cv2.resize(img, (max(1, int(img.shape[1] * scale)), max(1, int(img.shape[0] * scale))), interpolation=cv2.INTER_LINEAR)
+    else:
+        canvas = img.copy()
+    if canvas.ndim == 2:
+        canvas = cv2.cvtColor(canvas, cv2.COLOR_GRAY2BGR)
+
+    def size(pixels):
+        return max(1, int(round(pixels * scale)))
+
+    def point(x, y):
+        return int(x * scale), int(y * scale)
+
+    for command in commands:
+        kind = command[0]
+        if kind == "lines":
+            for x1, y1, x2, y2 in command[1]:
+                cv2.line(canvas, point(x1, y1), point(x2, y2), (0, 255, 0), size(2))
+        elif kind == "points":
+            _, points, radius, color = command
+            for x, y in points:
+                cv2.circle(canvas, point(x, y), size(radius), color, -1)
+        elif kind == "boxes":
+            color = (0, 0, 255)
+            for bounding_box in command[1]:
+                x0 = bounding_box["x"] - bounding_box["width"] / 2
+                x1 = bounding_box["x"] + bounding_box["width"] / 2
+                y0 = bounding_box["y"] - bounding_box["height"] / 2
+                y1 = bounding_box["y"] + bounding_box["height"] / 2
+                cv2.rectangle(canvas, point(x0, y0), point(x1, y1), color=color, thickness=size(4))
+                cv2.circle(canvas, point(bounding_box["x"], bounding_box["y"]), size(10), color=(0, 255, 0), thickness=-1)
+                text = f"{bounding_box['confidence']:.2f} {bounding_box['class']}"
+                cv2.putText(canvas, text, (int(x0 * scale), int(y0 * scale) + size(25)), fontFace=cv2.FONT_HERSHEY_SIMPLEX,
+                            fontScale=max(0.3, scale), color=color, thickness=size(3))
+    return canvas
+
+def file_label(label):
+    """Turns a frame label (an image path, "frame 12"...) into a string usable in file names."""
+    return re.sub(r"[^\w.-]+", "_", Path(str(label)).stem) or "frame"
+
+class DebugWriter:
+    """
+    Renders the debug overlays (detected lines, intersections, grid points, bounding boxes) on a background
+    thread and writes them to disk, so the pipeline keeps running at full speed with the debug output on.
+    The pipeline only queues a reference to the image and its draw commands, which must not be modified
+    afterwards; when more than max_pending overlays are waiting the new ones are dropped instead of blocking.
+    Each overlay is written to output_directory/<game>/<frame>_<index>_<name>.jpg, downscaled to overlay_side
+    pixels on its longest side, or, with contact_sheet, added as a thumbnail to the contact sheet of the game,
+    one row per frame, written when the game changes and when the writer is disabled.
+    While disabled, overlays are ignored.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.queue = None
+        self.thread = None
+        self.game = "game"
+        self.frame = "frame"
+        self.index = 0
+        self.stats = {"queued": 0, "dropped": 0, "written": 0, "render_time": 0.0}
+
+    def enable(self, output_directory, contact_sheet=False, max_pending=DEBUG_MAX_PENDING, overlay_side=DEBUG_OVERLAY_SIDE,
+               thumbnail_side=DEBUG_SHEET_THUMBNAIL_SIDE, sheet_name="contact_sheet.jpg", game=None):
+        """
+        Starts the writer thread.
+        sheet_name: file name of the contact sheets, processes writing to the same directory need different names.
+        game: see start_game.
+        """
+        if self.enabled:
+            self.disable()
+        self.output_directory = Path(output_directory)
+        self.contact_sheet = contact_sheet
+        self.overlay_side = overlay_side
+        self.thumbnail_side = thumbnail_side
+        self.sheet_name = sheet_name
+        self.sheet = None # (game, rows of (frame, thumbnails))
+        if game is not None:
+            self.start_game(game)
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, name="debug-writer", daemon=True)
+        self.thread.start()
+        # pool workers don't run atexit handlers, but they do run the multiprocessing finalizers
+        self.finalizer = Finalize(self, self.disable, exitpriority=10)
+        self.enabled = True
+
+    def disable(self):
+        """Writes the overlays still queued and the contact sheet, then stops the writer thread."""
+        if not self.enabled:
+            return
+        self.enabled = False
+        # the thread may have died, in which case nobody would take the sentinel from a full queue
+        while self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.thread.join()
+        self.finalizer.cancel()
+        self.queue = self.thread = None
+
+    def settings(self):
+        """Returns: the arguments of enable, to enable the writer of another process the same way, or None if disabled."""
+        if not self.enabled:
+            return None
+        return {"output_directory": str(self.output_directory), "contact_sheet": self.contact_sheet,
+                "max_pending": self.queue.maxsize, "overlay_side": self.overlay_side, "thumbnail_side": self.thumbnail_side,
+                "game": self.game}
+
+    def start_game(self, game):
+        """Writes the overlays submitted next to the directory of the game, a path relative to the output directory."""
+        self.game = str(game)
+
+    def start_frame(self, label):
+        """Names the overlays submitted next after the frame."""
+        self.frame = file_label(label)
+        self.index = 0
+
+    def submit(self, name, img, commands=()):
+        """Queues an overlay of the current frame, or drops it if too many are waiting."""
+        if not self.enabled:
+            return
+        self.index += 1
+        try:
+            self.queue.put_nowait((self.game, self.frame, self.index, name, img, commands))
+            self.stats["queued"] += 1
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def _run(self):
+        # the overlays wait for the CPU left by the pipeline, and are dropped when they wait for too long;
+        # only Linux applies the priority to a single thread, elsewhere the writer keeps the normal priority
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError) as error:
+            print(f"[debug] could not lower the priority of the debug writer: {error}")
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self._render(*item)
+            except Exception as error: # a broken overlay must not stop the writer
+                print(f"[error] Could not write the debug overlay '{item[3]}' of frame '{item[1]}': {error}")
+        self._write_sheet()
+
+    def _render(self, game, frame, index, name, img, commands):
+        start = time.perf_counter()
+        side = self.thumbnail_side if self.contact_sheet else self.overlay_side
+        scale = min(1.0, side / max(img.shape[:2])) if side is not None else 1.0
+        overlay = render_overlay(img, commands, scale)
+        if self.contact_sheet:
+            if self.sheet is not None and self.sheet[0] != game:
+                self._write_sheet()
+            if self.sheet is None:
+                self.sheet = (game, [])
+            rows = self.sheet[1]
+            if not rows or rows[-1][0] != frame:
+                rows.append((frame, []))
+            cv2.putText(overlay, f"{frame} {name}", (4, 14), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+            rows[-1][1].append(overlay)
+        else:
+            directory = self.output_directory / game
+            directory.mkdir(parents=True, exist_ok=True)
+            cv2.imwrite(str(directory / f"{frame}_{index:02d}_{name}.jpg"), overlay)
+            self.stats["written"] += 1
+        self.stats["render_time"] += time.perf_counter() - start
+
+    def _write_sheet(self):
+        if self.sheet is None:
+            return
+        game, rows = self.sheet
+        self.sheet = None
+        side = self.thumbnail_side
+        columns = max(len(thumbnails) for _, thumbnails in rows)
+        sheet = np.zeros((side * len(rows), side * columns, 3), dtype=np.uint8)
+        for row, (_, thumbnails) in enumerate(rows):
+            for column, thumbnail in enumerate(thumbnails):
+                height, width = thumbnail.shape[:2]
+                sheet[row * side:row * side + height, column * side:column * side + width] = thumbnail
+        directory = self.output_directory / game
+        directory.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(directory / self.sheet_name), sheet)
+        self.stats["written"] += 1
+
+    def report(self):
+        print(f"[info] Debug overlays: {self.stats['queued']} queued, {self.stats['dropped']} dropped, "
+              f"{self.stats['written']} files written, {self.stats['render_time']:.2f} s rendering in the background")
+
+
+debug_writer = DebugWriter()
@@ -0,0 +1,133 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import os
+from collections import deque
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from application.config import FRAME_STORE_SLOTS, FRAME_STORE_SLOT_BYTES
+
+# Each slot header holds: frame id, number of dimensions and up to 3 dimensions of the uint8 array in the slot
+HEADER_FIELDS = 5
+SLOT_ALIGNMENT = 64
+SHARED_MEMORY_DIR = "/dev/shm"
+
+def shared_memory_slots(slots, slot_bytes=FRAME_STORE_SLOT_BYTES):
+    """
+    Returns: the number of slots, at most slots, that fit in the free space of the shared memory.
+    The segment is created sparse, so a store larger than /dev/shm (64 MB by default in Docker) would
+    only fail with a SIGBUS in the worker writing to a slot past its end.
+    """
+    if not os.path.isdir(SHARED_MEMORY_DIR):
+        return slots
+    stat = os.statvfs(SHARED_MEMORY_DIR)
+    # one slot of margin for the headers and the other segments of the machine
+    return max(0, min(slots, stat.f_bavail * stat.f_frsize // slot_bytes - 1))
+
+class FrameStore:
+    """
+    Fixed number of frame slots in a shared memory segment, so images go from a process to
+    another as NumPy views by frame id instead of being pickled.
+    Only the process that created the store allocates and releases frames; the other processes
+    attach to it by name (FrameStore.attach) and read or write the frames whose ids they received.
+    Frames are uint8 arrays (decoded images, or the encoded bytes of an image) of at most slot_bytes.
+    Released slots are reused first, so the pages of the segment that are actually touched stay
+    proportional to the frames in flight rather than to the number of slots.
+    """
+    def __init__(self, slots=FRAME_STORE_SLOTS, slot_bytes=FRAME_STORE_SLOT_BYTES, _shm=None):
+        self.owner = _shm is None
+        header_bytes = -(-(16 + slots * HEADER_FIELDS * 8) // SLOT_ALIGNMENT) * SLOT_ALIGNMENT
+        if self.owner:
+            _shm = shared_memory.SharedMemory(create=True, size=header_bytes + slots * slot_bytes)
+        self.shm = _shm
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.headers = np.ndarray((slots, HEADER_FIELDS), dtype=np.int64, buffer=self.shm.buf, offset=16)
+        self.data = np.ndarray((slots, slot_bytes), dtype=np.uint8, buffer=self.shm.buf, offset=header_bytes)
+        if self.owner:
+            np.ndarray((2,), dtype=np.int64, buffer=self.shm.buf)[:] = (slots, slot_bytes)
+            self.headers[:, 0] = -1
+            self.free = deque(range(slots))
+            self.generation = 0
+            self.stats = {"frames": 0, "bytes_written": 0, "peak_in_use": 0}
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Opens the store created by another process. Meant for its child processes, which share its resource
+        tracker, so the segment is removed by the owner (or by the tracker if the owner dies) and not when they exit.
+        """
+        shm = shared_memory.SharedMemory(name=name)
+        slots, slot_bytes = np.ndarray((2,), dtype=np.int64, buffer=shm.buf)
+        return cls(int(slots), int(slot_bytes), _shm=shm)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def allocate(self):
+        """Reserves a slot, returns the id of its new frame."""
+        if not self.free:
+            raise RuntimeError(f"All the {self.slots} slots of the frame store are in use.")
+        slot = self.free.popleft()
+        self.generation += 1
+        frame_id = self.generation * self.slots + slot
+        self.headers[slot] = (frame_id, 0, 0, 0, 0)
+        self.stats["frames"] += 1
+        self.stats["peak_in_use"] = max(self.stats["peak_in_use"], self.slots - len(self.free))
+        return frame_id
+
+    def release(self, frame_id):
+        """Frees the slot of a frame, its views must not be used anymore."""
+        slot = self._slot(frame_id)
+        self.headers[slot, 0] = -1
+        self.free.appendleft(slot)
+
+    def fits(self, shape):
+        return int(np.prod(shape)) <= self.slot_bytes
+
+    def new_view(self, frame_id, shape):
+        """Returns a writable uint8 array of the given shape on the slot of the frame, which becomes its content."""
+        if not 1 <= len(shape) <= 3 or not self.fits(shape):
+            raise ValueError(f"A frame of shape {tuple(shape)} doesn't fit a slot of {self.slot_bytes} bytes.")
+        slot = self._slot(frame_id)
+        self.headers[slot, 1:] = (len(shape), *shape, *[0] * (3 - len(shape)))
+        return self.data[slot, :int(np.prod(shape))].reshape(shape)
+
+    def put(self, frame_id, data):
+        """Copies an image (or the bytes of an encoded image) to the slot of the frame, returns its view."""
+        array = np.frombuffer(data, dtype=np.uint8) if isinstance(data, (bytes, bytearray, memoryview)) else data
+        view = self.new_view(frame_id, array.shape)
+        view[...] = array
+        if self.owner:
+            self.stats["bytes_written"] += array.nbytes
+        return view
+
+    def get(self, frame_id):
+        """Returns a read-only view of the content of the frame, without copying it."""
+        slot = self._slot(frame_id)
+        ndim = self.headers[slot, 1]
+        shape = tuple(int(size) for size in self.headers[slot, 2:2 + ndim])
+        view = self.data[slot, :int(np.prod(shape))].reshape(shape)
+        view.flags.writeable = False
+        return view
+
+    def holds(self, array):
+        """Tells whether an array is a view on this store."""
+        return np.may_share_memory(array, self.data)
+
+    def _slot(self, frame_id):
+        slot = frame_id % self.slots
+        if self.headers[slot, 0] != frame_id:
+            raise KeyError(f"Frame {frame_id} is not in the frame store anymore.")
+        return slot
+
+    def close(self):
+        """Closes the store in this process, the owner also removes the shared memory segment."""
+        self.headers = self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
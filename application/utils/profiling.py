@@ -0,0 +1,115 @@
+import functools
+import json
+import time
+from contextlib import contextmanager
+
+class Profiler:
+    """
+    Records the wall time and number of calls of each pipeline stage and data size metrics
+    (number of lines, intersections, ...) for each frame.
+    Every finished frame is written as a JSON line to the output file, if any, and added to the
+    totals shown by summary(). While disabled, stages and metrics are ignored.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.output = None
+        self.current = None
+        self.frames = 0
+        self.stages = {}
+        self.metrics = {}
+
+    def enable(self, output_path=None):
+        self.enabled = True
+        if output_path is not None:
+            self.output = open(output_path, "w")
+
+    def disable(self):
+        self.end_frame()
+        self.enabled = False
+        if self.output is not None:
+            self.output.close()
+            self.output = None
+
+    def start_frame(self, label):
+        if not self.enabled:
+            return
+        self.end_frame()
+        self.current = {"frame": str(label), "stages": {}, "metrics": {}}
+
+    def end_frame(self):
+        """Finishes the current frame and returns its record, or None if there is no frame open."""
+        record, self.current = self.current, None
+        if record is None:
+            return None
+        self.frames += 1
+        for name, stage in record["stages"].items():
+            self._add_stage(self.stages, name, stage["time"], stage["calls"])
+        for name, value in record["metrics"].items():
+            self.metrics[name] = self.metrics.get(name, 0) + value
+        if self.output is not None:
+            self.output.write(json.dumps(record) + "\n")
+            self.output.flush()
+        return record
+
+    def add_frame(self, record):
+        """Adds a frame recorded by another process, e.g. a pool worker, as the current frame."""
+        if not self.enabled or record is None:
+            return
+        self.end_frame()
+        self.current = record
+
+    def _add_stage(self, stages, name, seconds, calls=1):
+        stage = stages.setdefault(name, {"time": 0.0, "calls": 0})
+        stage["time"] += seconds
+        stage["calls"] += calls
+
+    def add_time(self, name, seconds):
+        self._add_stage(self.current["stages"] if self.current is not None else self.stages, name, seconds)
+
+    def record(self, name, value):
+        if not self.enabled:
+            return
+        metrics = self.current["metrics"] if self.current is not None else self.metrics
+        metrics[name] = metrics.get(name, 0) + value
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def summary(self):
+        if not self.enabled:
+            return
+        self.end_frame()
+        frames = max(self.frames, 1)
+        print("============ PROFILE SUMMARY ============")
+        print(f"{self.frames} frames")
+        for name, stage in sorted(self.stages.items(), key=lambda item: -item[1]["time"]):
+            print(f"{name:<24} {stage['time']:8.2f} s {stage['calls']:6d} calls {1000 * stage['time'] / frames:9.1f} ms/frame")
+        for name, value in self.metrics.items():
+            print(f"{name:<24} {value / frames:12.1f} per frame")
+        print("=========================================")
+
+
+profiler = Profiler()
+
+def profiled(stage_name):
+    """Decorator that records the time spent in the function as the given stage."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.add_time(stage_name, time.perf_counter() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,140 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent.parent))
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from application.config import *
+
+CACHE_FORMAT_VERSION = 1
+
+def write_json_atomically(path, data):
+    """Writes data as JSON to a temporary file and renames it to path, so readers never see a partial file."""
+    path = Path(path)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "w") as file:
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+def pipeline_parameters(detector_identifier, tracker=None, incremental=None):
+    """
+    Returns every parameter that changes the cached results.
+    detector_identifier: string identifying the detection model and its version.
+    tracker, incremental: the BoardTracker and IncrementalDetector used, if any, which reuse the geometry
+    and the predictions of previous frames, so their results are not the ones of a full detection.
+    """
+    return {
+        "version": CACHE_FORMAT_VERSION,
+        "canny_thresholds": list(CANNY_THRESHOLDS),
+        "hough_threshold": HOUGH_THRESHOLD,
+        "hough_min_line_length": HOUGH_MIN_LINE_LENGTH,
+        "hough_max_line_gap": HOUGH_MAX_LINE_GAP,
+        "grid_cluster_eps_divisor": GRID_CLUSTER_EPS_DIVISOR,
+        "grid_cluster_min_samples": GRID_CLUSTER_MIN_SAMPLES,
+        "merge_lines": MERGE_LINES,
+        "median_blur_size": MEDIAN_BLUR_SIZE,
+        "dilation_kernel_size": DILATION_KERNEL_SIZE,
+        "reference_image_side": REFERENCE_IMAGE_SIDE,
+        "pyramid_working_side": PYRAMID_WORKING_SIDE,
+        "single_pass_grid": [SINGLE_PASS_GRID, GRID_FIT_MIN_NODES, GRID_FIT_MAX_RESIDUAL],
+        "detector": detector_identifier,
+        "min_confidence": OBJECT_DETECTION_MIN_CONFIDENCE,
+        "min_overlap": OBJECT_DETECTION_MIN_OVERLAP,
+        "board_tracker": None if tracker is None else
+            [tracker.patch_size, tracker.search_margin, tracker.min_correlation, tracker.max_shift],
+        "incremental": None if incremental is None else
+            [incremental.change_threshold, incremental.max_changed_cells, incremental.thumbnail_size, incremental.context_cells],
+    }
+
+
+class ResultCache:
+    """
+    On-disk cache of the board geometry and detection results of an image.
+    Entries are JSON files named by the hash of the image content and of the pipeline parameters.
+    Writes are atomic (temporary file + rename), so several processes can share the same directory,
+    and the least recently used entries are evicted when the directory grows over max_bytes.
+    """
+    def __init__(self, directory=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def make_key(self, image_path, parameters):
+        digest = hashlib.sha256()
+        with open(image_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        digest.update(json.dumps(parameters, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return self.directory / f"{key}.json"
+
+    def get(self, key):
+        """
+        Returns the cached entry, a dict with "corners", "grid_points" and "predictions", or None.
+        """
+        path = self._entry_path(key)
+        try:
+            with open(path) as file:
+                entry = json.load(file)
+            os.utime(path)  # mark as recently used
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return entry
+
+    def put(self, key, corners, grid_points, predictions):
+        entry = {
+            "corners": [[float(x), float(y)] for x, y in corners],
+            "grid_points": [[float(x), float(y)] for x, y in grid_points],
+            "predictions": predictions,
+        }
+        write_json_atomically(self._entry_path(key), entry)
+        self.stats["writes"] += 1
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for path in self.directory.glob("*.json"):
+            try:
+                status = path.stat()
+            except FileNotFoundError:  # removed by another process
+                continue
+            entries.append((status.st_mtime, status.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                self.stats["evictions"] += 1
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        print(f"[info] Cache '{self.directory}' cleared.")
+
+    def report(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = 100 * self.stats["hits"] / lookups if lookups else 0
+        print(f"[info] Cache: {self.stats['hits']} hits, {self.stats['misses']} misses ({hit_rate:.0f}% hit rate), "
+              f"{self.stats['writes']} writes, {self.stats['evictions']} evictions")